@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class BluePrintConfig( AppConfig ):
+  name = 'contractor.BluePrint'
+
+  def ready( self ):
+    from contractor.tscript import parser
+    from contractor.tscript.cache import registerStore
+    from contractor.tscript.descent_parser import DescentParser
+    from contractor.BluePrint.models import CompiledScript
+
+    # with SCRIPT_CACHE_PERSIST off the stored scripts are still read, the jobs pickled with just the hash need them
+    registerStore( CompiledScript, getattr( settings, 'SCRIPT_CACHE_PERSIST', True ) )
+
+    if getattr( settings, 'SCRIPT_PARSER', 'peg' ) == 'descent':
+      parser.registerParser( DescentParser )
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BluePrint', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompiledScript',
+            fields=[
+                ('script_hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('ast', models.BinaryField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={'default_permissions': ()},
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('BluePrint', '0002_compiledscript'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compiledscript',
+            name='script',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='compiledscript',
+            name='ast_version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
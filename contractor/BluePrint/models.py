@@ -1,4 +1,8 @@
+import pickle
+import datetime
+
 from django.db import models
+from django.utils import timezone
 from django.db.models.signals import post_save, post_delete
 from django.core.exceptions import ValidationError
 
@@ -6,6 +10,7 @@ from cinp.orm_django import DjangoCInP as CInP
 
 from contractor.fields import MapField, StringListField, name_regex, config_name_regex
 from contractor.tscript import parser
+from contractor.tscript.cache import scriptHash
 from contractor.lib.config import getConfig
 from contractor.BluePrint.lib import validateTemplate
 from contractor.Records.lib import post_save_callback, post_delete_callback
@@ -222,6 +227,65 @@ class Script( models.Model ):
     return 'Script "{0}"({1})'.format( self.description, self.name )
 
 
+@cinp.model( not_allowed_verb_list=[ 'LIST', 'GET', 'CREATE', 'UPDATE', 'DELETE', 'CALL' ], hide_field_list=( 'ast', 'script' ) )
+class CompiledScript( models.Model ):
+  script_hash = models.CharField( max_length=64, primary_key=True )  # sha256 of the script text, see tscript.cache.scriptHash
+  script = models.TextField( editable=False, default='' )  # so the ast can be parsed again if the ast_version changes
+  ast = models.BinaryField( editable=False )
+  ast_version = models.IntegerField( editable=False, default=0 )  # parser.AST_VERSION the ast was made with
+  created = models.DateTimeField( editable=False, auto_now_add=True )
+
+  @staticmethod
+  def loadAST( script_hash ):
+    try:
+      compiled = CompiledScript.objects.get( pk=script_hash )
+    except CompiledScript.DoesNotExist:
+      return None
+
+    if compiled.ast_version == parser.AST_VERSION:
+      return pickle.loads( compiled.ast )
+
+    if not compiled.script:  # stored before the script was kept, nothing to parse again
+      return None
+
+    ast = parser.parse( compiled.script )
+    CompiledScript.saveAST( script_hash, compiled.script, ast )
+    return ast
+
+  @staticmethod
+  def saveAST( script_hash, script, ast ):
+    # the hash is of the script text, so if some other process beat us to it, what is there is the same as what we
+    # have, unless it is from an other ast_version, then it is replaced
+    CompiledScript.objects.bulk_create( [ CompiledScript( script_hash=script_hash, script=script, ast=pickle.dumps( ast, protocol=4 ), ast_version=parser.AST_VERSION ) ], update_conflicts=True, unique_fields=[ 'script_hash' ], update_fields=[ 'script', 'ast', 'ast_version' ] )
+
+  @staticmethod
+  def cleanup( min_age=datetime.timedelta( hours=1 ) ):
+    # removes the scripts no Script or Job is using, ones newer than min_age are left, the Job using
+    # it might not be saved yet, returns the number removed
+    from contractor.Foreman.models import BaseJob
+
+    job_hash_list = list( BaseJob.objects.values_list( 'script_hash', flat=True ).distinct() )
+    if '' in job_hash_list:  # jobs from before the hash was saved with them, there is no telling what they are using
+      return 0
+
+    keep_set = set( job_hash_list )
+    keep_set.update( scriptHash( script ) for script in Script.objects.values_list( 'script', flat=True ) )
+
+    stale_list = CompiledScript.objects.filter( created__lt=timezone.now() - min_age ).exclude( script_hash__in=keep_set ).values_list( 'script_hash', flat=True )
+    return CompiledScript.objects.filter( script_hash__in=list( stale_list ) ).delete()[0]
+
+  @cinp.check_auth()
+  @staticmethod
+  def checkAuth( user, verb, id_list, action=None ):
+    return cinp.basic_auth_check( user, verb, action, CompiledScript )
+
+  class Meta:
+    default_permissions = ()  # nothing
+
+  def __str__( self ):
+    return 'CompiledScript "{0}"'.format( self.script_hash )
+
+
 @cinp.model()
 class BluePrintScript( models.Model ):
   blueprint = models.ForeignKey( BluePrint, on_delete=models.CASCADE )
@@ -1,4 +1,16 @@
+import pytest
+import pickle
+import datetime
+
+from django.utils import timezone
+
+from contractor.Site.models import Site
+from contractor.Foreman.models import BaseJob
+from contractor.BluePrint.models import Script, CompiledScript
 from contractor.BluePrint.lib import validateTemplate
+from contractor.tscript import parser
+from contractor.tscript.parser import parse
+from contractor.tscript.cache import scriptHash
 
 
 def test_validate_template():
@@ -6,3 +18,56 @@ def test_validate_template():
   validation_template = {}
 
   validateTemplate( id_map, validation_template )
+
+
+@pytest.mark.django_db
+def test_compiled_script():
+  script = 'var = 1\nother = ( var + 2 )'
+  script_hash = scriptHash( script )
+  assert CompiledScript.loadAST( script_hash ) is None
+
+  CompiledScript.saveAST( script_hash, script, parse( script ) )
+  assert CompiledScript.loadAST( script_hash ) == parse( script )
+  CompiledScript.saveAST( script_hash, script, parse( script ) )  # some other process beat us to it
+  assert CompiledScript.objects.count() == 1
+
+  # from an other parser version, it is parsed again and saved
+  CompiledScript.objects.filter( pk=script_hash ).update( ast=pickle.dumps( 'old ast' ), ast_version=parser.AST_VERSION - 1 )
+  assert CompiledScript.loadAST( script_hash ) == parse( script )
+  compiled = CompiledScript.objects.get( pk=script_hash )
+  assert compiled.ast_version == parser.AST_VERSION
+  assert pickle.loads( compiled.ast ) == parse( script )
+
+  # stored before the script was kept
+  CompiledScript.objects.filter( pk=script_hash ).update( script='', ast_version=0 )
+  assert CompiledScript.loadAST( script_hash ) is None
+
+
+@pytest.mark.django_db
+def test_compiled_script_cleanup():
+  site = Site( name='test', description='test' )
+  site.full_clean()
+  site.save()
+
+  hash_map = {}
+  for name in ( 'blueprint', 'job', 'unused', 'new' ):
+    script = '{0} = 1'.format( name )
+    hash_map[ name ] = scriptHash( script )
+    CompiledScript.saveAST( hash_map[ name ], script, parse( script ) )
+
+  CompiledScript.objects.exclude( pk=hash_map[ 'new' ] ).update( created=timezone.now() - datetime.timedelta( days=1 ) )
+
+  Script( name='test', description='test', script='blueprint = 1' ).save()
+  job = BaseJob( site=site, state='queued', script_name='test', script_runner=b'' )
+  job.save()
+
+  assert CompiledScript.cleanup() == 0  # the job does not say which script it has
+  assert CompiledScript.objects.count() == 4
+
+  job.script_hash = hash_map[ 'job' ]
+  job.save()
+  assert CompiledScript.cleanup() == 1
+  assert set( CompiledScript.objects.values_list( 'script_hash', flat=True ) ) == set( [ hash_map[ 'blueprint' ], hash_map[ 'job' ], hash_map[ 'new' ] ] )
+
+  assert CompiledScript.cleanup( datetime.timedelta( 0 ) ) == 1
+  assert set( CompiledScript.objects.values_list( 'script_hash', flat=True ) ) == set( [ hash_map[ 'blueprint' ], hash_map[ 'job' ] ] )
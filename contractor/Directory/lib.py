@@ -1,32 +1,14 @@
 import os
 
 from django.conf import settings
+from django.db.models import Q, Max, Count
 
 from contractor.lib.ip import StrToIp, IpIsV4
-from contractor.Utilities.models import Networked
-from contractor.Directory.models import Entry
-
-TEMPLATES = {}
-TEMPLATES[ 'SOA' ] = """$TTL {ttl}
-$ORIGIN {zone}.
-@  IN SOA {master}. {email}. (
-            **ZONE_SERIAL**
-            {refresh}
-            {retry}
-            {expire}
-            {minimum}
-          )
-"""
-TEMPLATES[ 'NS' ] = '{name:<50} IN NS    {server}.'
-TEMPLATES[ 'MX' ] = '{name:<50} IN MX    {priority:>4} {target}'
-TEMPLATES[ 'A' ] = '{name:<50} IN A     {address}'
-TEMPLATES[ 'AAAA' ] = '{name:<50} IN AAAA  {address}'
-TEMPLATES[ 'PTR' ] = '{value:<50} IN PTR   {target}'
-TEMPLATES[ 'CNAME' ] = '{name:<50} IN CNAME {target}'
-TEMPLATES[ 'TXT' ] = '{name:<50} IN TXT   "{target}"'
-TEMPLATES[ 'RTXT' ] = '{value:<50} IN TXT   "{target}"'
-TEMPLATES[ 'SRV' ] = '{name:<50} IN SRV   {priority:>4} {weight:>4} {port:>5} {target}'
-TEMPLATES[ 'SIG' ] = '{name:<50} IN SIG   {sig}'
+from contractor.Site.models import Site
+from contractor.Building.models import Foundation, Structure
+from contractor.Utilities.models import Networked, Address, AddressBlock, NetworkAddressBlock, NetworkInterface, interfaceMap
+from contractor.Directory.models import Zone, Entry
+from contractor.Directory.render import TEMPLATES, ZONE_RECORD_ORDER, PTR_ZONE_RECORD_ORDER, renderZone
 
 MASTER_NS_NETWORKED = Networked.objects.get( pk=settings.BIND_NS_NETWORKED_LIST[0] )
 MASTER_NS_HOSTNAME = '{0}.{1}'.format( MASTER_NS_NETWORKED.primary_interface.name, MASTER_NS_NETWORKED.fqdn )
@@ -40,18 +22,6 @@ REVERSE_SOA = { 'ttl': 3600,
                 }
 
 
-def _render( rec_type, parms ):
-  if isinstance( parms, list ):
-    return ''.join( [ _render( rec_type, i ) for i in parms ] )
-
-  try:
-    template = TEMPLATES[ rec_type ]
-  except KeyError:
-    raise ValueError( 'Invalid Record Type "{0}"'.format( rec_type ) )
-
-  return template.format( **parms ) + '\n'
-
-
 def _address_name( address, site_list=None ):
   address_block = address.address_block
   if site_list is not None and address_block.site not in site_list:
@@ -74,50 +44,130 @@ def _address_name( address, site_list=None ):
   return result
 
 
-def _getNetworkedEntries( networked, site_list ):
-  networked = networked.subclass
-  result = { 'RTXT': [], 'PTR': [], 'TXT': [], 'A': [], 'CNAME': [] }
-
-  for address in networked.address_set.all():
-    full_name = _address_name( address, site_list )
-    if full_name is None:
-      continue
+def _networkedEntries( zone_fqdn, site_list, record_map ):
+  # the records for all the Networked in site_list (the sites of the zone
+  # zone_fqdn), in a fixed number of queries instead of a few per address
+  site_pk_list = [ site.pk for site in site_list ]
+  address_list = list( Address.objects.filter( networked__site__in=site_pk_list ).select_related( 'address_block', 'networked__structure__foundation' ) )
+  iface_map = interfaceMap( address_list )
 
-    ip_addr = networked.primary_address.ip_address
+  nab_map = {}  # ( address block pk, network pk ) -> vlan
+  for nab in NetworkAddressBlock.objects.filter( address_block__site__in=site_pk_list ):
+    nab_map[ ( nab.address_block_id, nab.network_id ) ] = nab.vlan
 
-    result[ 'RTXT' ].append( { 'value': ip_addr, 'target': '{0}.{1}'.format( full_name, networked.fqdn ) } )
-    result[ 'PTR' ].append( { 'value': ip_addr, 'target': networked.fqdn } )
-    result[ 'TXT' ].append( { 'name': '{0}.{1}'.format( full_name, networked.hostname ), 'target': networked.foundation.locator } )
-    if IpIsV4( StrToIp( ip_addr ) ):
-      result[ 'A' ].append( { 'name': '{0}.{1}'.format( full_name, networked.hostname ), 'address': ip_addr } )
-    else:
-      result[ 'AAAA' ].append( { 'name': '{0}.{1}'.format( full_name, networked.hostname ), 'address': ip_addr } )
+  primary_map = {}  # networked pk -> primary address
+  networked_map = {}  # networked pk -> address list
+  for address in address_list:
     if address.is_primary:
-      result[ 'CNAME' ].append( { 'name': networked.hostname, 'target': '{0}.{1}'.format( full_name, networked.hostname ) } )
+      primary_map[ address.networked_id ] = address
+
+    networked_map.setdefault( address.networked_id, [] ).append( address )
+
+  site_order = dict( ( site_pk, i ) for ( i, site_pk ) in enumerate( site_pk_list ) )
+  for networked_pk in sorted( networked_map.keys(), key=lambda pk: ( site_order[ networked_map[ pk ][0].networked.site_id ], networked_map[ pk ][0].networked.hostname ) ):
+    address_list = sorted( networked_map[ networked_pk ], key=lambda address: address.pk )
+    networked = address_list[0].networked.subclass
+    primary = primary_map.get( networked_pk, None )
+    fqdn = '{0}.{1}'.format( networked.hostname, zone_fqdn )
+
+    for address in address_list:
+      if address.address_block is None or address.address_block.site_id not in site_order:
+        continue
+
+      iface = iface_map.get( address.pk, None )
+      if iface is None:
+        continue
+
+      try:
+        vlan = nab_map[ ( address.address_block_id, iface.network_id ) ]
+      except KeyError:
+        continue
+
+      full_name = iface.name
+      if address.alias_index is not None:
+        full_name = '{0}-{1}'.format( full_name, address.alias_index )
+
+      if vlan:
+        full_name = 'v{0}.{1}'.format( vlan, full_name )
+
+      if primary is None:
+        continue
+
+      ip_addr = primary.ip_address
+
+      record_map[ 'RTXT' ].append( { 'value': ip_addr, 'target': '{0}.{1}'.format( full_name, fqdn ) } )
+      record_map[ 'PTR' ].append( { 'value': ip_addr, 'target': fqdn } )
+      record_map[ 'TXT' ].append( { 'name': '{0}.{1}'.format( full_name, networked.hostname ), 'target': networked.foundation.locator } )
+      if IpIsV4( StrToIp( ip_addr ) ):
+        record_map[ 'A' ].append( { 'name': '{0}.{1}'.format( full_name, networked.hostname ), 'address': ip_addr } )
+      else:
+        record_map[ 'AAAA' ].append( { 'name': '{0}.{1}'.format( full_name, networked.hostname ), 'address': ip_addr } )
+      if address.is_primary:
+        record_map[ 'CNAME' ].append( { 'name': networked.hostname, 'target': '{0}.{1}'.format( full_name, networked.hostname ) } )
+
+
+def getNSList():
+  # ( hostname, site pk, glue address, fqdn ) of each of BIND_NS_NETWORKED_LIST, get
+  # once and pass to genZone/genPtrZones, instead of every zone getting them again
+  result = []
+  for ns in settings.BIND_NS_NETWORKED_LIST:
+    networked = Networked.objects.get( pk=ns )
+    hostname = '{0}.{1}'.format( _address_name( networked.primary_address ), networked.fqdn )
+    result.append( ( hostname, networked.site_id, networked.primary_address.address.ip_address, networked.fqdn ) )
 
   return result
 
 
-def genZone( zone, ptr_list, rtext_list, zone_file_list ):
+def _check( query_set, field='updated' ):
+  result = query_set.aggregate( Max( field ), Count( 'pk', distinct=True ) )
+  return '{0}/{1}'.format( result[ field + '__max' ], result[ 'pk__count' ] )
+
+
+def zoneCheck( zone ):
+  # a JSON-able value that changes when anything genZone( zone ) uses changes,
+  # saved things bump the max updated, deleted things drop the count.  Networked
+  # has no updated, so the max pk is used for it.
+  ns_list = settings.BIND_NS_NETWORKED_LIST
+  structure_list = Structure.objects.filter( Q( site__zone=zone ) | Q( pk__in=ns_list ) )
+  foundation_list = structure_list.values( 'foundation' )
+  return [
+           settings.BIND_SOA_EMAIL,
+           MASTER_NS_HOSTNAME,
+           ','.join( str( i ) for i in ns_list ),
+           _check( Zone.objects.all() ),
+           _check( Site.objects.filter( Q( zone=zone ) | Q( networked__in=ns_list ) ) ),
+           _check( Networked.objects.filter( Q( site__zone=zone ) | Q( pk__in=ns_list ) ), 'pk' ),
+           _check( structure_list ),
+           _check( Foundation.objects.filter( pk__in=foundation_list ) ),
+           _check( Address.objects.filter( Q( networked__site__zone=zone ) | Q( networked__in=ns_list ) ) ),
+           _check( AddressBlock.objects.all() ),
+           _check( NetworkAddressBlock.objects.all() ),
+           _check( NetworkInterface.objects.filter( Q( realnetworkinterface__foundation__in=foundation_list ) | Q( abstractnetworkinterface__structure__in=structure_list ) ) ),
+           _check( Entry.objects.filter( Q( zone=zone ) | Q( zone__isnull=True ) ) )
+         ]
+
+
+def zoneRecords( zone, ptr_list, rtext_list, zone_file_list, ns_list=None ):
+  # returns ( filename, record_map ) of zone, render with
+  # renderZone( record_map, ZONE_RECORD_ORDER ).  The zone's PTR and RTXT
+  # records are added to ptr_list and rtext_list for ptrZoneRecords
+  if ns_list is None:
+    ns_list = getNSList()
+
   record_map = {}
   for rec_type in TEMPLATES.keys():
     record_map[ rec_type ] = []
 
   zone_fqdn = zone.fqdn
-  site_list = list( zone.site_set.all() )
+  site_list = list( zone.site_set.all().order_by( 'pk' ) )
+  site_pk_list = [ site.pk for site in site_list ]
 
-  for ns in settings.BIND_NS_NETWORKED_LIST:
-    networked = Networked.objects.get( pk=ns )
-    hostname = '{0}.{1}'.format( _address_name( networked.primary_address ), networked.fqdn )
+  for ( hostname, site_pk, glue_address, _ ) in ns_list:
     record_map[ 'NS' ].append( { 'name': '@', 'server': hostname } )
-    if networked.site not in site_list and hostname.endswith( zone_fqdn ):  # Add a glue record, when the server is not in this zone file AND in a parent of the zone it belonds too
-      record_map[ 'A' ].append( { 'name': hostname + '.', 'address': networked.primary_address.address.ip_address } )
+    if site_pk not in site_pk_list and hostname.endswith( zone_fqdn ):  # Add a glue record, when the server is not in this zone file AND in a parent of the zone it belonds too
+      record_map[ 'A' ].append( { 'name': hostname + '.', 'address': glue_address } )
 
-  for site in site_list:
-    for networked in site.networked_set.all():
-      entry_list = _getNetworkedEntries( networked, site_list )
-      for entry_type in entry_list.keys():
-        record_map[ entry_type ] += entry_list[ entry_type ]
+  _networkedEntries( zone_fqdn, site_list, record_map )
 
   for entry in zone.entry_set.all():
     record_map[ entry.type ].append( {
@@ -158,23 +208,33 @@ def genZone( zone, ptr_list, rtext_list, zone_file_list ):
   del record_map[ 'PTR' ]
   del record_map[ 'RTXT' ]
 
-  result = ''
-  for rec_type in ( 'SOA', 'NS', 'SIG', 'SRV', 'A', 'AAAA', 'CNAME', 'TXT' ):
-    result += _render( rec_type, record_map[ rec_type ] )  # TODO: Sort record map, and get rid of duplicates
-
   filename = '{0}.zone'.format( zone_fqdn )
 
   zone_file_list.append( ( filename, zone_fqdn ) )
 
-  return filename, result
+  return filename, record_map
+
+
+def genZone( zone, ptr_list, rtext_list, zone_file_list, ns_list=None ):
+  filename, record_map = zoneRecords( zone, ptr_list, rtext_list, zone_file_list, ns_list )
 
+  return filename, ''.join( renderZone( record_map, ZONE_RECORD_ORDER ) )
+
+
+def ptrZoneRecords( ptr_list, rtext_list, zone_file_list, ns_list=None ):
+  # generator of ( filename, record_map ) of the reverse zones for ptr_list
+  # and rtext_list, render with renderZone( record_map, PTR_ZONE_RECORD_ORDER )
+  if ns_list is None:
+    ns_list = getNSList()
 
-def genPtrZones( ptr_list, rtext_list, zone_file_list ):
   zone_ptr_map = {}
   zone_rtxt_map = {}
 
   for ptr in ptr_list:
     parts = ptr[ 'value' ].split( '.' )
+    if len( parts ) != 4:  # TODO: ip6.arpa zones
+      continue
+
     zone = '.'.join( reversed( parts[ :3 ] ) ) + '.in-addr.arpa'
     try:
       zone_ptr_map[ zone ].append( { 'value': parts[3], 'target': ptr[ 'target' ] + '.' } )
@@ -183,32 +243,36 @@ def genPtrZones( ptr_list, rtext_list, zone_file_list ):
 
   for rtext in rtext_list:
     parts = rtext[ 'value' ].split( '.' )
+    if len( parts ) != 4:
+      continue
+
     zone = '.'.join( reversed( parts[ :3 ] ) ) + '.in-addr.arpa'
     try:
       zone_rtxt_map[ zone ].append( { 'value': parts[3], 'target': rtext[ 'target' ] } )
     except KeyError:
       zone_rtxt_map[ zone ] = [ { 'value': parts[3], 'target': rtext[ 'target' ] } ]
 
-  for zone in set( list( zone_ptr_map.keys() ) + list( zone_rtxt_map.keys() ) ):
+  for zone in sorted( set( list( zone_ptr_map.keys() ) + list( zone_rtxt_map.keys() ) ) ):
     record_map = { 'NS': [] }
     record_map[ 'SOA' ] = REVERSE_SOA.copy()
     record_map[ 'SOA' ][ 'zone' ] = zone
 
-    for ns in settings.BIND_NS_NETWORKED_LIST:
-      record_map[ 'NS' ].append( { 'name': '@', 'server': Networked.objects.get( pk=ns ).fqdn } )
+    for ( _, _, _, fqdn ) in ns_list:
+      record_map[ 'NS' ].append( { 'name': '@', 'server': fqdn } )
 
     record_map[ 'PTR' ] = zone_ptr_map.get( zone, [] )
     record_map[ 'RTXT' ] = zone_rtxt_map.get( zone, [] )
 
-    result = ''
-    for rec_type in ( 'SOA', 'NS', 'PTR', 'RTXT' ):
-      result += _render( rec_type, record_map[ rec_type ] )  # TODO: Sort record map
-
     filename = '{0}.zone'.format( zone )
 
     zone_file_list.append( ( filename, zone ) )
 
-    yield filename, result
+    yield filename, record_map
+
+
+def genPtrZones( ptr_list, rtext_list, zone_file_list, ns_list=None ):
+  for filename, record_map in ptrZoneRecords( ptr_list, rtext_list, zone_file_list, ns_list ):
+    yield filename, ''.join( renderZone( record_map, PTR_ZONE_RECORD_ORDER ) )
 
 
 def genMasterFile( zone_dir, zone_file_list ):
@@ -0,0 +1,265 @@
+import json
+import importlib
+import pytest
+
+from contractor.Site.models import Site
+from contractor.BluePrint.models import FoundationBluePrint, StructureBluePrint
+from contractor.Building.models import Foundation, Structure
+from contractor.Utilities.models import Network, AddressBlock, NetworkAddressBlock, Address, RealNetworkInterface
+from contractor.Directory.models import Zone, Entry
+
+
+def _structure( site, fb, sb, name, interface_list ):
+  f = Foundation( locator='f{0}'.format( name ), site=site, blueprint=fb )
+  f.full_clean()
+  f.save()
+
+  for ( iface_name, network ) in interface_list:
+    iface = RealNetworkInterface( foundation=f, name=iface_name, physical_location=iface_name, network=network )
+    iface.full_clean()
+    iface.save()
+
+  st = Structure( hostname='s{0}'.format( name ), foundation=f, blueprint=sb, site=site )
+  st.full_clean()
+  st.save()
+
+  return st
+
+
+def _address( structure, address_block, offset, interface_name, is_primary=False, alias_index=None ):
+  addr = Address( networked=structure, address_block=address_block, offset=offset, interface_name=interface_name, is_primary=is_primary, alias_index=alias_index )
+  addr.full_clean()
+  addr.save()
+
+  return addr
+
+
+def _network( site, name, subnet, prefix, vlan=0 ):
+  n = Network( name=name, site=site )
+  n.full_clean()
+  n.save()
+
+  ab = AddressBlock( site=site, name=name, subnet=subnet, prefix=prefix )
+  ab.full_clean()
+  ab.save()
+
+  nab = NetworkAddressBlock( network=n, address_block=ab, vlan=vlan )
+  nab.full_clean()
+  nab.save()
+
+  return n, ab
+
+
+def _lib( settings, ns ):
+  # lib looks up the master NS when it is imported, so it has to be (re)loaded
+  # after the NS is in the db
+  settings.BIND_NS_NETWORKED_LIST = [ ns.pk ]
+  from contractor.Directory import lib
+  return importlib.reload( lib )
+
+
+def _oldNetworkedEntries( lib, zone ):
+  # the per address way genZone used to get the Networked records
+  site_list = list( zone.site_set.all() )
+  result = { 'RTXT': [], 'PTR': [], 'TXT': [], 'A': [], 'AAAA': [], 'CNAME': [] }
+  for site in site_list:
+    for networked in site.networked_set.all():
+      networked = networked.subclass
+      for address in networked.address_set.all():
+        full_name = lib._address_name( address, site_list )
+        if full_name is None:
+          continue
+
+        ip_addr = networked.primary_address.ip_address
+        name = '{0}.{1}'.format( full_name, networked.hostname )
+        result[ 'RTXT' ].append( { 'value': ip_addr, 'target': '{0}.{1}'.format( full_name, networked.fqdn ) } )
+        result[ 'PTR' ].append( { 'value': ip_addr, 'target': networked.fqdn } )
+        result[ 'TXT' ].append( { 'name': name, 'target': networked.foundation.locator } )
+        result[ 'A' if '.' in ip_addr else 'AAAA' ].append( { 'name': name, 'address': ip_addr } )
+        if address.is_primary:
+          result[ 'CNAME' ].append( { 'name': networked.hostname, 'target': name } )
+
+  return result
+
+
+def _sorted( record_list ):
+  return sorted( record_list, key=repr )
+
+
+@pytest.fixture
+def zone_site():
+  fb = FoundationBluePrint( name='fdnb1', description='Foundation BluePrint 1', foundation_type_list=[ 'Unknown' ] )
+  fb.full_clean()
+  fb.save()
+
+  sb = StructureBluePrint( name='strb1', description='Structure BluePrint 1' )
+  sb.full_clean()
+  sb.save()
+  sb.foundation_blueprint_list.add( fb )
+
+  zone = Zone( name='test' )
+  zone.full_clean()
+  zone.save()
+
+  sub_zone = Zone( name='sub', parent=zone )
+  sub_zone.full_clean()
+  sub_zone.save()
+
+  ns_site = Site( name='nssite', description='ns site', zone=sub_zone )
+  ns_site.full_clean()
+  ns_site.save()
+
+  ns_net, ns_ab = _network( ns_site, 'nsnet', '10.0.0.0', 24 )
+  ns = _structure( ns_site, fb, sb, 'ns', [ ( 'eth0', ns_net ) ] )
+  _address( ns, ns_ab, 53, 'eth0', True )
+
+  site = Site( name='site1', description='test site1', zone=zone )
+  site.full_clean()
+  site.save()
+
+  net1, ab1 = _network( site, 'net1', '10.0.1.0', 24, 10 )
+  net6, ab6 = _network( site, 'net6', '2001:db8::', 64 )
+
+  st1 = _structure( site, fb, sb, 1, [ ( 'eth0', net1 ), ( 'eth1', net6 ) ] )
+  _address( st1, ab1, 10, 'eth0', True )
+  _address( st1, ab1, 11, 'eth0', alias_index=1 )
+  _address( st1, ab6, 16, 'eth1' )
+
+  st2 = _structure( site, fb, sb, 2, [ ( 'eth0', net6 ) ] )
+  _address( st2, ab6, 32, 'eth0', True )
+
+  for ( entry_zone, rec_type, name, target ) in ( ( zone, 'MX', 'mail', 'mx' ), ( None, 'CNAME', 's1', 'other' ), ( None, 'TXT', 'global', 'here' ) ):
+    entry = Entry( zone=entry_zone, type=rec_type, name=name, priority=10 if rec_type == 'MX' else None, target=target )
+    entry.full_clean()
+    entry.save()
+
+  return { 'zone': zone, 'sub_zone': sub_zone, 'site': site, 'ns': ns, 'fb': fb, 'sb': sb, 'net1': net1, 'ab1': ab1, 'st1': st1 }
+
+
+@pytest.mark.django_db
+def test_zone_records( settings, zone_site ):
+  lib = _lib( settings, zone_site[ 'ns' ] )
+  zone = zone_site[ 'zone' ]
+
+  ns_list = lib.getNSList()
+  assert ns_list == [ ( 'eth0.sns.sub.test', zone_site[ 'ns' ].site.pk, '10.0.0.53', 'sns.sub.test' ) ]
+
+  ptr_list = []
+  rtext_list = []
+  zone_file_list = []
+  filename, record_map = lib.zoneRecords( zone, ptr_list, rtext_list, zone_file_list, ns_list )
+  assert filename == 'test.zone'
+  assert zone_file_list == [ ( 'test.zone', 'test' ) ]
+  assert 'PTR' not in record_map
+  assert 'RTXT' not in record_map
+  assert record_map[ 'SOA' ][0][ 'zone' ] == 'test'
+  assert record_map[ 'SOA' ][0][ 'master' ] == 'eth0.sns.sub.test'
+
+  old = _oldNetworkedEntries( lib, zone )
+  assert _sorted( ptr_list ) == _sorted( old[ 'PTR' ] )
+  assert _sorted( rtext_list ) == _sorted( old[ 'RTXT' ] )
+  assert _sorted( record_map[ 'TXT' ] ) == _sorted( old[ 'TXT' ] + [ { 'name': 'global', 'priority': None, 'weight': None, 'port': None, 'target': 'here' } ] )
+  assert _sorted( record_map[ 'AAAA' ] ) == _sorted( old[ 'AAAA' ] )
+  assert _sorted( record_map[ 'CNAME' ] ) == _sorted( old[ 'CNAME' ] )  # the global s1 CNAME is dropped, s1 allready has one
+  glue = { 'name': 'eth0.sns.sub.test.', 'address': '10.0.0.53' }
+  assert _sorted( record_map[ 'A' ] ) == _sorted( old[ 'A' ] + [ glue ] )
+  assert record_map[ 'NS' ] == [ { 'name': '@', 'server': 'eth0.sns.sub.test' } ]
+  assert record_map[ 'MX' ] == [ { 'name': 'mail', 'priority': 10, 'weight': None, 'port': None, 'target': 'mx' } ]
+
+  assert _sorted( record_map[ 'A' ] ) == _sorted( [ glue, { 'name': 'v10.eth0.s1', 'address': '10.0.1.10' }, { 'name': 'v10.eth0-1.s1', 'address': '10.0.1.10' }, { 'name': 'eth1.s1', 'address': '10.0.1.10' } ] )
+  assert record_map[ 'AAAA' ] == [ { 'name': 'eth0.s2', 'address': '2001:db8::20' } ]
+  assert _sorted( record_map[ 'CNAME' ] ) == _sorted( [ { 'name': 's1', 'target': 'v10.eth0.s1' }, { 'name': 's2', 'target': 'eth0.s2' } ] )
+
+  # the NS is in the sub zone's sites, so no glue there
+  _, record_map = lib.zoneRecords( zone_site[ 'sub_zone' ], [], [], [], ns_list )
+  assert record_map[ 'A' ] == [ { 'name': 'eth0.sns', 'address': '10.0.0.53' } ]
+  assert record_map[ 'NS' ] == [ { 'name': '@', 'server': 'eth0.sns.sub.test' } ]
+
+
+@pytest.mark.django_db
+def test_zone_records_skipped( settings, zone_site ):
+  lib = _lib( settings, zone_site[ 'ns' ] )
+  zone = zone_site[ 'zone' ]
+  site = zone_site[ 'site' ]
+
+  _, expected = lib.zoneRecords( zone, [], [], [] )
+
+  net2 = Network( name='net2', site=site )
+  net2.full_clean()
+  net2.save()
+
+  st3 = _structure( site, zone_site[ 'fb' ], zone_site[ 'sb' ], 3, [ ( 'eth0', net2 ) ] )
+  _address( st3, zone_site[ 'ab1' ], 30, 'eth0', True )  # net2 is not in ab1
+
+  st4 = _structure( site, zone_site[ 'fb' ], zone_site[ 'sb' ], 4, [ ( 'eth0', zone_site[ 'net1' ] ) ] )
+  _address( st4, zone_site[ 'ab1' ], 40, 'eth0' )  # no primary
+
+  st5 = _structure( site, zone_site[ 'fb' ], zone_site[ 'sb' ], 5, [ ( 'eth0', zone_site[ 'net1' ] ) ] )
+  _address( st5, zone_site[ 'ab1' ], 50, 'eth5', True )  # no such interface
+
+  ptr_list = []
+  _, record_map = lib.zoneRecords( zone, ptr_list, [], [] )
+  assert record_map == expected
+  assert all( ptr[ 'target' ] in ( 's1.test', 's2.test' ) for ptr in ptr_list )
+
+
+@pytest.mark.django_db
+def test_zone_check( settings, zone_site ):
+  lib = _lib( settings, zone_site[ 'ns' ] )
+  zone = zone_site[ 'zone' ]
+  st1 = zone_site[ 'st1' ]
+
+  check = lib.zoneCheck( zone )
+  assert json.loads( json.dumps( check ) ) == check  # genDNS keeps it in a JSON cache
+  assert lib.zoneCheck( zone ) == check
+
+  lib.zoneRecords( zone, [], [], [] )  # generating does not change anything
+  assert lib.zoneCheck( zone ) == check
+
+  def changed():
+    nonlocal check
+    new_check = lib.zoneCheck( zone )
+    result = new_check != check
+    check = new_check
+    return result
+
+  address = _address( st1, zone_site[ 'ab1' ], 12, 'eth0', alias_index=2 )
+  assert changed()
+  address.offset = 13
+  address.full_clean()
+  address.save()
+  assert changed()
+  address.delete()
+  assert changed()
+  assert not changed()
+
+  entry = Entry( zone=zone, type='TXT', name='info', target='stuff' )
+  entry.full_clean()
+  entry.save()
+  assert changed()
+  entry.target = 'other stuff'
+  entry.full_clean()
+  entry.save()
+  assert changed()
+  entry.delete()
+  assert changed()
+
+  entry = Entry( zone=None, type='TXT', name='info', target='stuff' )  # global entries are in every zone
+  entry.full_clean()
+  entry.save()
+  assert changed()
+
+  st1.hostname = 'renamed'
+  st1.full_clean()
+  st1.save()
+  assert changed()
+
+  ns = Structure.objects.get( pk=zone_site[ 'ns' ].pk )  # the NS is in an other zone, but is in this one's NS/glue
+  ns.hostname = 'ns2'
+  ns.full_clean()
+  ns.save()
+  assert changed()
+
+  st1.delete()
+  assert changed()
+  assert not changed()
@@ -0,0 +1,121 @@
+import os
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# turning the record maps from Directory.lib into zone files, nothing in here
+# touches django or the database, so it can run in worker processes that have
+# not done django.setup
+
+TEMPLATES = {}
+TEMPLATES[ 'SOA' ] = """$TTL {ttl}
+$ORIGIN {zone}.
+@  IN SOA {master}. {email}. (
+            **ZONE_SERIAL**
+            {refresh}
+            {retry}
+            {expire}
+            {minimum}
+          )
+"""
+TEMPLATES[ 'NS' ] = '{name:<50} IN NS    {server}.'
+TEMPLATES[ 'MX' ] = '{name:<50} IN MX    {priority:>4} {target}'
+TEMPLATES[ 'A' ] = '{name:<50} IN A     {address}'
+TEMPLATES[ 'AAAA' ] = '{name:<50} IN AAAA  {address}'
+TEMPLATES[ 'PTR' ] = '{value:<50} IN PTR   {target}'
+TEMPLATES[ 'CNAME' ] = '{name:<50} IN CNAME {target}'
+TEMPLATES[ 'TXT' ] = '{name:<50} IN TXT   "{target}"'
+TEMPLATES[ 'RTXT' ] = '{value:<50} IN TXT   "{target}"'
+TEMPLATES[ 'SRV' ] = '{name:<50} IN SRV   {priority:>4} {weight:>4} {port:>5} {target}'
+TEMPLATES[ 'SIG' ] = '{name:<50} IN SIG   {sig}'
+
+ZONE_RECORD_ORDER = ( 'SOA', 'NS', 'SIG', 'SRV', 'A', 'AAAA', 'CNAME', 'TXT' )
+PTR_ZONE_RECORD_ORDER = ( 'SOA', 'NS', 'PTR', 'RTXT' )
+
+SERIAL_PLACEHOLDER = '**ZONE_SERIAL**'
+
+
+def _render( rec_type, parms ):
+  if isinstance( parms, list ):
+    return ''.join( [ _render( rec_type, i ) for i in parms ] )
+
+  try:
+    template = TEMPLATES[ rec_type ]
+  except KeyError:
+    raise ValueError( 'Invalid Record Type "{0}"'.format( rec_type ) )
+
+  return template.format( **parms ) + '\n'
+
+
+def renderZone( record_map, rec_type_list ):
+  # generator of the zone file text, one record type at a time, the records of
+  # each type are sorted and duplicates dropped, so the same records make the
+  # same file no matter what order they were collected in
+  for rec_type in rec_type_list:
+    parms = record_map.get( rec_type, [] )
+    if not isinstance( parms, list ):
+      yield _render( rec_type, parms )
+      continue
+
+    line_list = sorted( set( _render( rec_type, i ) for i in parms ) )
+    if line_list:
+      yield ''.join( line_list )
+
+
+def writeZone( filename, record_map, rec_type_list, old_hash, serial ):
+  # streams the zone to a temp file next to filename, hashing as it goes, the
+  # hash is of the text before the serial is filled in.  The temp file replaces
+  # filename only if the hash is not old_hash, returns ( hash, written )
+  hasher = hashlib.sha256()
+  fd, tmp_filename = tempfile.mkstemp( dir=os.path.dirname( filename ), prefix='.', suffix='.tmp' )
+  try:
+    with os.fdopen( fd, 'w' ) as fp:
+      for chunk in renderZone( record_map, rec_type_list ):
+        hasher.update( chunk.encode() )
+        fp.write( chunk.replace( SERIAL_PLACEHOLDER, serial ) )
+
+    hash = hasher.hexdigest()
+    if hash == old_hash and os.path.exists( filename ):
+      os.unlink( tmp_filename )
+      return ( hash, False )
+
+    os.chmod( tmp_filename, 0o644 )
+    os.replace( tmp_filename, filename )
+
+  except Exception:
+    if os.path.exists( tmp_filename ):
+      os.unlink( tmp_filename )
+    raise
+
+  return ( hash, True )
+
+
+def writeZones( zone_dir, zone_iterator, hash_map, serial, workers=0 ):
+  # zone_iterator is of ( filename, record_map, rec_type_list ), hash_map is
+  # filename -> hash of the last written file, and is updated.  With workers
+  # the zones are rendered and written in that many processes, while
+  # zone_iterator is still collecting the next zones.  Returns the list of the
+  # filenames that were (re)written
+  result = []
+  if not workers:
+    for ( filename, record_map, rec_type_list ) in zone_iterator:
+      ( hash, written ) = writeZone( os.path.join( zone_dir, filename ), record_map, rec_type_list, hash_map.get( filename, None ), serial )
+      hash_map[ filename ] = hash
+      if written:
+        result.append( filename )
+
+    return result
+
+  future_list = []
+  with ProcessPoolExecutor( max_workers=workers, mp_context=multiprocessing.get_context( 'spawn' ) ) as pool:  # spawn, the caller has open db connections
+    for ( filename, record_map, rec_type_list ) in zone_iterator:
+      future_list.append( ( filename, pool.submit( writeZone, os.path.join( zone_dir, filename ), record_map, rec_type_list, hash_map.get( filename, None ), serial ) ) )
+
+    for ( filename, future ) in future_list:
+      ( hash, written ) = future.result()
+      hash_map[ filename ] = hash
+      if written:
+        result.append( filename )
+
+  return result
@@ -0,0 +1,89 @@
+import os
+
+from contractor.Directory.render import ZONE_RECORD_ORDER, PTR_ZONE_RECORD_ORDER, renderZone, writeZone, writeZones
+
+SOA = { 'zone': 'test', 'master': 'ns.test', 'ttl': 3600, 'email': 'hostmaster.test', 'refresh': 1, 'retry': 2, 'expire': 3, 'minimum': 4 }
+
+
+def _record_map():
+  return {
+           'SOA': [ SOA ],
+           'NS': [ { 'name': '@', 'server': 'ns.test' } ],
+           'A': [ { 'name': 'b', 'address': '10.0.0.2' }, { 'name': 'a', 'address': '10.0.0.1' }, { 'name': 'b', 'address': '10.0.0.2' } ],
+           'CNAME': [],
+           'TXT': [ { 'name': 'a', 'target': 'loc1' } ]
+         }
+
+
+def test_render():
+  txt = ''.join( renderZone( _record_map(), ZONE_RECORD_ORDER ) )
+  assert txt == """$TTL 3600
+$ORIGIN test.
+@  IN SOA ns.test. hostmaster.test. (
+            **ZONE_SERIAL**
+            1
+            2
+            3
+            4
+          )
+
+@                                                  IN NS    ns.test.
+a                                                  IN A     10.0.0.1
+b                                                  IN A     10.0.0.2
+a                                                  IN TXT   "loc1"
+"""
+
+  record_map = _record_map()
+  record_map[ 'A' ].reverse()
+  assert ''.join( renderZone( record_map, ZONE_RECORD_ORDER ) ) == txt
+
+  record_map = { 'SOA': dict( SOA ), 'NS': [], 'PTR': [ { 'value': '2', 'target': 'b.test.' }, { 'value': '1', 'target': 'a.test.' } ], 'RTXT': [] }
+  assert list( renderZone( record_map, PTR_ZONE_RECORD_ORDER ) )[ 1: ] == [ '1                                                  IN PTR   a.test.\n2                                                  IN PTR   b.test.\n' ]
+
+
+def test_write( tmp_path ):
+  filename = str( tmp_path / 'test.zone' )
+
+  ( hash, written ) = writeZone( filename, _record_map(), ZONE_RECORD_ORDER, None, '1234' )
+  assert written is True
+  txt = open( filename, 'r' ).read()
+  assert '**ZONE_SERIAL**' not in txt
+  assert '            1234\n' in txt
+
+  assert writeZone( filename, _record_map(), ZONE_RECORD_ORDER, hash, '5678' ) == ( hash, False )
+  assert open( filename, 'r' ).read() == txt  # not re-written, serial not changed
+
+  record_map = _record_map()
+  record_map[ 'A' ].append( { 'name': 'c', 'address': '10.0.0.3' } )
+  ( hash2, written ) = writeZone( filename, record_map, ZONE_RECORD_ORDER, hash, '5678' )
+  assert written is True
+  assert hash2 != hash
+  assert '            5678\n' in open( filename, 'r' ).read()
+
+  os.unlink( filename )
+  assert writeZone( filename, record_map, ZONE_RECORD_ORDER, hash2, '5678' ) == ( hash2, True )  # missing file is written
+
+  assert os.listdir( str( tmp_path ) ) == [ 'test.zone' ]  # no temp files left behind
+
+
+def test_write_zones( tmp_path ):
+  zone_list = []
+  for i in range( 0, 5 ):
+    record_map = _record_map()
+    record_map[ 'SOA' ] = [ dict( SOA, zone='test{0}'.format( i ) ) ]
+    zone_list.append( ( 'test{0}.zone'.format( i ), record_map, ZONE_RECORD_ORDER ) )
+
+  serial_dir = tmp_path / 'serial'
+  serial_dir.mkdir()
+  pool_dir = tmp_path / 'pool'
+  pool_dir.mkdir()
+
+  serial_hash_map = {}
+  pool_hash_map = {}
+  assert writeZones( str( serial_dir ), iter( zone_list ), serial_hash_map, '1' ) == [ i[0] for i in zone_list ]
+  assert writeZones( str( pool_dir ), iter( zone_list ), pool_hash_map, '1', workers=2 ) == [ i[0] for i in zone_list ]
+  assert serial_hash_map == pool_hash_map
+  for ( filename, _, _ ) in zone_list:
+    assert open( str( serial_dir / filename ) ).read() == open( str( pool_dir / filename ) ).read()
+
+  assert writeZones( str( pool_dir ), iter( zone_list ), pool_hash_map, '2', workers=2 ) == []
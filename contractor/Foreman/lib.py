@@ -1,12 +1,22 @@
 import pickle
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import close_old_connections
+from django.utils import timezone
 
 from contractor.Building.models import Foundation, Structure, Dependency
 from contractor.Foreman.runner_plugins.building import ConfigPlugin, FoundationPlugin, ROFoundationPlugin, StructurePlugin, ROStructurePlugin, SignalingPlugin
-from contractor.Foreman.models import BaseJob, FoundationJob, StructureJob, DependencyJob, JobLog, ForemanException
+from contractor.Foreman.models import BaseJob, FoundationJob, StructureJob, DependencyJob, JobLog, DispatchTask, ForemanException
 from contractor.PostOffice.lib import registerEvent
 
-from contractor.tscript.parser import parse
+from contractor.tscript.cache import getAST, scriptHash
 from contractor.tscript.runner import Runner, Pause, ExecutionError, UnrecoverableError, ParamaterError, NotDefinedError, ScriptError
 
 
@@ -42,6 +52,14 @@ RUNNER_MODULE_LIST = []
 JOB_LOOKUP_MAP = { 'Foundation': 'foundationjob', 'Structure': 'structurejob', 'Dependency': 'dependencyjob' }
 DEPENDENCY_LOOKUP_MAP = { 'Foundation': ( 'dependency', ), 'Structure': ( 'foundation', ), 'Dependency': ( 'structure', 'dependency' ) }
 
+# so BaseJob.realJob (and the job's target for can_start/done) come back with the job, with out a query per job type
+REAL_JOB_RELATED_LIST = ( 'foundationjob', 'structurejob', 'dependencyjob' )
+JOB_TARGET_RELATED_LIST = ( 'foundationjob__foundation', 'structurejob__structure__foundation', 'dependencyjob__dependency__structure', 'dependencyjob__dependency__dependency', 'dependencyjob__dependency__foundation', 'dependencyjob__dependency__script_structure' )
+JOB_SAVE_FIELD_LIST = ( 'state', 'status', 'message', 'script_runner', 'updated' )
+
+_step_pool = None
+_step_pool_lock = threading.Lock()
+
 
 def _target_class( target ):
   if isinstance( target, Foundation ):
@@ -155,7 +173,8 @@ def createJob( script_name, target, creator ):
   if script is None:
     script = '# empty place holder'
 
-  runner = Runner( parse( script ) )
+  script_hash = scriptHash( script )
+  runner = Runner( getAST( script, script_hash ), script_hash, getattr( settings, 'SCRIPT_OPTIMIZE', False ) )
   for module in RUNNER_MODULE_LIST:
     runner.registerModule( module )
 
@@ -167,6 +186,7 @@ def createJob( script_name, target, creator ):
 
   job.state = 'waiting'
   job.script_name = script_name
+  job.script_hash = script_hash
   job.script_runner = pickle.dumps( runner )
   job.full_clean()
   job.save()
@@ -174,6 +194,13 @@ def createJob( script_name, target, creator ):
   runner = pickle.loads( job.script_runner )
   runner.registerObject( SignalingPlugin( target, job ) )  # this is special it needs the pk, which is after the save
   job.script_runner = pickle.dumps( runner )
+
+  # not an error, they could be in a branch that is never taken, but most likely a typo or a missing plugin
+  unknown_list = runner.unknownReferences()
+  if unknown_list:
+    job.message = 'Unknown references: {0}'.format( ', '.join( '"{1}" on line {0}'.format( *i ) for i in unknown_list ) )[ 0:1024 ]
+    logging.warning( 'job {0} script "{1}" has unknown references: {2}'.format( job.pk, script_name, unknown_list ) )
+
   job.full_clean()
   job.save()
 
@@ -182,10 +209,164 @@ def createJob( script_name, target, creator ):
   return job.pk
 
 
+def _runJob( runner ):
+  # returns ( state, message ), message is None if it is not changing
+  try:
+    return ( 'queued', runner.run() )
+
+  except Pause as e:
+    return ( 'paused', str( e )[ 0:1024 ] )
+
+  except ExecutionError as e:
+    return ( 'error', str( e )[ 0:1024 ] )
+
+  except ( UnrecoverableError, ParamaterError, NotDefinedError, ScriptError ) as e:
+    return ( 'aborted', str( e )[ 0:1024 ] )
+
+  except Exception as e:
+    return ( 'aborted', 'Unknown Runtime Exception ({0}): "{1}"'.format( type( e ).__name__, str( e ) )[ 0:1024 ] )
+
+
+def _loadRunner( script_runner ):
+  # returns ( runner, message ), runner is None if it can not be loaded, the
+  # runners pickled with just the script hash need the stored script to still be there,
+  # and one saved part way through an expression can not go on if the script compiles differently now
+  try:
+    return ( pickle.loads( script_runner ), None )
+
+  except ( KeyError, UnrecoverableError, ValueError ) as e:
+    return ( None, 'Unable to load the job script: {0}'.format( str( e ) )[ 0:1024 ] )
+
+
+def _stepJob( script_runner ):
+  # runs in the step pool, returns ( state, message, status, script_runner ),
+  # status and script_runner are None if the runner was not run
+  close_old_connections()
+  try:
+    ( runner, message ) = _loadRunner( script_runner )
+    if runner is None:
+      return ( 'aborted', message, None, None )
+
+    if runner.aborted:
+      return ( 'aborted', None, None, None )
+
+    if runner.done:
+      return ( 'done', None, None, None )
+
+    ( state, message ) = _runJob( runner )
+
+    return ( state, message, runner.status, pickle.dumps( runner ) )
+
+  finally:
+    close_old_connections()
+
+
+def _stepPool():
+  global _step_pool
+
+  with _step_pool_lock:
+    if _step_pool is None:
+      context = multiprocessing.get_context( 'spawn' )  # spawn, forking a process with open db connections and threads is asking for trouble, the workers get DJANGO_SETTINGS_MODULE from our environment
+      python = getattr( settings, 'FOREMAN_STEP_PYTHON', None )
+      if python:  # spawn starts sys.executable, under mod_wsgi that is apache, not python
+        context.set_executable( python )
+
+      _step_pool = ProcessPoolExecutor( max_workers=settings.FOREMAN_STEP_WORKERS, mp_context=context, initializer=django.setup )
+
+    return _step_pool
+
+
+def _resetStepPool():
+  global _step_pool
+
+  with _step_pool_lock:
+    if _step_pool is not None:
+      _step_pool.shutdown( wait=False )
+
+    _step_pool = None
+
+
+def _dispatchJob( job, runner, module_list, results ):
+  task = runner.toSubcontractor( module_list )
+  if task is not None:
+    task.update( { 'job_id': job.pk } )
+    results.append( task )
+
+    return True
+
+  return False
+
+
+def _processJobsSerial( job_iterator, module_list, max_jobs, results, save_list ):
+  for job in job_iterator:
+    save_list.append( job )
+    ( runner, message ) = _loadRunner( job.script_runner )
+    if runner is None:
+      job.state = 'aborted'
+      job.message = message
+      continue
+
+    if runner.aborted:
+      job.state = 'aborted'
+      continue
+
+    if runner.done:
+      job.state = 'done'
+      continue
+
+    ( job.state, message ) = _runJob( runner )
+    if message is not None:
+      job.message = message
+
+    if job.state == 'queued':
+      _dispatchJob( job, runner, module_list, results )
+
+    job.status = runner.status
+    job.script_runner = pickle.dumps( runner )
+
+    if max_jobs is not None and len( results ) >= max_jobs:
+      break
+
+
+def _processJobsPool( job_iterator, module_list, max_jobs, results, save_list ):
+  # all the queued jobs are stepped, the remote tasks are handed out in the
+  # same order as _processJobsSerial, up to max_jobs, the rest will be picked up
+  # next time, same as the jobs _processJobsSerial did not get to.
+  # max_jobs of None is no limit
+  job_list = list( job_iterator )
+  try:
+    step_list = list( _stepPool().map( _stepJob, [ job.script_runner for job in job_list ] ) )
+  except BrokenProcessPool:
+    _resetStepPool()
+    raise
+
+  for ( job, ( state, message, status, script_runner ) ) in zip( job_list, step_list ):
+    save_list.append( job )
+    job.state = state
+    if message is not None:
+      job.message = message
+
+    if script_runner is None:
+      continue
+
+    job.status = status
+    job.script_runner = script_runner
+
+    if job.state == 'queued' and ( max_jobs is None or len( results ) < max_jobs ):
+      runner = pickle.loads( script_runner )
+      if _dispatchJob( job, runner, module_list, results ):
+        job.status = runner.status
+        job.script_runner = pickle.dumps( runner )
+
+
 def processJobs( site, module_list, max_jobs=10 ):
   if max_jobs > 100:
     max_jobs = 100
 
+  return _processJobs( site, module_list, max_jobs )
+
+
+def _processJobs( site, module_list, max_jobs ):
   # how to know if something can just be located, for now, if it has a complex and the complex is up and running
   # then we can auto locate.  The question is, should we go back to the foundation haveing a can_auto_locate
   # flag again, do we need that kind of detail?
@@ -202,17 +383,20 @@ def processJobs( site, module_list, max_jobs=10 ):
         foundation.setLocated()
 
   # start waiting jobs
-  for job in BaseJob.objects.select_for_update().filter( site=site, state='waiting' ):
+  started_list = []
+  for job in BaseJob.objects.select_for_update( of=( 'self', ) ).select_related( *JOB_TARGET_RELATED_LIST ).filter( site=site, state='waiting' ):
     job = job.realJob
     if job.can_start:
-      job.state = 'queued'
-      job.full_clean()
-      job.save()
+      started_list.append( job.pk )
 
-      JobLog.started( job )
+  if started_list:
+    now = timezone.now()
+    BaseJob.objects.filter( pk__in=started_list ).update( state='queued', updated=now )
+    JobLog.startedList( started_list, now )
 
   # clean up completed jobs
-  for job in BaseJob.objects.select_for_update().filter( site=site, state='done' ):
+  finished_list = []
+  for job in BaseJob.objects.select_for_update( of=( 'self', ) ).select_related( *JOB_TARGET_RELATED_LIST ).filter( site=site, state='done' ):
     job = job.realJob
     job.done()
     if isinstance( job, StructureJob ):
@@ -221,64 +405,53 @@ def processJobs( site, module_list, max_jobs=10 ):
     elif isinstance( job, FoundationJob ):
       registerEvent( job.foundation, job=job )
 
-    JobLog.finished( job )
+    finished_list.append( job.pk )
 
-    job.delete()
+  if finished_list:
+    JobLog.finishedList( finished_list, timezone.now() )
+    BaseJob.objects.filter( pk__in=finished_list ).delete()
 
   # iterate over the curent jobs
   results = []
-  for job in BaseJob.objects.select_for_update().filter( site=site, state='queued' ).order_by( 'updated' ):
-    job = job.realJob
-    runner = pickle.loads( job.script_runner )
+  save_list = []
+  job_iterator = ( job.realJob for job in BaseJob.objects.select_for_update( of=( 'self', ) ).select_related( *REAL_JOB_RELATED_LIST ).filter( site=site, state='queued' ).order_by( 'updated' ) )
+  if getattr( settings, 'FOREMAN_STEP_WORKERS', 0 ):
+    _processJobsPool( job_iterator, module_list, max_jobs, results, save_list )
+  else:
+    _processJobsSerial( job_iterator, module_list, max_jobs, results, save_list )
 
-    if runner.aborted:
-      job.state = 'aborted'
-      job.full_clean()
-      job.save()
-      continue
+  now = timezone.now()
+  for job in save_list:
+    job.updated = now  # bulk_update skips auto_now
+    job.full_clean( validate_unique=False )  # nothing unique is changing, and checking costs a query per job
 
-    if runner.done:
-      job.state = 'done'
-      job.full_clean()
-      job.save()
-      continue
+  BaseJob.objects.bulk_update( save_list, JOB_SAVE_FIELD_LIST )
 
-    try:
-      msg = runner.run()
-      if msg is not None:
-        job.message = msg
+  return results
 
-    except Pause as e:
-      job.state = 'paused'
-      job.message = str( e )[ 0:1024 ]
 
-    except ExecutionError as e:
-      job.state = 'error'
-      job.message = str( e )[ 0:1024 ]
+def scheduleJobs( site ):
+  # for the scheduler, advances all the site's jobs, and queues up what is
+  # ready for subcontractor, for any module, to be handed out by dispatchJobs
+  task_list = _processJobs( site, None, None )
+  DispatchTask.objects.bulk_create( [ DispatchTask( job_id=task[ 'job_id' ], site=site, module=task[ 'module' ], task=task ) for task in task_list ] )
 
-    except ( UnrecoverableError, ParamaterError, NotDefinedError, ScriptError ) as e:
-      job.state = 'aborted'
-      job.message = str( e )[ 0:1024 ]
+  return len( task_list )
 
-    except Exception as e:
-      job.state = 'aborted'
-      job.message = 'Unknown Runtime Exception ({0}): "{1}"'.format( type( e ).__name__, str( e ) )[ 0:1024 ]
 
-    if job.state == 'queued':
-      task = runner.toSubcontractor( module_list )
-      if task is not None:
-        task.update( { 'job_id': job.pk } )
-        results.append( task )
+def dispatchJobs( site, module_list, max_jobs=10 ):
+  # hands out the tasks the scheduler has queued up, oldest first, skip_locked
+  # so simultaneous polls don't wait on each other or get the same task
+  if max_jobs > 100:
+    max_jobs = 100
 
-    job.status = runner.status
-    job.script_runner = pickle.dumps( runner )
-    job.full_clean()
-    job.save()
+  task_list = list( DispatchTask.objects.select_for_update( skip_locked=True, of=( 'self', ) ).filter( site=site, module__in=module_list, job__state='queued' ).order_by( 'pk' )[ :max_jobs ] )
+  if not task_list:
+    return []
 
-    if len( results ) >= max_jobs:
-      break
+  DispatchTask.objects.filter( pk__in=[ task.pk for task in task_list ] ).delete()
 
-  return results
+  return [ task.task for task in task_list ]
 
 
 # TODO: we will need some kind of job record locking, so only one thing can happen at a time, ie: rolling back when things are still comming in,
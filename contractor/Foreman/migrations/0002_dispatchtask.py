@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import contractor.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Site', '0001_initial'),
+        ('Foreman', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DispatchTask',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('module', models.CharField(max_length=40)),
+                ('task', contractor.fields.JSONField(default={})),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('job', models.ForeignKey(editable=False, to='Foreman.BaseJob', on_delete=models.CASCADE)),
+                ('site', models.ForeignKey(editable=False, to='Site.Site', on_delete=models.CASCADE)),
+            ],
+            options={'default_permissions': ()},
+        ),
+        migrations.AddIndex(
+            model_name='dispatchtask',
+            index=models.Index(fields=['site', 'module'], name='Foreman_dis_site_id_e8e131_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Foreman', '0002_dispatchtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basejob',
+            name='script_hash',
+            field=models.CharField(default='', editable=False, max_length=64),
+        ),
+    ]
@@ -39,6 +39,7 @@ class BaseJob( models.Model ):
   message = models.CharField( max_length=1024, default='', blank=True )  # messages can come from Script (Pause/___Error/Exception), Plugin (fromSubcontractor jobResults/jobError), PXE Image postMessage/signalAlert
   script_runner = models.BinaryField( editable=False )
   script_name = models.CharField( max_length=40, editable=False, default=False )
+  script_hash = models.CharField( max_length=64, editable=False, default='' )  # of the script the job is running, see BluePrint.CompiledScript.cleanup
   updated = models.DateTimeField( editable=False, auto_now=True )
   created = models.DateTimeField( editable=False, auto_now_add=True )
 
@@ -110,6 +111,7 @@ class BaseJob( models.Model ):
     runner.clearDispatched()
     self.status = runner.status
     self.script_runner = pickle.dumps( runner, protocol=PICKLE_PROTOCOL )
+    DispatchTask.clearJob( self )
 
     self.state = 'queued'
     self.full_clean()
@@ -133,6 +135,7 @@ class BaseJob( models.Model ):
 
     self.status = runner.status
     self.script_runner = pickle.dumps( runner, protocol=PICKLE_PROTOCOL )
+    DispatchTask.clearJob( self )
     self.state = 'queued'
     self.full_clean()
     self.save()
@@ -153,6 +156,7 @@ class BaseJob( models.Model ):
     runner.clearDispatched()
     self.status = runner.status
     self.script_runner = pickle.dumps( runner, protocol=PICKLE_PROTOCOL )
+    DispatchTask.clearJob( self )
 
     self.full_clean()
     self.save()
@@ -602,6 +606,31 @@ class DependencyJob( BaseJob ):
     return 'DependencyJob #{0} for "{1}" in "{2}"'.format( self.pk, self.dependency.pk, self.dependency.site.pk )
 
 
+@cinp.model( not_allowed_verb_list=[ 'LIST', 'GET', 'CREATE', 'UPDATE', 'DELETE', 'CALL' ], hide_field_list=( 'task', ) )
+class DispatchTask( models.Model ):  # tasks the scheduler has taken from the job runners, waiting for subcontractor to pick them up
+  job = models.ForeignKey( BaseJob, editable=False, on_delete=models.CASCADE )
+  site = models.ForeignKey( Site, editable=False, on_delete=models.CASCADE )
+  module = models.CharField( max_length=40 )
+  task = JSONField( default={} )
+  created = models.DateTimeField( editable=False, auto_now_add=True )
+
+  @staticmethod
+  def clearJob( job ):  # the job's runner is not waiting on these any more (ie: clearDispatched), so they must not go out
+    DispatchTask.objects.filter( job=job ).delete()
+
+  @cinp.check_auth()
+  @staticmethod
+  def checkAuth( user, verb, id_list, action=None ):
+    return cinp.basic_auth_check( user, verb, action, DispatchTask )
+
+  class Meta:
+    default_permissions = ()  # nothing
+    indexes = [ models.Index( fields=[ 'site', 'module' ] ) ]
+
+  def __str__( self ):
+    return 'DispatchTask #{0} for job #{1}'.format( self.pk, self.job_id )
+
+
 @cinp.model( not_allowed_verb_list=[ 'CREATE', 'UPDATE', 'DELETE', 'CALL' ] )
 class JobLog( models.Model ):
   site = models.ForeignKey( Site, on_delete=models.CASCADE )
@@ -664,6 +693,14 @@ class JobLog( models.Model ):
     log.full_clean()
     log.save()
 
+  @classmethod
+  def startedList( cls, job_id_list, now ):
+    JobLog.objects.filter( job_id__in=job_id_list ).update( started_at=now, updated=now )
+
+  @classmethod
+  def finishedList( cls, job_id_list, now ):
+    JobLog.objects.filter( job_id__in=job_id_list ).update( finished_at=now, updated=now )
+
   @classmethod
   def canceled( cls, job, by ):
     log = JobLog.objects.get( job_id=job.pk )
@@ -1,11 +1,54 @@
+import copy
+import threading
+from collections import OrderedDict
+
 from contractor.fields import config_name_regex
-from contractor.lib.config import getConfig
+from contractor.lib.config import getConfig, getConfigValues, configLastModified
 from contractor.tscript.runner import ParamaterError, Interrupt
 
+CONFIG_CACHE_SIZE = 500
+
+# merged config_values, keyed by ( class name, pk ) of the target, along with
+# the '__last_modified' of the target when they were merged.  As long as
+# configLastModified( target ) returns the same value, the blueprints, sites and
+# config_values have not changed and the merge can be skipped.
+_config_cache = OrderedDict()
+_config_cache_lock = threading.Lock()
+
+# bumped every time a script changes config_values, so ConfigPlugins in this
+# process know to re-load their snapshot
+_config_generation = 0
+
+
+def _cachedConfig( target ):
+  key = ( target.__class__.__name__, target.pk )
+  last_modified = configLastModified( target )
+
+  with _config_cache_lock:
+    try:
+      ( cached_last_modified, value_config ) = _config_cache[ key ]
+      _config_cache.move_to_end( key )
+    except KeyError:
+      cached_last_modified = None
 
-def getWrapper( target, key ):  # TODO: find a way to make this less expensive, mabey something that can detect if the target has changed, without calling getConfig
-  config = getConfig( target )
-  return config[ key ]
+  if cached_last_modified != last_modified:
+    value_config = getConfigValues( target )
+    with _config_cache_lock:
+      _config_cache[ key ] = ( last_modified, value_config )
+      _config_cache.move_to_end( key )
+      while len( _config_cache ) > CONFIG_CACHE_SIZE:
+        _config_cache.popitem( last=False )
+
+  return getConfig( target, value_config )
+
+
+def clearConfigCache():
+  with _config_cache_lock:
+    _config_cache.clear()
+
+
+def getWrapper( plugin, key ):
+  return copy.deepcopy( plugin.config[ key ] )  # the snapshot is shared by all the reads in this pass, and with the cache, don't let the script modify it
 
 
 class SetConfig( object ):
@@ -45,7 +88,10 @@ class SetConfig( object ):
     config_values[ name ] = value
 
     self.structure.full_clean()
-    self.structure.save( update_fields=[ 'config_values' ] )
+    self.structure.save( update_fields=[ 'config_values', 'updated' ] )  # updated so the '__last_modified' moves and cached configs are re-merged
+
+    global _config_generation
+    _config_generation += 1
 
 
 class ConfigPlugin( object ):
@@ -56,18 +102,41 @@ class ConfigPlugin( object ):
     if isinstance( target, tuple ):
       self.target_class = target[0]
       self.target_pk = target[1]
-      self.target = self.target_class.objects.get( pk=self.target_pk )
+      self._target = None
 
     else:
-      self.target = target.subclass
-      self.target_class = self.target.__class__
-      self.target_pk = self.target.pk
+      self._target = target.subclass
+      self.target_class = self._target.__class__
+      self.target_pk = self._target.pk
+
+    self._config = None
+    self._config_generation = None
+
+  @property
+  def target( self ):  # loaded when first used, so un-pickling a job's runner dosen't cost a query per plugin
+    if self._target is None:
+      self._target = self.target_class.objects.get( pk=self.target_pk )
+
+    return self._target
+
+  @property
+  def config( self ):  # snapshot of the target's config, the plugin is re-created each time the job's runner is un-pickled, so this is good for one run of the job
+    if self._config_generation != _config_generation:
+      if self._config is not None:  # something in this process changed config_values, the target is stale too
+        self._target = None
+
+      self._config = None
+      self._config_generation = _config_generation
+
+    if self._config is None:
+      self._config = _cachedConfig( self.target )
+
+    return self._config
 
   def getValues( self ):
-    config = getConfig( self.target )
     result = {}
-    for key in config:
-      result[ key ] = ( lambda key=key: getWrapper( self.target, key ), None )
+    for key in self.config:
+      result[ key ] = ( lambda key=key: getWrapper( self, key ), None )
 
     return result
 
@@ -90,16 +159,23 @@ class FoundationPlugin( object ):  # TODO: really should have the RO version be
     if isinstance( foundation, tuple ):
       self.foundation_class = foundation[0]
       self.foundation_pk = foundation[1]
-      self.foundation = self.foundation_class.objects.get( pk=self.foundation_pk )
+      self._foundation = None
 
     else:
-      self.foundation = foundation.subclass
-      self.foundation_class = self.foundation.__class__
-      self.foundation_pk = self.foundation.pk
+      self._foundation = foundation.subclass
+      self.foundation_class = self._foundation.__class__
+      self.foundation_pk = self._foundation.pk
 
     self.value_map = self.foundation_class.getTscriptValues( write )
     self.function_map = self.foundation_class.getTscriptFunctions()
 
+  @property
+  def foundation( self ):  # see ConfigPlugin.target
+    if self._foundation is None:
+      self._foundation = self.foundation_class.objects.get( pk=self.foundation_pk )
+
+    return self._foundation
+
   def _setValue( self, name, val ):
     setter = self.value_map[ name ][1]
     setter( self.foundation, val )
@@ -153,12 +229,19 @@ class StructurePlugin( object ):  # ie: structure with some settable attributes,
     if isinstance( structure, tuple ):
       self.structure_class = structure[0]
       self.structure_pk = structure[1]
-      self.structure = self.structure_class.objects.get( pk=self.structure_pk )
+      self._structure = None
 
     else:
-      self.structure = structure
-      self.structure_class = self.structure.__class__
-      self.structure_pk = self.structure.pk
+      self._structure = structure
+      self.structure_class = self._structure.__class__
+      self.structure_pk = self._structure.pk
+
+  @property
+  def structure( self ):  # see ConfigPlugin.target
+    if self._structure is None:
+      self._structure = self.structure_class.objects.get( pk=self.structure_pk )
+
+    return self._structure
 
   def getValues( self ):
     result = {}
@@ -1,12 +1,18 @@
 import pytest
 
-from contractor.Foreman.runner_plugins.building import SetConfig
+from contractor.Foreman.runner_plugins.building import SetConfig, ConfigPlugin, clearConfigCache
 from contractor.tscript.runner import ParamaterError
 
 
 class fakeStructure():
-  def __init__( self, config_map ):
+  def __init__( self, config_map, pk=1 ):
     self.config_values = config_map
+    self.pk = pk
+    self.updated = 1
+
+  @property
+  def subclass( self ):
+    return self
 
   def full_clean( self ):
     pass
@@ -88,3 +94,89 @@ def test_setconfig():
   sc = SetConfig( s )
   sc( 'a.a|d', 4 )
   assert s.config_values == { 'a': { 'a|d': 4 }, 'b': 10 }
+
+
+class fakeStructureClass():
+  def __init__( self, structure ):
+    self.objects = self
+    self.structure = structure
+
+  def get( self, pk ):
+    assert pk == self.structure.pk
+    return self.structure
+
+
+@pytest.fixture
+def fake_config( mocker ):
+  clearConfigCache()
+  counts = { 'last_modified': 0, 'values': 0, 'config': 0 }
+
+  def configLastModified( target ):
+    counts[ 'last_modified' ] += 1
+    return target.updated
+
+  def getConfigValues( target ):
+    counts[ 'values' ] += 1
+    result = dict( target.config_values )
+    result[ '__last_modified' ] = target.updated
+    return result
+
+  def getConfig( target, value_config ):
+    counts[ 'config' ] += 1
+    result = dict( value_config )
+    result[ '_structure_id' ] = target.pk
+    return result
+
+  mocker.patch( 'contractor.Foreman.runner_plugins.building.configLastModified', configLastModified )
+  mocker.patch( 'contractor.Foreman.runner_plugins.building.getConfigValues', getConfigValues )
+  mocker.patch( 'contractor.Foreman.runner_plugins.building.getConfig', getConfig )
+  yield counts
+  clearConfigCache()
+
+
+def test_config_snapshot( fake_config ):
+  s = fakeStructure( { 'aa': 2, 'bb': { 'cc': 10 } } )
+  plugin = ConfigPlugin( s )
+  value_map = plugin.getValues()
+  assert sorted( value_map.keys() ) == [ '__last_modified', '_structure_id', 'aa', 'bb' ]
+  for _ in range( 0, 30 ):
+    assert value_map[ 'aa' ][0]() == 2
+    assert value_map[ 'bb' ][0]() == { 'cc': 10 }
+
+  assert fake_config == { 'last_modified': 1, 'values': 1, 'config': 1 }
+
+  value_map[ 'bb' ][0]()[ 'cc' ] = 20  # the script gets a copy
+  assert value_map[ 'bb' ][0]() == { 'cc': 10 }
+
+  plugin = ConfigPlugin( s )  # next run of the job, nothing changed
+  value_map = plugin.getValues()
+  assert value_map[ 'aa' ][0]() == 2
+  assert fake_config == { 'last_modified': 2, 'values': 1, 'config': 2 }
+
+  s.config_values[ 'aa' ] = 3
+  s.updated = 2
+  plugin = ConfigPlugin( s )
+  value_map = plugin.getValues()
+  assert value_map[ 'aa' ][0]() == 3
+  assert fake_config == { 'last_modified': 3, 'values': 2, 'config': 3 }
+
+  s2 = fakeStructure( { 'aa': 5 }, pk=2 )
+  plugin = ConfigPlugin( s2 )
+  assert plugin.getValues()[ 'aa' ][0]() == 5
+  assert fake_config == { 'last_modified': 4, 'values': 3, 'config': 4 }
+
+
+def test_config_set_config( fake_config ):
+  s = fakeStructure( { 'aa': 2 } )
+  plugin = ConfigPlugin( s )
+  value_map = plugin.getValues()
+  assert value_map[ 'aa' ][0]() == 2
+  assert value_map[ 'aa' ][0]() == 2
+  assert fake_config[ 'config' ] == 1
+
+  s.updated = 2  # normally done by the save
+  SetConfig( s )( 'aa', 4 )
+  plugin.target_class = fakeStructureClass( s )
+  assert value_map[ 'aa' ][0]() == 4
+  assert fake_config[ 'config' ] == 2
+  assert fake_config[ 'values' ] == 2
@@ -1,3 +1,4 @@
+import sys
 import pytest
 import pickle
 import time
@@ -7,12 +8,14 @@ from django.db import transaction
 
 from contractor.tscript.parser import parse
 from contractor.tscript.runner import Runner
+from contractor.tscript.cache import getAST, scriptHash, clearCache
 from contractor.Site.models import Site
-from contractor.Foreman.models import BaseJob  # , FoundationJob, StructureJob, DependencyJob
+from contractor.Foreman.models import BaseJob, JobLog, DispatchTask  # , FoundationJob, StructureJob, DependencyJob
 from contractor.Building.models import Foundation, Structure, Dependency
-from contractor.BluePrint.models import StructureBluePrint, FoundationBluePrint  # , BluePrintScript, Script
+from contractor.BluePrint.models import StructureBluePrint, FoundationBluePrint, CompiledScript, BluePrintScript, Script
 
-from contractor.Foreman.lib import processJobs, jobResults, createJob
+from contractor.Foreman.lib import processJobs, scheduleJobs, dispatchJobs, jobResults, createJob, _stepJob, _resetStepPool
+from contractor.SubContractor.models import Dispatch
 
 
 class TestUser():
@@ -324,6 +327,210 @@ def test_job_locking( mocker ):
     assert j.jobRunnerState() == {'cur_line': None, 'state': 'DONE'}
 
 
+@pytest.mark.django_db()
+def test_process_jobs( mocker ):
+  mocker.patch( 'contractor.Building.models.Foundation._canSetState', fake_canSetState )
+
+  si = Site( name='test', description='test' )
+  si.full_clean()
+  si.save()
+
+  fb = FoundationBluePrint( name='fdnb1', description='Foundation BluePrint 1' )
+  fb.foundation_type_list = [ 'Unknown' ]
+  fb.full_clean()
+  fb.save()
+
+  foundation_list = []
+  for i in range( 0, 3 ):
+    f = Foundation( locator='test{0}'.format( i ), site=si, blueprint=fb )
+    f.full_clean()
+    f.save()
+    createJob( 'create', f, TestUser() )
+    foundation_list.append( f )
+
+  foundation_list[0].setLocated()
+  foundation_list[1].setLocated()
+
+  assert processJobs( si, [], 10 ) == []
+  assert sorted( BaseJob.objects.filter( site=si ).values_list( 'state', flat=True ) ) == [ 'queued', 'queued', 'waiting' ]
+  assert JobLog.objects.filter( started_at__isnull=False ).count() == 2
+
+  assert processJobs( si, [], 10 ) == []  # the scripts are empty, so done right away
+  assert sorted( BaseJob.objects.filter( site=si ).values_list( 'state', flat=True ) ) == [ 'done', 'done', 'waiting' ]
+
+  assert processJobs( si, [], 10 ) == []
+  assert list( BaseJob.objects.filter( site=si ).values_list( 'state', flat=True ) ) == [ 'waiting' ]
+  assert JobLog.objects.filter( finished_at__isnull=False ).count() == 2
+  assert [ Foundation.objects.get( pk=f.pk ).state for f in foundation_list ] == [ 'built', 'built', 'planned' ]
+
+
+@pytest.mark.django_db()
+def test_step_job():
+  runner = Runner( parse( 'testing.remote()' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  ( state, message, status, script_runner ) = _stepJob( pickle.dumps( runner ) )
+  assert state == 'queued'
+  runner = pickle.loads( script_runner )
+  assert status == runner.status
+  assert runner.toSubcontractor( [ 'testing' ] ) is not None
+
+  runner = Runner( parse( 'pause( msg=\'stop\' )' ) )
+  ( state, message, status, script_runner ) = _stepJob( pickle.dumps( runner ) )
+  assert ( state, message ) == ( 'paused', 'stop' )
+
+  runner = Runner( parse( 'not_a_function()' ) )
+  ( state, message, status, script_runner ) = _stepJob( pickle.dumps( runner ) )
+  assert state == 'aborted'
+
+  runner = Runner( parse( '' ) )
+  runner.run()
+  assert _stepJob( pickle.dumps( runner ) ) == ( 'done', None, None, None )
+
+
+@pytest.mark.django_db()
+def test_step_job_script_gone():  # pickled with just the script hash, and the stored script was removed
+  s = Site( name='test', description='test' )
+  s.full_clean()
+  s.save()
+
+  script = 'testing.remote()'
+  script_hash = scriptHash( script )
+  runner = Runner( getAST( script, script_hash ), script_hash )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  job = BaseJob( site=s )
+  job.state = 'queued'
+  job.script_name = 'test'
+  job.script_runner = pickle.dumps( runner )
+  job.full_clean()
+  job.save()
+
+  CompiledScript.objects.all().delete()
+  clearCache()
+
+  ( state, message, status, script_runner ) = _stepJob( job.script_runner )
+  assert state == 'aborted'
+  assert message.startswith( 'Unable to load the job script' )
+  assert script_runner is None
+
+  assert processJobs( s, [ 'testing' ], 10 ) == []
+  job = BaseJob.objects.get( pk=job.pk )
+  assert job.state == 'aborted'
+  assert job.message.startswith( 'Unable to load the job script' )
+
+
+@pytest.mark.django_db()
+def test_process_jobs_program_changed():  # saved part way through an expression, then the script compiles differently
+  s = Site( name='test', description='test' )
+  s.full_clean()
+  s.save()
+
+  job_list = []
+  for script in ( 'var = ( 1 + testing.remote() )', 'testing.remote()' ):
+    runner = Runner( parse( script ) )
+    runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+    runner.run()
+    job = BaseJob( site=s )
+    job.state = 'queued'
+    job.script_name = 'test'
+    job.script_runner = pickle.dumps( runner )
+    job.full_clean()
+    job.save()
+    job_list.append( job )
+
+  runner = pickle.loads( job_list[0].script_runner )
+  assert runner.stack == [ 1 ]
+  runner.program._fingerprint = 'compiled by something else'
+  job_list[0].script_runner = pickle.dumps( runner )
+  job_list[0].save()
+
+  ( state, message, status, script_runner ) = _stepJob( job_list[0].script_runner )
+  assert ( state, script_runner ) == ( 'aborted', None )
+  assert message.startswith( 'Unable to load the job script' )
+
+  rc = processJobs( s, [ 'testing' ], 10 )
+  assert [ i[ 'job_id' ] for i in rc ] == [ job_list[1].pk ]  # the other job still goes
+  job = BaseJob.objects.get( pk=job_list[0].pk )
+  assert job.state == 'aborted'
+  assert job.message.startswith( 'Unable to load the job script' )
+
+
+@pytest.mark.timeout( 120 )
+@pytest.mark.django_db()
+def test_process_jobs_workers( settings ):
+  settings.FOREMAN_STEP_WORKERS = 2
+  settings.FOREMAN_STEP_PYTHON = sys.executable
+
+  s = Site( name='test', description='test' )
+  s.full_clean()
+  s.save()
+
+  for i in range( 0, 4 ):
+    runner = Runner( parse( 'testing.remote()' ) )
+    runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+    job = BaseJob( site=s )
+    job.state = 'queued'
+    job.script_name = 'test'
+    job.script_runner = pickle.dumps( runner )
+    job.full_clean()
+    job.save()
+
+  try:
+    rc = processJobs( s, [ 'testing' ], 3 )
+    assert len( rc ) == 3
+    assert len( set( i[ 'job_id' ] for i in rc ) ) == 3
+
+    rc = processJobs( s, [ 'testing' ], 3 )  # the last one's turn
+    assert len( rc ) == 1
+
+    assert processJobs( s, [ 'testing' ], 3 ) == []
+
+  finally:
+    _resetStepPool()
+
+
+@pytest.mark.django_db()
+def test_schedule_jobs( settings ):
+  settings.FOREMAN_SCHEDULER = True
+
+  s = Site( name='test', description='test' )
+  s.full_clean()
+  s.save()
+
+  job_list = []
+  for module in ( 'testing', 'testing', 'other' ):
+    runner = Runner( parse( '{0}.remote()'.format( module ) ) )
+    runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+    job = BaseJob( site=s )
+    job.state = 'queued'
+    job.script_name = 'test'
+    job.script_runner = pickle.dumps( runner )
+    job.full_clean()
+    job.save()
+    job_list.append( job )
+
+  assert Dispatch.getJobs( s, [ 'testing' ], 10 ) == []  # nothing scheduled yet
+  assert scheduleJobs( s ) == 2
+  assert scheduleJobs( s ) == 0  # allready dispatched
+  assert DispatchTask.objects.count() == 2
+
+  assert dispatchJobs( s, [ 'other' ], 10 ) == []
+  cookie, rc = _stripcookie( Dispatch.getJobs( s, [ 'testing' ], 1 ) )
+  assert rc == [ { 'job_id': job_list[0].pk, 'module': 'testing', 'function': 'remote_func', 'paramaters': 'the count "1"' } ]
+  assert DispatchTask.objects.count() == 1
+
+  job = BaseJob.objects.get( pk=job_list[1].pk )
+  job.pause()
+  assert dispatchJobs( s, [ 'testing' ], 10 ) == []
+  job.resume()
+
+  job.clearDispatched()
+  assert DispatchTask.objects.count() == 0
+  assert scheduleJobs( s ) == 1
+  rc = dispatchJobs( s, [ 'testing' ], 10 )
+  assert [ i[ 'job_id' ] for i in rc ] == [ job_list[1].pk ]
+  assert dispatchJobs( s, [ 'testing' ], 10 ) == []
+
+
 @pytest.mark.django_db()
 def test_job_create():
   si = Site()
@@ -411,6 +618,31 @@ def test_foundation_job_create():  # TODO: should also do tests depending on a D
   f = Foundation.objects.get( pk=f.pk )
 
 
+@pytest.mark.django_db()
+def test_job_create_unknown_references():
+  si = Site( name='test', description='test' )
+  si.full_clean()
+  si.save()
+
+  fb = FoundationBluePrint( name='fdnb1', description='Foundation BluePrint 1' )
+  fb.foundation_type_list = [ 'Unknown' ]
+  fb.full_clean()
+  fb.save()
+
+  script = Script( name='create', description='create', script='var = foundation.id\nif exists( foundation.maybe ) then\n  bogus.thing()\nvar = foundation.not_there' )
+  script.full_clean()
+  script.save()
+  BluePrintScript( blueprint=fb, script=script, name='create' ).save()
+
+  f = Foundation( locator='test', site=si, blueprint=fb )
+  f.full_clean()
+  f.save()
+
+  job = BaseJob.objects.get( pk=createJob( 'create', f, TestUser() ) )
+  assert job.message == 'Unknown references: "bogus.thing" on line 2, "foundation.not_there" on line 4'
+  assert job.script_hash == scriptHash( script.script )
+
+
 @pytest.mark.django_db()
 def test_foundation_with_structure_job_create():
   si = Site()
@@ -1,17 +1,24 @@
 import json
-from urllib import request
+import base64
+import random
+from datetime import timedelta
+from http import client
+from urllib import parse
+from concurrent.futures import ThreadPoolExecutor
 
 from django.utils import timezone
 
 from contractor.Building.models import Foundation, Structure
-from contractor.PostOffice.models import FoundationPost, StructurePost, FoundationBox, StructureBox, PostOfficeException
+from contractor.PostOffice.models import FoundationPost, StructurePost, FoundationBox, StructureBox, FoundationDelivery, StructureDelivery, PostOfficeException
 
 WEBHOOK_REQUEST_TIMEOUT = 60
+WEBHOOK_WORKERS = 10  # max number of destinations being delivered to at the same time
+WEBHOOK_MAX_ATTEMPTS = 10  # a delivery that has failed this many times is left 'dead'
+WEBHOOK_RETRY_DELAY = 60  # in seconds, doubled after each failed attempt
+WEBHOOK_RETRY_MAX_DELAY = 21600  # in seconds
 
-
-class HTTPErrorProcessorPassthrough( request.HTTPErrorProcessor ):
-  def http_response( self, request, response ):
-    return response
+# ( post model, box model, delivery model, the post/box field of the target )
+POST_MODEL_LIST = ( ( FoundationPost, FoundationBox, FoundationDelivery, 'foundation' ), ( StructurePost, StructureBox, StructureDelivery, 'structure' ) )
 
 
 def registerEvent( target, job=None, name=None ):
@@ -38,86 +45,288 @@ def registerEvent( target, job=None, name=None ):
   post.save()
 
 
-def _sendPost( data, box ):
+class _Destination():
+  # a connection to one scheme://host:port (through proxy if not None), kept
+  # open for all the posts to that destination.  Not thread safe, each
+  # destination is delivered to by one thread at a time
+  def __init__( self, scheme, netloc, proxy ):
+    self.scheme = scheme
+    self.netloc = netloc
+    self.proxy = proxy
+    self.connection = None
+
+  def _connect( self, timeout ):
+    if self.scheme == 'https':
+      connection_class = client.HTTPSConnection
+    elif self.scheme == 'http':
+      connection_class = client.HTTPConnection
+    else:
+      raise ValueError( 'Unknown url scheme "{0}"'.format( self.scheme ) )
+
+    if self.proxy is None:
+      return connection_class( self.netloc, timeout=timeout )
+
+    proxy = self.proxy
+    if '://' not in proxy:
+      proxy = 'http://' + proxy
+
+    proxy = parse.urlsplit( proxy )
+    proxy_host = proxy.hostname if proxy.port is None else '{0}:{1}'.format( proxy.hostname, proxy.port )
+    if self.scheme == 'http':  # plain http is sent to the proxy with the full url
+      return client.HTTPConnection( proxy_host, timeout=timeout )
+
+    connection = client.HTTPSConnection( proxy_host, timeout=timeout )
+    connection.set_tunnel( self.netloc, headers=self._proxyHeaders() )
+    return connection
+
+  def _proxyHeaders( self ):
+    # the Proxy-Authorization for the user:pass@ in the proxy, if there is one, the same as urllib's ProxyHandler did
+    if self.proxy is None:
+      return {}
+
+    proxy = self.proxy
+    if '://' not in proxy:
+      proxy = 'http://' + proxy
+
+    proxy = parse.urlsplit( proxy )
+    if proxy.username is None:
+      return {}
+
+    credentials = '{0}:{1}'.format( parse.unquote( proxy.username ), parse.unquote( proxy.password or '' ) )
+    return { 'Proxy-Authorization': 'Basic ' + base64.b64encode( credentials.encode() ).decode( 'ascii' ) }
+
+  def request( self, method, url, body, headers, timeout ):
+    # returns the response status, the connection is dropped on any error, the
+    # next request will open a new one.  Redirects are not followed, they never
+    # were, the old urllib opener passed every response through as is
+    reused = self.connection is not None
+    if self.connection is None:
+      self.connection = self._connect( timeout )
+    else:
+      self.connection.timeout = timeout
+      if self.connection.sock is not None:
+        self.connection.sock.settimeout( timeout )
+
+    if self.proxy is None or self.scheme == 'https':
+      parts = parse.urlsplit( url )
+      url = parse.urlunsplit( ( '', '', parts.path or '/', parts.query, '' ) )
+    else:
+      headers = dict( headers, **self._proxyHeaders() )
+
+    try:
+      self.connection.request( method, url, body=body, headers=headers )
+      resp = self.connection.getresponse()
+      resp.read()  # the body has to be read before the connection can be used again
+
+    except ( client.RemoteDisconnected, ConnectionResetError, BrokenPipeError ):
+      self.close()
+      if not reused:
+        raise
+
+      return self.request( method, url, body, headers, timeout )  # the receiver closed the kept open connection, try again on a new one
+
+    except Exception:
+      self.close()
+      raise
+
+    if resp.will_close:
+      self.close()
+
+    return resp.status
+
+  def close( self ):
+    if self.connection is not None:
+      self.connection.close()
+
+    self.connection = None
+
+
+def _sendPost( data, box, destination ):
   print( 'Sending "{0}" to "{1}"'.format( data, box.url ) )
-  if box.proxy is not None:
-    opener = request.build_opener( HTTPErrorProcessorPassthrough, request.ProxyHandler( { 'http': box.proxy, 'https': box.proxy } ) )
-  else:
-    opener = request.build_opener( HTTPErrorProcessorPassthrough, request.ProxyHandler( {} ) )
 
   headers = { 'User-Agent': 'Contractor WebHook', 'Content-Type': 'application/json;charset=utf-8' }
 
-  data = json.dumps( data ).encode( 'utf-8' )
-  req = request.Request( box.url, data=data, headers=headers )
   if box.type == 'post':
-    req.get_method = lambda: 'POST'
+    method = 'POST'
 
   elif box.type == 'call':
-    req.headers[ 'CInP-Version' ] = '1.0'
-    req.get_method = lambda: 'CALL'
+    headers[ 'CInP-Version' ] = '1.0'
+    method = 'CALL'
 
   else:
     raise PostOfficeException( 'INVALID_BOX_TYPE', 'Unknown box type "{0}"'.format( box.type ) )
 
+  data = json.dumps( data ).encode( 'utf-8' )
+  timeout = box.timeout or WEBHOOK_REQUEST_TIMEOUT
   try:
-    resp = opener.open( req, timeout=WEBHOOK_REQUEST_TIMEOUT )  # Do we care about the return value, ie: allow a re-queue of a one shot or something?
+    code = destination.request( method, box.url, data, headers, timeout )  # Do we care about the return value, ie: allow a re-queue of a one shot or something?
+  except OSError:  # could not connect or timed out, see _sendDestination
+    raise
   except Exception as e:
     print( 'Error with webhook: ({0})"{1}"'.format( e.__class__.__name__, e ) )
     return False
 
-  print( 'got "{0}"'.format( resp.code ) )
-  return resp.code >= 200 and resp.code < 300
+  print( 'got "{0}"'.format( code ) )
+  return code >= 200 and code < 300
+
 
+def _postData( post, box ):
+  data = dict( box.extra_data )
+  if isinstance( post, FoundationPost ):
+    data[ 'foundation' ] = post.foundation_id
+  else:
+    data[ 'structure' ] = post.structure_id
 
-def _sendFoundationPost( post, box ):
-  data = box.extra_data
-  data[ 'foundation' ] = post.foundation.pk
   data[ 'script' ] = post.name
   data[ 'at' ] = post.created.isoformat()
-  return _sendPost( data, box )
+  return data
 
 
-def _sendStructurePost( post, box ):
-  data = box.extra_data
-  data[ 'structure' ] = post.structure.pk
-  data[ 'script' ] = post.name
-  data[ 'at' ] = post.created.isoformat()
-  return _sendPost( data, box )
+def _sendDestination( destination, delivery_list ):
+  # delivery_list is [ ( data, box ) ], sent in order on the one connection, if
+  # the destination can't be connected to or times out, the rest are not tried,
+  # they would only wait on the same thing, they are failed and retried later
+  result = []
+  try:
+    for ( data, box ) in delivery_list:
+      try:
+        result.append( _sendPost( data, box, destination ) )
+      except PostOfficeException as e:
+        print( 'Error with webhook: {0}'.format( e ) )
+        result.append( False )
+      except OSError as e:
+        print( 'Error with webhook destination, skipping the rest: ({0})"{1}"'.format( e.__class__.__name__, e ) )
+        break
+
+  finally:
+    destination.close()
+
+  return result + [ False ] * ( len( delivery_list ) - len( result ) )
+
+
+def _deliver( delivery_list ):
+  # delivery_list is [ ( data, box ) ], returns a list of True/False of which
+  # were delivered.  The deliveries are grouped by destination, the
+  # destinations are delivered to in parallel, so a slow or dead receiver only
+  # holds up it's own posts, and at most WEBHOOK_WORKERS connections are open
+  # at a time
+  destination_map = {}
+  for ( i, ( data, box ) ) in enumerate( delivery_list ):
+    parts = parse.urlsplit( box.url )
+    key = ( parts.scheme, parts.netloc, box.proxy )
+    try:
+      destination_map[ key ][1].append( ( i, ( data, box ) ) )
+    except KeyError:
+      destination_map[ key ] = ( _Destination( *key ), [ ( i, ( data, box ) ) ] )
+
+  result = [ False ] * len( delivery_list )
+  if not destination_map:
+    return result
+
+  with ThreadPoolExecutor( max_workers=min( WEBHOOK_WORKERS, len( destination_map ) ) ) as pool:
+    future_list = []
+    for ( destination, item_list ) in destination_map.values():
+      future_list.append( ( item_list, pool.submit( _sendDestination, destination, [ i[1] for i in item_list ] ) ) )
+
+    for ( item_list, future ) in future_list:
+      for ( ( i, _ ), sent ) in zip( item_list, future.result() ):
+        result[ i ] = sent
+
+  return result
+
+
+def retryDelay( attempts ):
+  # exponential backoff, with jitter so the deliveries to a receiver that was
+  # down do not all come back at the same time
+  delay = min( WEBHOOK_RETRY_DELAY * ( 2 ** ( attempts - 1 ) ), WEBHOOK_RETRY_MAX_DELAY )
+  return timedelta( seconds=random.uniform( delay / 2, delay ) )
+
+
+def _newDeliveries( post_model, box_model, delivery_model, target_field, now ):
+  # creates the deliveries for the posts that don't have any yet, to each of
+  # the boxes of the post's target.  A one shot box only gets the first post
+  # for it, the posts after that wait ( with no deliveries ) until that one is
+  # delivered and the box is gone, if it goes dead the next post gets the box.
+  # Posts with nothing to deliver to are done
+  post_list = list( post_model.objects.filter( **{ delivery_model._meta.model_name + '__isnull': True } ).order_by( 'pk' ) )
+  if not post_list:
+    return
+
+  target_id = target_field + '_id'
+  box_map = {}  # target pk -> box list
+  for box in box_model.objects.filter( **{ target_field + '__in': set( getattr( post, target_id ) for post in post_list ) } ).order_by( 'pk' ):
+    box_map.setdefault( getattr( box, target_id ), [] ).append( box )
+
+  one_shot_list = [ box.pk for box_list in box_map.values() for box in box_list if box.one_shot ]
+  used_set = set( delivery_model.objects.filter( box__in=one_shot_list, state__in=( 'pending', 'delivered' ) ).values_list( 'box', flat=True ) )
+
+  delivery_list = []
+  done_list = []
+  for post in post_list:
+    box_list = box_map.get( getattr( post, target_id ), [] )
+    if not box_list:
+      done_list.append( post.pk )
+      continue
+
+    if any( box.one_shot and box.pk in used_set for box in box_list ):  # waiting on the post before it
+      continue
+
+    for box in box_list:
+      if box.one_shot:
+        used_set.add( box.pk )
+
+      delivery_list.append( delivery_model( post=post, box=box, next_attempt=now ) )
+
+  delivery_model.objects.bulk_create( delivery_list )
+  post_model.objects.filter( pk__in=done_list ).delete()
 
 
 def processPost():
+  now = timezone.now()
+
   # first clcean up the expired
-  for box in FoundationBox.objects.filter( expires__lt=timezone.now(), expires__isnull=False ):
-    box.delete()  # send a expiration notification? or mabey a 4, 2, 1 hour warning so they can renew
-
-  for box in StructureBox.objects.filter( expires__lt=timezone.now(), expires__isnull=False ):
-    box.delete()
-
-  # now look over the Posts and see if there is anything that needs to be delievered
-  for post in FoundationPost.objects.all():
-    done = True
-    for box in FoundationBox.objects.filter( foundation=post.foundation ):
-      if not _sendFoundationPost( post, box ):
-        print( 'Error posting foundation  "{0}" to "{1}"'.format( post, box ) )
-        done = False
-        continue
+  FoundationBox.objects.filter( expires__lt=now, expires__isnull=False ).delete()  # send a expiration notification? or mabey a 4, 2, 1 hour warning so they can renew
+  StructureBox.objects.filter( expires__lt=now, expires__isnull=False ).delete()
 
-      if box.one_shot:
-        box.delete()
+  for ( post_model, box_model, delivery_model, target_field ) in POST_MODEL_LIST:
+    _newDeliveries( post_model, box_model, delivery_model, target_field, now )
+
+  # now deliver the deliveries that are due
+  delivery_list = []
+  for ( _, _, delivery_model, _ ) in POST_MODEL_LIST:
+    delivery_list += list( delivery_model.objects.filter( state='pending', next_attempt__lte=now ).select_related( 'post', 'box' ).order_by( 'pk' ) )
 
-    if done:
-      post.delete()
+  sent_list = _deliver( [ ( _postData( delivery.post, delivery.box ), delivery.box ) for delivery in delivery_list ] )
 
-  for post in StructurePost.objects.all():
-    done = True
-    for box in StructureBox.objects.filter( structure=post.structure ):
-      if not _sendStructurePost( post, box ):
-        print( 'Error posting structure  "{0}" to "{1}"'.format( post, box ) )
-        done = False
+  for ( post_model, box_model, delivery_model, _ ) in POST_MODEL_LIST:
+    delivered_list = []
+    failed_list = []
+    for ( delivery, sent ) in zip( delivery_list, sent_list ):
+      if not isinstance( delivery, delivery_model ):
         continue
 
-      if box.one_shot:
-        box.delete()
+      delivery.attempts += 1
+      delivery.last_attempt = now
+      delivery.updated = now
+      if sent:
+        delivery.state = 'delivered'
+        delivered_list.append( delivery )
+        continue
+
+      if delivery.attempts >= WEBHOOK_MAX_ATTEMPTS:
+        print( 'Giving up on "{0}" after "{1}" attempts'.format( delivery, delivery.attempts ) )
+        delivery.state = 'dead'
+      else:
+        print( 'Error delivering "{0}", will retry'.format( delivery ) )
+        delivery.next_attempt = now + retryDelay( delivery.attempts )
+
+      failed_list.append( delivery )
+
+    delivery_model.objects.bulk_update( delivered_list + failed_list, [ 'state', 'attempts', 'last_attempt', 'next_attempt', 'updated' ] )
+
+    # the posts that are delivered every where they are going are done, this
+    # has to be before the one shot boxes and their deliveries go
+    delivery_name = delivery_model._meta.model_name
+    post_model.objects.filter( **{ delivery_name + '__state': 'delivered' } ).exclude( **{ delivery_name + '__state__in': ( 'pending', 'dead' ) } ).delete()
 
-    if done:
-      post.delete()
+    box_model.objects.filter( pk__in=[ delivery.box_id for delivery in delivered_list if delivery.box.one_shot ] ).delete()
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PostOffice', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foundationbox',
+            name='timeout',
+            field=models.IntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='structurebox',
+            name='timeout',
+            field=models.IntegerField(null=True, blank=True),
+        ),
+    ]
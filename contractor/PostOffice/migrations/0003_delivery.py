@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PostOffice', '0002_box_timeout'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FoundationDelivery',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('state', models.CharField(max_length=9, default='pending', choices=[('pending', 'Pending'), ('delivered', 'Delivered'), ('dead', 'Dead')])),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt', models.DateTimeField()),
+                ('last_attempt', models.DateTimeField(null=True, blank=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('box', models.ForeignKey(to='PostOffice.FoundationBox', on_delete=models.CASCADE)),
+                ('post', models.ForeignKey(to='PostOffice.FoundationPost', on_delete=models.CASCADE)),
+            ],
+            options={'default_permissions': ('change', 'delete', 'view')},
+        ),
+        migrations.CreateModel(
+            name='StructureDelivery',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('state', models.CharField(max_length=9, default='pending', choices=[('pending', 'Pending'), ('delivered', 'Delivered'), ('dead', 'Dead')])),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt', models.DateTimeField()),
+                ('last_attempt', models.DateTimeField(null=True, blank=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('box', models.ForeignKey(to='PostOffice.StructureBox', on_delete=models.CASCADE)),
+                ('post', models.ForeignKey(to='PostOffice.StructurePost', on_delete=models.CASCADE)),
+            ],
+            options={'default_permissions': ('change', 'delete', 'view')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='foundationdelivery',
+            unique_together=set([('post', 'box')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='structuredelivery',
+            unique_together=set([('post', 'box')]),
+        ),
+        migrations.AddIndex(
+            model_name='foundationdelivery',
+            index=models.Index(fields=['state', 'next_attempt'], name='PostOffice__state_839a53_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='structuredelivery',
+            index=models.Index(fields=['state', 'next_attempt'], name='PostOffice__state_b77394_idx'),
+        ),
+    ]
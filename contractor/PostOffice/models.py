@@ -2,6 +2,7 @@ from datetime import datetime, timezone, timedelta
 
 from django.db import models
 from django.core.exceptions import ValidationError
+from django.utils import timezone as django_timezone
 
 from cinp.orm_django import DjangoCInP as CInP
 
@@ -74,6 +75,7 @@ class Box( models.Model ):
   type = models.CharField( max_length=4, choices=BOX_TYPE )
   one_shot = models.BooleanField( default=True )
   extra_data = MapField()
+  timeout = models.IntegerField( blank=True, null=True )  # in seconds, None for the default WEBHOOK_REQUEST_TIMEOUT
   expires = models.DateTimeField( blank=True, null=True )
   updated = models.DateTimeField( editable=False, auto_now=True )
   created = models.DateTimeField( editable=False, auto_now_add=True )
@@ -98,6 +100,9 @@ class Box( models.Model ):
     if self.expires is not None and not self.expires > datetime.now( timezone.utc ) + timedelta( hours=MAX_BOX_LIFE ):
       errors[ 'expires' ] = 'more than "{0}" hourse in the future'.format( MAX_BOX_LIFE )
 
+    if self.timeout is not None and self.timeout < 1:
+      errors[ 'timeout' ] = 'must be at least 1 second'
+
     if not self.one_shot and self.exires is None:
       errors[ 'expires' ] = 'required when not one_shot'
 
@@ -148,3 +153,109 @@ class StructureBox( Box ):
 
   def __str__( self ):
     return 'StructureBox for "{0}"'.format( self.structure_id )
+
+
+class Delivery( models.Model ):
+  # the delivery of a post to a box, processPost makes one per box when it
+  # first sees the post, the post is removed (with it's deliveries) once they
+  # are all 'delivered'.  After each failed attempt next_attempt is pushed
+  # back, when it has run out of attempts it is left in state 'dead' until it
+  # is retried or deleted
+  DELIVERY_STATE = ( ( 'pending', 'Pending' ), ( 'delivered', 'Delivered' ), ( 'dead', 'Dead' ) )
+  state = models.CharField( max_length=9, choices=DELIVERY_STATE, default='pending' )
+  attempts = models.IntegerField( default=0 )
+  next_attempt = models.DateTimeField()
+  last_attempt = models.DateTimeField( blank=True, null=True )
+  updated = models.DateTimeField( editable=False, auto_now=True )
+  created = models.DateTimeField( editable=False, auto_now_add=True )
+
+  def retry( self ):
+    if self.state != 'dead':
+      raise PostOfficeException( 'NOT_DEAD', 'Can only retry a dead delivery' )
+
+    self.state = 'pending'
+    self.attempts = 0
+    self.next_attempt = django_timezone.now()
+    self.full_clean()
+    self.save()
+
+  def delete( self, *args, **kwargs ):
+    # a post with no deliveries is a post processPost has not seen yet, so
+    # when the last one goes, the post goes too
+    post = self.post
+    result = super().delete( *args, **kwargs )
+    if not type( self ).objects.filter( post=post ).exists():
+      post.delete()
+
+    return result
+
+  def clean( self, *args, **kwargs ):
+    super().clean( *args, **kwargs )
+    errors = {}
+
+    if self.state not in dict( self.DELIVERY_STATE ):
+      errors[ 'state' ] = 'Invalid'
+
+    if errors:
+      raise ValidationError( errors )
+
+  class Meta:
+    abstract = True
+
+
+@cinp.model( not_allowed_verb_list=[ 'CREATE', 'UPDATE' ] )
+class FoundationDelivery( Delivery ):
+  post = models.ForeignKey( FoundationPost, on_delete=models.CASCADE )
+  box = models.ForeignKey( FoundationBox, on_delete=models.CASCADE )
+
+  @cinp.action()
+  def retry( self ):
+    """
+    Retry a delivery that is in 'dead' state.
+
+    Errors:
+      NOT_DEAD - Delivery is not in state 'dead'.
+    """
+    super().retry()
+
+  @cinp.check_auth()
+  @staticmethod
+  def checkAuth( user, verb, id_list, action=None ):
+    return cinp.basic_auth_check( user, verb, action, FoundationDelivery, { 'retry': 'PostOffice.change_foundationdelivery' } )
+
+  class Meta:
+    default_permissions = ( 'change', 'delete', 'view' )
+    unique_together = ( ( 'post', 'box' ), )
+    indexes = [ models.Index( fields=[ 'state', 'next_attempt' ] ) ]
+
+  def __str__( self ):
+    return 'FoundationDelivery of "{0}" to "{1}"'.format( self.post_id, self.box_id )
+
+
+@cinp.model( not_allowed_verb_list=[ 'CREATE', 'UPDATE' ] )
+class StructureDelivery( Delivery ):
+  post = models.ForeignKey( StructurePost, on_delete=models.CASCADE )
+  box = models.ForeignKey( StructureBox, on_delete=models.CASCADE )
+
+  @cinp.action()
+  def retry( self ):
+    """
+    Retry a delivery that is in 'dead' state.
+
+    Errors:
+      NOT_DEAD - Delivery is not in state 'dead'.
+    """
+    super().retry()
+
+  @cinp.check_auth()
+  @staticmethod
+  def checkAuth( user, verb, id_list, action=None ):
+    return cinp.basic_auth_check( user, verb, action, StructureDelivery, { 'retry': 'PostOffice.change_structuredelivery' } )
+
+  class Meta:
+    default_permissions = ( 'change', 'delete', 'view' )
+    unique_together = ( ( 'post', 'box' ), )
+    indexes = [ models.Index( fields=[ 'state', 'next_attempt' ] ) ]
+
+  def __str__( self ):
+    return 'StructureDelivery of "{0}" to "{1}"'.format( self.post_id, self.box_id )
@@ -1,8 +1,13 @@
-from pymongo import MongoClient
+import json
+import hashlib
+
+from pymongo import MongoClient, UpdateOne
 from django.conf import settings
 
-from contractor.lib.config import getConfig, mergeValues
+from contractor.lib.config import getConfig, mergeValues, JSONDefault
 
+RECORD_HASH_FIELD = '__record_hash'  # hash of the record when written by syncRecords, so unchanged records can be skipped
+SYNC_BATCH_SIZE = 500
 
 _mongo_db = None
 
@@ -64,9 +69,7 @@ def prepConfig( config ):
   return config
 
 
-def updateRecord( target ):
-  db = collection( target )
-
+def recordItem( target ):
   if target.__class__.__name__ in ( 'StructureBluePrint', 'FoundationBluePrint' ):
     item = getConfig( target )
   else:
@@ -75,10 +78,86 @@ def updateRecord( target ):
   for i in ( '__contractor_host', '__pxe_location' ):  # these are the same everywhere
     del item[i]
 
+  return prepConfig( item )
+
+
+def recordHash( item ):
+  # everything but '__timestamp', that is different every time
+  value = dict( item )
+  value.pop( '__timestamp', None )
+  value.pop( RECORD_HASH_FIELD, None )
+  return hashlib.sha256( json.dumps( value, sort_keys=True, default=JSONDefault ).encode() ).hexdigest()
+
+
+def updateRecord( target ):
+  db = collection( target )
+
+  item = recordItem( target )
+
   key = { '_id': target.pk }
 
-  prepConfig( item )
-  db.update_one( key, { '$set': item }, upsert=True )
+  db.update_one( key, { '$set': item, '$unset': { RECORD_HASH_FIELD: '' } }, upsert=True )  # the hash is only kept up to date by syncRecords
+
+
+def syncRecords( queryset, batch_size=SYNC_BATCH_SIZE, after=None, checkpoint=None ):
+  # brings the records for everything in queryset up to date, batch_size
+  # at a time.  A record whose hash (recordHash) has not changed since the
+  # last syncRecords is not written, the changed ones are written with one
+  # bulk_write per batch.  Goes in pk order starting after the pk after, once
+  # each batch is written checkpoint( last pk of the batch ) is called, so an
+  # interrupted sync can be picked up with after=that pk.
+  # returns ( written count, skipped count )
+  written = 0
+  skipped = 0
+  queryset = queryset.order_by( 'pk' )
+  db = None
+  while True:
+    if after is not None:
+      target_list = list( queryset.filter( pk__gt=after )[ :batch_size ] )
+    else:
+      target_list = list( queryset[ :batch_size ] )
+
+    if not target_list:
+      break
+
+    if db is None:
+      db = collection( target_list[0] )
+
+    hash_map = {}
+    for record in db.find( { '_id': { '$in': [ target.pk for target in target_list ] } }, { RECORD_HASH_FIELD: 1 } ):
+      hash_map[ record[ '_id' ] ] = record.get( RECORD_HASH_FIELD, None )
+
+    operation_list = []
+    for target in target_list:
+      item = recordItem( target )
+      item[ RECORD_HASH_FIELD ] = recordHash( item )
+      if hash_map.get( target.pk, None ) == item[ RECORD_HASH_FIELD ]:
+        skipped += 1
+        continue
+
+      operation_list.append( UpdateOne( { '_id': target.pk }, { '$set': item }, upsert=True ) )
+
+    if operation_list:
+      db.bulk_write( operation_list, ordered=False )
+      written += len( operation_list )
+
+    after = target_list[ -1 ].pk
+    if checkpoint is not None:
+      checkpoint( after )
+
+  return ( written, skipped )
+
+
+def removeOrphanRecords( group, queryset_list ):
+  # removes the records in the group collection of things not in any of
+  # queryset_list (the FoundationBluePrints and StructureBluePrints share a
+  # collection), with one request.  returns the number removed
+  db = collection( group )
+  pk_list = []
+  for queryset in queryset_list:
+    pk_list += list( queryset.values_list( 'pk', flat=True ) )
+
+  return db.delete_many( { '_id': { '$nin': pk_list } } ).deleted_count
 
 
 def removeRecord( target ):
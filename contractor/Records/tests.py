@@ -3,7 +3,7 @@ import pytest
 from contractor.Site.models import Site
 from contractor.Building.models import Structure, Foundation
 from contractor.BluePrint.models import StructureBluePrint, FoundationBluePrint
-from contractor.Records.lib import collection
+from contractor.Records.lib import collection, syncRecords, removeOrphanRecords, RECORD_HASH_FIELD
 
 
 fake_key = None
@@ -368,3 +368,77 @@ def test_updateConfig_structure( mocker ):
   fake_key = None
   str.delete()
   assert fake_key == { '_id': pk }
+
+
+class FakeResult():
+  def __init__( self, deleted_count ):
+    self.deleted_count = deleted_count
+
+
+class FakeStoreCollection():
+  def __init__( self ):
+    self.record_map = {}
+    self.bulk_write_count = 0
+
+  def update_one( self, key, item, upsert ):
+    record = self.record_map.setdefault( key[ '_id' ], { '_id': key[ '_id' ] } )
+    record.update( item[ '$set' ] )
+    for name in item.get( '$unset', {} ):
+      record.pop( name, None )
+
+  def find( self, query, fields ):
+    return [ { '_id': i[ '_id' ], RECORD_HASH_FIELD: i.get( RECORD_HASH_FIELD ) } for i in self.record_map.values() if i[ '_id' ] in query[ '_id' ][ '$in' ] ]
+
+  def bulk_write( self, operation_list, ordered ):
+    self.bulk_write_count += 1
+    for operation in operation_list:
+      self.update_one( operation._filter, operation._doc, operation._upsert )
+
+  def delete_many( self, query ):
+    pk_list = [ i for i in self.record_map.keys() if i not in query[ '_id' ][ '$nin' ] ]
+    for pk in pk_list:
+      del self.record_map[ pk ]
+
+    return FakeResult( len( pk_list ) )
+
+
+@pytest.mark.django_db
+def test_sync( mocker ):
+  site_collection = FakeStoreCollection()
+
+  class FakeStoreDB():
+    site = site_collection
+
+  mocker.patch( 'contractor.Records.lib._connect', lambda: FakeStoreDB() )
+
+  for i in range( 0, 5 ):
+    s = Site( name='site{0}'.format( i ), description='test site' )
+    s.full_clean()
+    s.save()
+
+  site_collection.record_map = {}
+
+  checkpoint_list = []
+  assert syncRecords( Site.objects.all(), batch_size=2, checkpoint=checkpoint_list.append ) == ( 5, 0 )
+  assert checkpoint_list == [ 'site1', 'site3', 'site4' ]
+  assert site_collection.bulk_write_count == 3
+  assert sorted( site_collection.record_map.keys() ) == [ 'site0', 'site1', 'site2', 'site3', 'site4' ]
+  assert site_collection.record_map[ 'site2' ][ '_site' ] == 'site2'
+
+  assert syncRecords( Site.objects.all(), batch_size=2 ) == ( 0, 5 )
+  assert site_collection.bulk_write_count == 3
+
+  s = Site.objects.get( name='site2' )
+  s.config_values = { 'a': 42 }
+  s.full_clean()
+  s.save()
+  site_collection.update_one( { '_id': 'site2' }, { '$set': { 'a': 42 }, '$unset': { RECORD_HASH_FIELD: '' } }, True )  # what updateRecord does
+
+  assert syncRecords( Site.objects.all(), batch_size=2 ) == ( 1, 4 )
+  assert site_collection.record_map[ 'site2' ][ 'a' ] == 42
+
+  assert syncRecords( Site.objects.all(), batch_size=2, after='site2' ) == ( 0, 2 )
+
+  site_collection.record_map[ 'gone' ] = { '_id': 'gone' }
+  assert removeOrphanRecords( 'Site', [ Site.objects.all() ] ) == 1
+  assert sorted( site_collection.record_map.keys() ) == [ 'site0', 'site1', 'site2', 'site3', 'site4' ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import contractor.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Site', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PoolSnapshot',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('pool_type', models.CharField(max_length=10, choices=[('static', 'static'), ('dynamic', 'dynamic')])),
+                ('pool_hash', models.CharField(max_length=64)),
+                ('pool', contractor.fields.JSONField(default={})),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('site', models.ForeignKey(editable=False, to='Site.Site', on_delete=models.CASCADE)),
+            ],
+            options={'default_permissions': ()},
+        ),
+        migrations.AddIndex(
+            model_name='poolsnapshot',
+            index=models.Index(fields=['site', 'pool_type'], name='SubContract_site_id_39c02c_idx'),
+        ),
+    ]
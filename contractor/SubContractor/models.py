@@ -1,12 +1,23 @@
+import json
+import hashlib
+
+from django.conf import settings
+from django.db import models
+
 from cinp.orm_django import DjangoCInP as CInP
 
+from contractor.fields import JSONField
 from contractor.Site.models import Site
-from contractor.Utilities.models import AddressBlock, NetworkAddressBlock
-from contractor.Foreman.lib import processJobs, jobResults, jobError
+from contractor.Building.models import FOUNDATION_SUBCLASS_LIST
+from contractor.Utilities.models import AddressBlock, NetworkAddressBlock, Address, interfaceMap
+from contractor.lib.ip import StrToIp, IpToStr
+from contractor.Foreman.lib import processJobs, dispatchJobs, jobResults, jobError
 from contractor.lib.config import getConfig
 
 cinp = CInP( 'SubContractor', '0.1' )
 
+POOL_SNAPSHOT_KEEP = 5  # per site and pool type, a watermark older than this gets a full sync
+
 
 # these are only for subcontractor to talk to, thus some of the job_id short cuts
 @cinp.staticModel()  # TODO: move to  Foreman?
@@ -17,6 +28,9 @@ class Dispatch():
   @cinp.action( return_type={ 'type': 'Map', 'is_array': True }, paramater_type_list=[ { 'type': 'Model', 'model': Site }, { 'type': 'String', 'is_array': True }, 'Integer' ] )
   @staticmethod
   def getJobs( site, module_list, max_jobs=10 ):
+    if getattr( settings, 'FOREMAN_SCHEDULER', False ):  # the scheduler is running the jobs, just hand out what it has ready
+      return dispatchJobs( site, module_list, max_jobs )
+
     result = processJobs( site, module_list, max_jobs )
     return result
 
@@ -39,6 +53,72 @@ class Dispatch():
     return verb == 'CALL' and user.username == 'subcontractor'
 
 
+@cinp.model( not_allowed_verb_list=[ 'LIST', 'GET', 'CREATE', 'UPDATE', 'DELETE', 'CALL' ], hide_field_list=( 'pool', ) )
+class PoolSnapshot( models.Model ):  # the pools as they were handed out, the watermark is the pk, so the next sync can be just what changed since
+  site = models.ForeignKey( Site, editable=False, on_delete=models.CASCADE )
+  pool_type = models.CharField( max_length=10, choices=( ( 'static', 'static' ), ( 'dynamic', 'dynamic' ) ) )
+  pool_hash = models.CharField( max_length=64 )
+  pool = JSONField( default={} )
+  created = models.DateTimeField( editable=False, auto_now_add=True )
+
+  @staticmethod
+  def delta( site, pool_type, pool, watermark ):
+    # pool is the map of everything as of now, returns what has been added,
+    # changed and removed from it since the snapshot watermark, and the pool as
+    # of the watermark.  If watermark is None or has been cleaned up, everything
+    # is added and full is True
+    pool_hash = hashlib.sha256( json.dumps( pool, sort_keys=True ).encode() ).hexdigest()
+    snapshot_list = PoolSnapshot.objects.filter( site=site, pool_type=pool_type )
+    try:
+      current = snapshot_list.filter( pool_hash=pool_hash ).latest( 'pk' )
+    except PoolSnapshot.DoesNotExist:
+      current = PoolSnapshot( site=site, pool_type=pool_type, pool_hash=pool_hash, pool=pool )
+      current.full_clean()
+      current.save()
+      keep_list = list( snapshot_list.order_by( '-pk' ).values_list( 'pk', flat=True )[ :POOL_SNAPSHOT_KEEP ] )
+      snapshot_list.exclude( pk__in=keep_list ).delete()
+
+    result = { 'watermark': current.pk, 'full': False, 'added': {}, 'changed': {}, 'removed': [] }
+
+    if watermark == current.pk:
+      return ( result, pool )
+
+    previous = None
+    if watermark is not None:
+      try:
+        previous = snapshot_list.get( pk=watermark )
+      except PoolSnapshot.DoesNotExist:
+        pass
+
+    if previous is None:
+      result[ 'full' ] = True
+      result[ 'added' ] = pool
+      return ( result, None )
+
+    for key, value in pool.items():
+      try:
+        if previous.pool[ key ] != value:
+          result[ 'changed' ][ key ] = value
+      except KeyError:
+        result[ 'added' ][ key ] = value
+
+    result[ 'removed' ] = sorted( key for key in previous.pool if key not in pool )
+
+    return ( result, previous.pool )
+
+  @cinp.check_auth()
+  @staticmethod
+  def checkAuth( user, verb, id_list, action=None ):
+    return cinp.basic_auth_check( user, verb, action, PoolSnapshot )
+
+  class Meta:
+    default_permissions = ()  # nothing
+    indexes = [ models.Index( fields=[ 'site', 'pool_type' ] ) ]
+
+  def __str__( self ):
+    return 'PoolSnapshot #{0} {1} for site "{2}"'.format( self.pk, self.pool_type, self.site_id )
+
+
 @cinp.staticModel()  # TODO: static poller
 class DHCPd():
   def __init__( self ):
@@ -66,7 +146,7 @@ class DHCPd():
                'domain_name': domain_name
               }
 
-      item[ 'address_list' ] = [ addr.ip_address for addr in address_block.baseaddress_set.filter( dynamicaddress__isnull=False ) ]
+      item[ 'address_list' ] = [ addr.ip_address for addr in address_block.baseaddress_set.filter( dynamicaddress__isnull=False ).order_by( 'offset' ) ]  # ordered, PoolSnapshot hashes it
 
       result.append( item )
 
@@ -75,42 +155,94 @@ class DHCPd():
   @cinp.action( return_type={ 'type': 'Map' }, paramater_type_list=[ { 'type': 'Model', 'model': Site } ] )
   @staticmethod
   def getStaticPools( site ):
+    # everything is loaded up front, in a handfull of queries no matter how
+    # many hosts there are, then put together the same way Address.interface,
+    # Address.console, etc would of
+    site_config = getConfig( site )
+    extra = {}
+    try:
+      extra[ 'dns_server' ] = site_config[ 'dns_servers' ][0]
+    except ( KeyError, IndexError ):
+      pass
+
+    try:
+      extra[ 'domain_name' ] = site_config[ 'domain_name' ]
+    except KeyError:
+      pass
+
+    foundation_related_list = [ 'networked__structure__foundation__{0}'.format( attr ) for attr in FOUNDATION_SUBCLASS_LIST ]  # so foundation.subclass dosen't have to go back to the db
+    address_list = list( Address.objects.filter( address_block__site=site ).select_related( 'address_block', 'networked__structure__foundation', *foundation_related_list ).order_by( 'address_block', 'pk' ) )
+
+    iface_map = interfaceMap( address_list )
+
+    vlan_map = {}  # ( address block pk, network pk ) -> vlan
+    for nab in NetworkAddressBlock.objects.filter( address_block__site=site ):
+      vlan_map[ ( nab.address_block_id, nab.network_id ) ] = nab.vlan
+
+    block_map = {}  # address block pk -> ( subnet, netmask, gateway )
+    console_map = {}  # foundation pk -> console
     result = {}
-    # without the distinct we get an AddressBlock for each Networked
-    for address_block in AddressBlock.objects.filter( site=site, baseaddress__address__networked__isnull=False ).distinct():
-      for addr in address_block.baseaddress_set.filter( address__networked__isnull=False ):
-        addr = addr.subclass
-        iface = addr.interface
-        if iface is None or iface.mac is None:
-          continue
-
-        try:
-          nab = address_block.networkaddressblock_set.get( network=iface.network )
-        except NetworkAddressBlock.DoesNotExist:
-          continue
-
-        result[ iface.mac ] = {
-                                'ip_address': addr.ip_address,
-                                'netmask': address_block.netmask,
-                                'gateway': address_block.gateway,
-                                'host_name': addr.structure.hostname,
-                                'config_uuid': addr.structure.config_uuid,
-                                'mtu': iface.network.mtu,
-                                'vlan': nab.vlan,
-                                'console': addr.console
-                              }
-
-        site_config = address_block.site.getConfig()
-
-        try:
-          result[ iface.mac ][ 'dns_server' ] = site_config[ 'dns_servers' ][0]
-        except ( KeyError, IndexError ):
-          pass
-
-        try:
-          result[ iface.mac ][ 'domain_name' ] = site_config[ 'domain_name' ]
-        except KeyError:
-          pass
+    for addr in address_list:
+      iface = iface_map.get( addr.pk, None )
+      if iface is None or iface.mac is None:
+        continue
+
+      structure = addr.networked.structure
+
+      try:
+        vlan = vlan_map[ ( addr.address_block_id, iface.network_id ) ]
+      except KeyError:
+        continue
+
+      try:
+        ( subnet, netmask, gateway ) = block_map[ addr.address_block_id ]
+      except KeyError:
+        address_block = addr.address_block
+        ( subnet, netmask, gateway ) = block_map[ addr.address_block_id ] = ( StrToIp( address_block.subnet ), address_block.netmask, address_block.gateway )
+
+      try:
+        console = console_map[ structure.foundation_id ]
+      except KeyError:
+        console = console_map[ structure.foundation_id ] = structure.foundation.subclass.console
+
+      result[ iface.mac ] = {
+                              'ip_address': IpToStr( subnet + addr.offset ),
+                              'netmask': netmask,
+                              'gateway': gateway,
+                              'host_name': structure.hostname,
+                              'config_uuid': structure.config_uuid,
+                              'mtu': iface.network.mtu,
+                              'vlan': vlan,
+                              'console': console
+                            }
+      result[ iface.mac ].update( extra )
+
+    return result
+
+  @cinp.action( return_type={ 'type': 'Map' }, paramater_type_list=[ { 'type': 'Model', 'model': Site }, 'Integer' ] )
+  @staticmethod
+  def getDynamicPoolsDelta( site, watermark=None ):
+    # getDynamicPools keyed by pool name (as a string), changed pools have
+    # added_address_list and removed_address_list in place of address_list
+    pool_map = dict( ( str( item[ 'name' ] ), item ) for item in DHCPd.getDynamicPools( site ) )
+    ( result, previous ) = PoolSnapshot.delta( site, 'dynamic', pool_map, watermark )
+    for key, item in result[ 'changed' ].items():
+      old_address_set = set( previous[ key ][ 'address_list' ] )
+      address_set = set( item[ 'address_list' ] )
+      item = item.copy()
+      del item[ 'address_list' ]
+      item[ 'added_address_list' ] = [ address for address in pool_map[ key ][ 'address_list' ] if address not in old_address_set ]
+      item[ 'removed_address_list' ] = [ address for address in previous[ key ][ 'address_list' ] if address not in address_set ]
+      result[ 'changed' ][ key ] = item
+
+    return result
+
+  @cinp.action( return_type={ 'type': 'Map' }, paramater_type_list=[ { 'type': 'Model', 'model': Site }, 'Integer' ] )
+  @staticmethod
+  def getStaticPoolsDelta( site, watermark=None ):
+    # getStaticPools, only the macs added, changed and removed since the
+    # watermark from the last call, pass the returned watermark next time
+    ( result, _ ) = PoolSnapshot.delta( site, 'static', DHCPd.getStaticPools( site ), watermark )
 
     return result
 
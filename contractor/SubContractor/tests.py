@@ -0,0 +1,208 @@
+import pytest
+
+from contractor.Site.models import Site
+from contractor.BluePrint.models import FoundationBluePrint, StructureBluePrint
+from contractor.Building.models import Foundation, Structure
+from contractor.Utilities.models import Network, AddressBlock, NetworkAddressBlock, Address, DynamicAddress, RealNetworkInterface, AbstractNetworkInterface, AggregatedNetworkInterface
+from contractor.SubContractor.models import DHCPd, PoolSnapshot
+
+
+def _structure( site, fb, sb, name, interface_list ):
+  f = Foundation( locator='f{0}'.format( name ), site=site, blueprint=fb )
+  f.full_clean()
+  f.save()
+
+  for ( iface_name, mac, network ) in interface_list:
+    iface = RealNetworkInterface( foundation=f, name=iface_name, physical_location=iface_name, mac=mac, network=network )
+    iface.full_clean()
+    iface.save()
+
+  st = Structure( hostname='s{0}'.format( name ), foundation=f, blueprint=sb, site=site )
+  st.full_clean()
+  st.save()
+
+  return st
+
+
+def _address( structure, address_block, offset, interface_name, is_primary=False ):
+  addr = Address( networked=structure, address_block=address_block, offset=offset, interface_name=interface_name, is_primary=is_primary )
+  addr.full_clean()
+  addr.save()
+
+  return addr
+
+
+@pytest.mark.django_db
+def test_static_pools( django_assert_max_num_queries ):
+  s1 = Site( name='site1', description='test site1', config_values={ 'dns_servers': [ '10.0.0.53', '10.0.0.54' ], 'domain_name': 'test.local' } )
+  s1.full_clean()
+  s1.save()
+
+  n1 = Network( name='net1', site=s1, mtu=9000 )
+  n1.full_clean()
+  n1.save()
+
+  n2 = Network( name='net2', site=s1 )
+  n2.full_clean()
+  n2.save()
+
+  ab1 = AddressBlock( site=s1, name='block1', subnet='10.0.0.0', prefix=24, gateway_offset=1 )
+  ab1.full_clean()
+  ab1.save()
+
+  ab2 = AddressBlock( site=s1, name='block2', subnet='10.0.1.0', prefix=24 )
+  ab2.full_clean()
+  ab2.save()
+
+  nab = NetworkAddressBlock( network=n1, address_block=ab1, vlan=10 )
+  nab.full_clean()
+  nab.save()
+
+  nab = NetworkAddressBlock( network=n2, address_block=ab2 )
+  nab.full_clean()
+  nab.save()
+
+  fb = FoundationBluePrint( name='fdnb1', description='Foundation BluePrint 1', foundation_type_list=[ 'Unknown' ] )
+  fb.full_clean()
+  fb.save()
+
+  sb = StructureBluePrint( name='strb1', description='Structure BluePrint 1' )
+  sb.full_clean()
+  sb.save()
+  sb.foundation_blueprint_list.add( fb )
+
+  assert DHCPd.getStaticPools( s1 ) == {}
+
+  st1 = _structure( s1, fb, sb, 1, [ ( 'eth0', '00:00:00:00:00:01', n1 ), ( 'eth1', '00:00:00:00:01:01', n2 ) ] )
+  _address( st1, ab1, 10, 'eth0', True )
+  _address( st1, ab2, 10, 'eth1' )
+  _address( st1, ab2, 11, 'eth5' )  # no such interface
+
+  st2 = _structure( s1, fb, sb, 2, [ ( 'eth0', None, n1 ) ] )  # no mac
+  _address( st2, ab1, 20, 'eth0', True )
+
+  st3 = _structure( s1, fb, sb, 3, [ ( 'eth0', '00:00:00:00:00:03', n2 ), ( 'eth1', '00:00:00:00:01:03', n1 ) ] )
+  _address( st3, ab1, 30, 'eth0', True )  # network not in ab1
+
+  bond = AggregatedNetworkInterface( structure=st3, name='bond0', network=n1, primary_interface=RealNetworkInterface.objects.get( foundation=st3.foundation, name='eth1' ) )
+  bond.full_clean()
+  bond.save()
+  _address( st3, ab1, 31, 'bond0' )
+
+  abstract = AbstractNetworkInterface( structure=st3, name='abs0', network=n1 )
+  abstract.full_clean()
+  abstract.save()
+  _address( st3, ab1, 32, 'abs0' )  # abstract has no mac
+
+  extra = { 'dns_server': '10.0.0.53', 'domain_name': 'test.local' }
+  expected = {
+               '00:00:00:00:00:01': { 'ip_address': '10.0.0.10', 'netmask': '255.255.255.0', 'gateway': '10.0.0.1', 'host_name': 's1', 'config_uuid': st1.config_uuid, 'mtu': 9000, 'vlan': 10, 'console': 'console', **extra },
+               '00:00:00:00:01:01': { 'ip_address': '10.0.1.10', 'netmask': '255.255.255.0', 'gateway': None, 'host_name': 's1', 'config_uuid': st1.config_uuid, 'mtu': None, 'vlan': None, 'console': 'console', **extra },
+               '00:00:00:00:01:03': { 'ip_address': '10.0.0.31', 'netmask': '255.255.255.0', 'gateway': '10.0.0.1', 'host_name': 's3', 'config_uuid': st3.config_uuid, 'mtu': 9000, 'vlan': 10, 'console': 'console', **extra }
+             }
+  assert DHCPd.getStaticPools( s1 ) == expected
+
+  for i in range( 4, 24 ):
+    st = _structure( s1, fb, sb, i, [ ( 'eth0', '00:00:00:00:00:{0:02x}'.format( i ), n1 ) ] )
+    _address( st, ab1, 100 + i, 'eth0', True )
+
+  with django_assert_max_num_queries( 10 ):  # does not grow with the number of hosts
+    result = DHCPd.getStaticPools( s1 )
+
+  assert len( result ) == 23
+  assert result[ '00:00:00:00:00:17' ][ 'ip_address' ] == '10.0.0.123'
+
+  s1.config_values = {}
+  s1.full_clean()
+  s1.save()
+  assert DHCPd.getStaticPools( s1 )[ '00:00:00:00:00:01' ] == { 'ip_address': '10.0.0.10', 'netmask': '255.255.255.0', 'gateway': '10.0.0.1', 'host_name': 's1', 'config_uuid': st1.config_uuid, 'mtu': 9000, 'vlan': 10, 'console': 'console' }
+
+
+@pytest.mark.django_db
+def test_static_pools_delta( mocker ):
+  s1 = Site( name='site1', description='test site1' )
+  s1.full_clean()
+  s1.save()
+
+  s2 = Site( name='site2', description='test site2' )
+  s2.full_clean()
+  s2.save()
+
+  pool = { 'aa': { 'ip_address': '10.0.0.1' }, 'bb': { 'ip_address': '10.0.0.2' } }
+  mocker.patch( 'contractor.SubContractor.models.DHCPd.getStaticPools', lambda site: pool )
+
+  rc = DHCPd.getStaticPoolsDelta( s1 )
+  watermark = rc[ 'watermark' ]
+  assert rc == { 'watermark': watermark, 'full': True, 'added': pool, 'changed': {}, 'removed': [] }
+
+  assert DHCPd.getStaticPoolsDelta( s1, watermark ) == { 'watermark': watermark, 'full': False, 'added': {}, 'changed': {}, 'removed': [] }
+  assert PoolSnapshot.objects.count() == 1
+
+  pool = { 'aa': { 'ip_address': '10.0.0.3' }, 'cc': { 'ip_address': '10.0.0.2' } }
+  rc = DHCPd.getStaticPoolsDelta( s1, watermark )
+  assert rc[ 'watermark' ] != watermark
+  assert rc == { 'watermark': rc[ 'watermark' ], 'full': False, 'added': { 'cc': { 'ip_address': '10.0.0.2' } }, 'changed': { 'aa': { 'ip_address': '10.0.0.3' } }, 'removed': [ 'bb' ] }
+  assert DHCPd.getStaticPoolsDelta( s1, watermark ) == rc  # an old watermark still works
+  watermark2 = rc[ 'watermark' ]
+
+  assert DHCPd.getStaticPoolsDelta( s2, watermark )[ 'full' ] is True  # watermark from a different site
+  assert DHCPd.getStaticPoolsDelta( s1, watermark2 + 100 )[ 'full' ] is True
+
+  for i in range( 0, 3 ):
+    pool = { 'aa': { 'ip_address': '10.0.1.{0}'.format( i ) } }
+    rc = DHCPd.getStaticPoolsDelta( s1, watermark2 )
+    assert rc[ 'full' ] is False
+
+  assert PoolSnapshot.objects.filter( site=s1 ).count() == 5
+  assert DHCPd.getStaticPoolsDelta( s1, watermark )[ 'full' ] is False
+
+  pool = { 'aa': { 'ip_address': '10.0.2.1' } }
+  rc = DHCPd.getStaticPoolsDelta( s1, watermark2 )
+  assert rc[ 'full' ] is False
+  assert PoolSnapshot.objects.filter( site=s1 ).count() == 5
+  rc = DHCPd.getStaticPoolsDelta( s1, watermark )  # the oldest is cleaned up
+  assert rc == { 'watermark': rc[ 'watermark' ], 'full': True, 'added': pool, 'changed': {}, 'removed': [] }
+
+
+@pytest.mark.django_db
+def test_dynamic_pools_delta():
+  s1 = Site( name='site1', description='test site1', config_values={ 'dns_servers': [ '10.0.0.53' ], 'domain_name': 'test.local' } )
+  s1.full_clean()
+  s1.save()
+
+  ab1 = AddressBlock( site=s1, name='block1', subnet='10.0.0.0', prefix=24, gateway_offset=1 )
+  ab1.full_clean()
+  ab1.save()
+
+  ab2 = AddressBlock( site=s1, name='block2', subnet='10.0.1.0', prefix=24 )
+  ab2.full_clean()
+  ab2.save()
+
+  for offset in ( 12, 10, 11 ):  # the address_list is in offset order, not the order they were added
+    da = DynamicAddress( address_block=ab1, offset=offset )
+    da.full_clean()
+    da.save()
+
+  rc = DHCPd.getDynamicPoolsDelta( s1 )
+  watermark = rc[ 'watermark' ]
+  item = { 'gateway': '10.0.0.1', 'name': ab1.pk, 'netmask': '255.255.255.0', 'dns_server': '10.0.0.53', 'domain_name': 'test.local', 'address_list': [ '10.0.0.10', '10.0.0.11', '10.0.0.12' ] }
+  assert rc == { 'watermark': watermark, 'full': True, 'added': { str( ab1.pk ): item }, 'changed': {}, 'removed': [] }
+  assert DHCPd.getDynamicPoolsDelta( s1, watermark ) == { 'watermark': watermark, 'full': False, 'added': {}, 'changed': {}, 'removed': [] }
+
+  DynamicAddress.objects.get( address_block=ab1, offset=11 ).delete()
+  da = DynamicAddress( address_block=ab1, offset=13 )
+  da.full_clean()
+  da.save()
+  da = DynamicAddress( address_block=ab2, offset=10 )
+  da.full_clean()
+  da.save()
+
+  rc = DHCPd.getDynamicPoolsDelta( s1, watermark )
+  watermark = rc[ 'watermark' ]
+  changed = { 'gateway': '10.0.0.1', 'name': ab1.pk, 'netmask': '255.255.255.0', 'dns_server': '10.0.0.53', 'domain_name': 'test.local', 'added_address_list': [ '10.0.0.13' ], 'removed_address_list': [ '10.0.0.11' ] }
+  added = { 'gateway': None, 'name': ab2.pk, 'netmask': '255.255.255.0', 'dns_server': '10.0.0.53', 'domain_name': 'test.local', 'address_list': [ '10.0.1.10' ] }
+  assert rc == { 'watermark': watermark, 'full': False, 'added': { str( ab2.pk ): added }, 'changed': { str( ab1.pk ): changed }, 'removed': [] }
+
+  DynamicAddress.objects.filter( address_block=ab2 ).delete()
+  rc = DHCPd.getDynamicPoolsDelta( s1, watermark )
+  assert rc == { 'watermark': rc[ 'watermark' ], 'full': False, 'added': {}, 'changed': {}, 'removed': [ str( ab2.pk ) ] }
@@ -1,8 +1,10 @@
 import re
 import random
+import bisect
+import threading
 
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Q, Max, Count
 from django.db.models.signals import m2m_changed
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 
@@ -11,12 +13,21 @@ from cinp.orm_django import DjangoCInP as CInP
 from contractor.fields import MapField, IpAddressField, hostname_regex, name_regex
 from contractor.BluePrint.models import PXE
 from contractor.Site.models import Site
-from contractor.lib.ip import IpIsV4, CIDRNetworkBounds, StrToIp, IpToStr, CIDRNetworkSize, CIDRNetmask, CIDRNetworkRange
+from contractor.lib.ip import IpIsV4, CIDRNetworkBounds, StrToIp, IpToStr, CIDRNetworkSize, CIDRNetmask
 
 cinp = CInP( 'Utilities', '0.1' )
 
 network_name_regex = re.compile( r'^[a-zA-Z0-9][a-zA-Z0-9_\-]*(\.[0-9]{1,4})?$' )  # the ".[0-9]" is for networks that are vlans of other networks, some things like proxmox treat these as un-named special networks
 
+MAX_OFFSET = 2147483647  # BaseAddress.offset is an IntegerField, ipv6 blocks can be bigger than that
+
+# site pk -> ( [ subnet, ... ], [ ( subnet, max address, block pk ), ... ] ),
+# sorted by subnet.  The blocks in a site do not overlap, so the only block an ip
+# can be in is the one just before where bisect would insert it.  Re-loaded when
+# the check (see _blockIndex) changes.
+_block_index = ( None, {} )
+_block_index_lock = threading.Lock()
+
 
 class UtilitiesException( ValueError ):
   def __init__( self, code, message ):
@@ -200,29 +211,74 @@ class AddressBlock( models.Model ):
   def isIpV4( self ):
     return IpIsV4( StrToIp( self.subnet ) )
 
-  @cinp.action( return_type={ 'type': 'Model', 'model': 'contractor.Utilities.models.Address' }, paramater_type_list=[ { 'type': 'Model', 'model': 'contractor.Utilities.models.Networked' }, { 'type': 'String' }, { 'type': 'Boolean' } ] )
-  def nextAddress( self, networked, interface_name, is_primary ):  # TODO: wrap this in a transaction, or some other way to unwrap everything if it fails
-    address = Address( networked=networked, interface_name=interface_name, is_primary=is_primary )
-    if networked.structure.foundation.subclass.__class__.__name__ == 'DockerFoundation':
-      # address.pointer = Address.objects.get( networked=structure.foundation.docker_host.members[0], interface_name='eth0' )
-      return None  # set map_ports will do the address
+  def _freeOffsets( self, count ):
+    # random unused offsets, worked out from the runs of free offsets between
+    # the used ones, so the cost is by the number of addresses in use, not the
+    # size of the block.  Lock the block first (see nextAddresses) so the
+    # offsets are still free when the addresses are saved
+    ( low_offset, high_offset ) = self.offsetBounds
+    high_offset = min( high_offset, MAX_OFFSET )
+    used_offsets = set( BaseAddress.objects.filter( address_block=self, offset__gte=low_offset, offset__lte=high_offset ).values_list( 'offset', flat=True ) )
+    if self.gateway_offset is not None:
+      used_offsets.add( self.gateway_offset )
+
+    start_list = []  # first offset of each free run
+    total_list = []  # number of free offsets up to and including each free run
+    total = 0
+    next_offset = low_offset
+    for offset in sorted( used_offsets ) + [ high_offset + 1 ]:
+      if offset > next_offset:
+        start_list.append( next_offset )
+        total += offset - next_offset
+        total_list.append( total )
 
-    else:  # TODO: either retry till all_offsets is empty, or lock the Address table(s)
-      all_offsets = set( CIDRNetworkRange( StrToIp( self.subnet ), self.prefix, False, True ) )
-      if self.gateway_offset is not None:
-        all_offsets = all_offsets - set( [ self.gateway_offset ] )
+      next_offset = offset + 1
 
-      if not all_offsets:
-        raise UtilitiesException( 'NO_OFFSETS', 'No Available Offsets' )
+    if total < count:
+      raise UtilitiesException( 'NO_OFFSETS', 'No Available Offsets' )
 
-      used_offsets = set( BaseAddress.objects.filter( address_block=self, offset__isnull=False ).values_list( 'offset', flat=True ) )
-      address.address_block = self
-      address.offset = random.choice( list( all_offsets - used_offsets ) )
+    result = []
+    for index in random.sample( range( total ), count ):
+      run = bisect.bisect_right( total_list, index )
+      if run:
+        index -= total_list[ run - 1 ]
 
-    address.full_clean()
-    address.save()
+      result.append( start_list[ run ] + index )
 
-    return address
+    return result
+
+  @cinp.action( return_type={ 'type': 'Model', 'model': 'contractor.Utilities.models.Address' }, paramater_type_list=[ { 'type': 'Model', 'model': 'contractor.Utilities.models.Networked' }, { 'type': 'String' }, { 'type': 'Boolean' } ] )
+  def nextAddress( self, networked, interface_name, is_primary ):
+    address_list = self.nextAddresses( networked, interface_name, is_primary, 1 )
+    if not address_list:
+      return None
+
+    return address_list[0]
+
+  @cinp.action( return_type={ 'type': 'Model', 'model': 'contractor.Utilities.models.Address', 'is_array': True }, paramater_type_list=[ { 'type': 'Model', 'model': 'contractor.Utilities.models.Networked' }, { 'type': 'String' }, { 'type': 'Boolean' }, 'Integer' ] )
+  def nextAddresses( self, networked, interface_name, is_primary, count ):  # the first address is is_primary, the rest are aliases (alias_index 1, 2, ...)
+    if networked.structure.foundation.subclass.__class__.__name__ == 'DockerFoundation':
+      # address.pointer = Address.objects.get( networked=structure.foundation.docker_host.members[0], interface_name='eth0' )
+      return []  # set map_ports will do the address
+
+    if count < 1:
+      return []
+
+    with transaction.atomic():
+      AddressBlock.objects.select_for_update().filter( pk=self.pk ).first()  # other allocations from this block wait here till we are saved
+      address_list = []
+      for offset in self._freeOffsets( count ):
+        address = Address( networked=networked, interface_name=interface_name, address_block=self, offset=offset )
+        if address_list:
+          address.alias_index = len( address_list )
+        else:
+          address.is_primary = is_primary
+
+        address.full_clean()
+        address.save()
+        address_list.append( address )
+
+    return address_list
 
   @cinp.action( return_type='Map' )
   def usage( self ):
@@ -252,7 +308,7 @@ class AddressBlock( models.Model ):
   @cinp.check_auth()
   @staticmethod
   def checkAuth( user, verb, id_list, action=None ):
-    return cinp.basic_auth_check( user, verb, action, AddressBlock, { 'usage': None, 'nextAddress': 'Utilities.add_address' } )
+    return cinp.basic_auth_check( user, verb, action, AddressBlock, { 'usage': None, 'nextAddress': 'Utilities.add_address', 'nextAddresses': 'Utilities.add_address' } )
 
   def clean( self, *args, **kwargs ):
     super().clean( *args, **kwargs )
@@ -719,6 +775,51 @@ def aggregated_secondary_changed( sender, instance, action, pk_set, **kwards ):
 m2m_changed.connect( aggregated_secondary_changed, sender=AggregatedNetworkInterface.secondary_interfaces.through )
 
 
+def clearBlockIndex():
+  global _block_index
+
+  with _block_index_lock:
+    _block_index = ( None, {} )
+
+
+def _blockIndex():
+  global _block_index
+
+  # any block saved bumps the max updated, any deleted drops the count
+  result = AddressBlock.objects.aggregate( Max( 'updated' ), Count( 'pk' ) )
+  check = ( result[ 'updated__max' ], result[ 'pk__count' ] )
+
+  with _block_index_lock:
+    if _block_index[0] == check:
+      return _block_index[1]
+
+  block_map = {}
+  for ( pk, site_pk, subnet, max_address ) in AddressBlock.objects.values_list( 'pk', 'site_id', 'subnet', '_max_address' ):
+    block_map.setdefault( site_pk, [] ).append( ( StrToIp( subnet ), StrToIp( max_address ), pk ) )
+
+  index = {}
+  for site_pk, block_list in block_map.items():
+    block_list.sort()
+    index[ site_pk ] = ( [ block[0] for block in block_list ], block_list )
+
+  with _block_index_lock:
+    _block_index = ( check, index )
+
+  return index
+
+
+def _locateBlocks( ip_address_ip, site_index_list ):  # ( block pk, offset ) for each block ip_address_ip is in
+  result = []
+  for ( subnet_list, block_list ) in site_index_list:
+    pos = bisect.bisect_right( subnet_list, ip_address_ip ) - 1
+    if pos >= 0:
+      ( subnet, max_address, pk ) = block_list[ pos ]
+      if ip_address_ip <= max_address:
+        result.append( ( pk, ip_address_ip - subnet ) )
+
+  return result
+
+
 @cinp.model( not_allowed_verb_list=[ 'LIST', 'GET', 'CREATE', 'UPDATE', 'DELETE' ], property_list=( 'type', 'ip_address', 'subnet', 'netmask', 'prefix', 'gateway' ) )
 class BaseAddress( models.Model ):
   address_block = models.ForeignKey( AddressBlock, blank=True, null=True, on_delete=models.CASCADE )
@@ -810,34 +911,57 @@ class BaseAddress( models.Model ):
   @cinp.action( return_type={ 'type': 'Model', 'model': 'contractor.Utilities.models.BaseAddress' }, paramater_type_list=[ 'String', { 'type': 'Model', 'model': 'contractor.Site.models.Site' } ] )
   @staticmethod
   def lookup( ip_address, site=None ):
-    try:
-      ip_address_ip = StrToIp( ip_address )
-    except ValueError:
-      return None
+    return BaseAddress.lookupMany( [ ip_address ], site )[0]
 
-    located_list = []
-    ip_address = IpToStr( ip_address_ip )  # so it is in a consistant format
+  @cinp.action( return_type={ 'type': 'Model', 'model': 'contractor.Utilities.models.BaseAddress', 'is_array': True }, paramater_type_list=[ { 'type': 'String', 'is_array': True }, { 'type': 'Model', 'model': 'contractor.Site.models.Site' } ] )
+  @staticmethod
+  def lookupMany( ip_address_list, site=None ):  # same order as ip_address_list, None for the ones not found or found more than once
+    index = _blockIndex()
     if site is not None:
-      query_set = AddressBlock.objects.filter( site=site )
+      site_index_list = [ index[ site.pk ] ] if site.pk in index else []
     else:
-      query_set = AddressBlock.objects.all()
+      site_index_list = list( index.values() )
+
+    located_list = []
+    offset_map = {}  # block pk -> offsets to get
+    for ip_address in ip_address_list:
+      if ip_address is None:
+        raise ValueError( 'Invalid Ip Address' )
 
-    for address_block in query_set.filter( subnet__lte=ip_address, _max_address__gte=ip_address ):
-      offset = ip_address_ip - StrToIp( address_block.subnet )
       try:
-        located_list.append( BaseAddress.objects.get( address_block=address_block, offset=offset ) )
-      except BaseAddress.DoesNotExist:
-        pass
+        location_list = _locateBlocks( StrToIp( ip_address ), site_index_list )
+      except ValueError:
+        location_list = []
 
-    if len( located_list ) == 1:
-      return located_list[0]
+      location_list = [ location for location in location_list if location[1] <= MAX_OFFSET ]  # nothing can be stored past MAX_OFFSET
+      for ( block_pk, offset ) in location_list:
+        offset_map.setdefault( block_pk, set() ).add( offset )
 
-    return None
+      located_list.append( location_list )
+
+    address_map = {}
+    if offset_map:
+      query = Q()
+      for ( block_pk, offset_set ) in offset_map.items():
+        query |= Q( address_block_id=block_pk, offset__in=offset_set )
+
+      for address in BaseAddress.objects.filter( query ):
+        address_map[ ( address.address_block_id, address.offset ) ] = address
+
+    result = []
+    for location_list in located_list:
+      address_list = [ address_map[ location ] for location in location_list if location in address_map ]
+      if len( address_list ) == 1:
+        result.append( address_list[0] )
+      else:
+        result.append( None )
+
+    return result
 
   @cinp.check_auth()
   @staticmethod
   def checkAuth( user, verb, id_list, action=None ):
-    return cinp.basic_auth_check( user, verb, action, BaseAddress, { 'lookup': None } )
+    return cinp.basic_auth_check( user, verb, action, BaseAddress, { 'lookup': None, 'lookupMany': None } )
 
   def clean( self, *args, **kwargs ):
     super().clean( *args, **kwargs )
@@ -1044,6 +1168,43 @@ class Address( BaseAddress ):
     return 'Address in Block "{0}" offset "{1}" networked "{2}" on interface "{3}"'.format( self.address_block, self.offset, self.networked, self.interface_name )
 
 
+def interfaceMap( address_list ):
+  # address pk -> what address.interface would be, for all of address_list in a
+  # fixed number of queries.  select_related 'networked__structure' on the
+  # addresses, otherwise getting to the structure is a query each
+  structure_map = {}  # networked pk -> structure
+  for address in address_list:
+    try:
+      structure_map[ address.networked_id ] = address.networked.structure
+    except ObjectDoesNotExist:
+      pass
+
+  real_map = {}  # ( foundation pk, name ) -> interface
+  for iface in RealNetworkInterface.objects.filter( foundation__in=set( structure.foundation_id for structure in structure_map.values() ) ).select_related( 'network' ):
+    real_map[ ( iface.foundation_id, iface.name ) ] = iface
+
+  abstract_map = {}  # ( structure pk, name ) -> interface
+  for iface in AbstractNetworkInterface.objects.filter( structure__in=list( structure_map.keys() ) ).select_related( 'network', 'aggregatednetworkinterface__primary_interface__realnetworkinterface' ):
+    abstract_map[ ( iface.structure_id, iface.name ) ] = iface.subclass
+
+  result = {}
+  for address in address_list:
+    try:
+      structure = structure_map[ address.networked_id ]
+    except KeyError:
+      continue
+
+    try:
+      result[ address.pk ] = real_map[ ( structure.foundation_id, address.interface_name ) ]
+    except KeyError:
+      try:
+        result[ address.pk ] = abstract_map[ ( structure.pk, address.interface_name ) ]
+      except KeyError:
+        pass
+
+  return result
+
+
 @cinp.model( property_list=( 'type', 'ip_address', 'subnet', 'netmask', 'prefix', 'gateway' ) )
 class ReservedAddress( BaseAddress ):
   reason = models.CharField( max_length=50 )
@@ -4,7 +4,7 @@ from django.db import transaction
 from django.core.exceptions import ValidationError
 
 from contractor.lib.ip import StrToIp
-from contractor.Utilities.models import Networked, AddressBlock, Network, NetworkAddressBlock, BaseAddress, Address, ReservedAddress, DynamicAddress, NetworkInterface, RealNetworkInterface, AbstractNetworkInterface, AggregatedNetworkInterface
+from contractor.Utilities.models import UtilitiesException, Networked, AddressBlock, Network, NetworkAddressBlock, BaseAddress, Address, ReservedAddress, DynamicAddress, NetworkInterface, RealNetworkInterface, AbstractNetworkInterface, AggregatedNetworkInterface
 from contractor.Site.models import Site
 from contractor.BluePrint.models import FoundationBluePrint, StructureBluePrint
 from contractor.Building.models import Foundation, Structure
@@ -260,6 +260,81 @@ def test_addressblock_resize():
     ab.full_clean()
 
 
+@pytest.mark.django_db
+def test_addressblock_freeoffsets():
+  s1 = Site( name='tsite1', description='test site1' )
+  s1.full_clean()
+  s1.save()
+
+  ab = AddressBlock( site=s1, name='test', subnet='10.0.0.0', prefix=29, gateway_offset=1 )
+  ab.full_clean()
+  ab.save()
+
+  assert sorted( ab._freeOffsets( 5 ) ) == [ 2, 3, 4, 5, 6 ]
+
+  for offset in ( 3, 5 ):
+    ba = BaseAddress( address_block=ab, offset=offset )
+    ba.full_clean()
+    ba.save()
+
+  assert sorted( ab._freeOffsets( 3 ) ) == [ 2, 4, 6 ]
+  assert ab._freeOffsets( 1 )[0] in ( 2, 4, 6 )
+  with pytest.raises( UtilitiesException ):
+    ab._freeOffsets( 4 )
+
+  ab = AddressBlock( site=s1, name='big', subnet='2001:db8::', prefix=64 )  # to big to list out
+  ab.full_clean()
+  ab.save()
+
+  offset_list = ab._freeOffsets( 10 )
+  assert len( set( offset_list ) ) == 10
+  low_offset, high_offset = ab.offsetBounds
+  assert all( low_offset <= offset <= high_offset for offset in offset_list )
+
+
+@pytest.mark.django_db
+def test_addressblock_nextaddress():
+  s1 = Site( name='tsite1', description='test site1' )
+  s1.full_clean()
+  s1.save()
+
+  fb = FoundationBluePrint( name='testing', description='testing', foundation_type_list=[ 'Unknown' ] )
+  fb.full_clean()
+  fb.save()
+
+  sb = StructureBluePrint( name='testing2', description='testing2' )
+  sb.full_clean()
+  sb.save()
+  sb.foundation_blueprint_list.add( fb )
+
+  f1 = Foundation( locator='testf', site=s1, blueprint=fb )
+  f1.full_clean()
+  f1.save()
+
+  st1 = Structure( hostname='tests', foundation=f1, blueprint=sb, site=s1 )
+  st1.full_clean()
+  st1.save()
+
+  ab = AddressBlock( site=s1, name='test', subnet='10.0.0.0', prefix=29, gateway_offset=1 )
+  ab.full_clean()
+  ab.save()
+
+  assert ab.nextAddresses( st1, 'eth0', True, 0 ) == []
+
+  ad = ab.nextAddress( st1, 'eth0', True )
+  assert ad.offset in ( 2, 3, 4, 5, 6 )
+  assert ad.is_primary is True
+  assert ad.alias_index is None
+
+  address_list = ab.nextAddresses( st1, 'eth1', False, 4 )
+  assert [ i.alias_index for i in address_list ] == [ None, 1, 2, 3 ]
+  assert [ i.is_primary for i in address_list ] == [ False, False, False, False ]
+  assert sorted( [ ad.offset ] + [ i.offset for i in address_list ] ) == [ 2, 3, 4, 5, 6 ]
+
+  with pytest.raises( UtilitiesException ):
+    ab.nextAddress( st1, 'eth2', False )
+
+
 @pytest.mark.django_db
 def test_network():
   s1 = Site( name='tsite1', description='test site1' )
@@ -778,6 +853,31 @@ def test_baseaddress_lookup():
   assert ba.address_block == ab23
   assert ba.offset == 10
 
+  ip_list = [ 'asdf', '1.1.1.1', '10.0.0.10', '1.2.3.10', '10.0.1.10', '1.2.3.10' ]
+  assert BaseAddress.lookupMany( [] ) == []
+  assert BaseAddress.lookupMany( ip_list ) == [ None, None, None, BaseAddress.objects.get( address_block=ab13, offset=10 ), None, BaseAddress.objects.get( address_block=ab13, offset=10 ) ]
+  assert BaseAddress.lookupMany( ip_list, site=s2 ) == [ None, None, BaseAddress.objects.get( address_block=ab21, offset=10 ), None, BaseAddress.objects.get( address_block=ab23, offset=10 ), None ]
+
+  s3 = Site( name='tsite3', description='test site3' )
+  s3.full_clean()
+  s3.save()
+
+  assert BaseAddress.lookupMany( ip_list, site=s3 ) == [ None ] * 6
+
+  ab23.delete()  # the block index has to notice
+  assert BaseAddress.lookup( '10.0.1.10', site=s2 ) is None
+  ba = BaseAddress.lookup( '10.0.1.10' )
+  assert ba.address_block == ab11
+  assert ba.offset == 266
+
+  ab13.subnet = StrToIp( '1.2.4.0' )
+  ab13.full_clean()
+  ab13.save()
+  assert BaseAddress.lookup( '1.2.3.10' ) is None
+  ba = BaseAddress.lookup( '1.2.4.10' )
+  assert ba.address_block == ab13
+  assert ba.offset == 10
+
 
 @pytest.mark.django_db
 def test_address():
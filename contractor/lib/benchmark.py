@@ -0,0 +1,86 @@
+import gc
+import json
+import time
+import platform
+
+# minimal harness for the *_bench.py modules, run them with
+# python3 -m contractor.<module path>_bench
+#
+# results can be saved as json with save() and checked against a saved run
+# with compare(), times are only comparable on the same machine
+
+
+def bench( name, func, repeat=5, number=1 ):
+  # returns ( name, best time of repeat runs, in seconds per call of func )
+  gc.collect()
+  gc_enabled = gc.isenabled()
+  gc.disable()
+  try:
+    best = None
+    for _ in range( 0, repeat ):
+      start = time.perf_counter()
+      for _ in range( 0, number ):
+        func()
+      elapsed = ( time.perf_counter() - start ) / number
+      if best is None or elapsed < best:
+        best = elapsed
+
+  finally:
+    if gc_enabled:
+      gc.enable()
+
+  return ( name, best )
+
+
+def report( title, result_list, baseline=None ):
+  # baseline is the name of the result everything else is compared to
+  baseline_time = None
+  if baseline is not None:
+    baseline_time = dict( result_list )[ baseline ]
+
+  print( title )
+  for ( name, elapsed ) in result_list:
+    line = '  {0:<40} {1:>12.3f} ms'.format( name, elapsed * 1000 )
+    if baseline_time is not None and name != baseline:
+      line += '  {0:>8.1f}x'.format( baseline_time / elapsed )
+
+    print( line )
+
+
+def save( filename, result_map ):
+  # result_map is { title: result_list }
+  data = {
+           'python': platform.python_version(),
+           'machine': platform.machine(),
+           'timestamp': time.time(),
+           'results': dict( ( title, dict( result_list ) ) for ( title, result_list ) in result_map.items() )
+         }
+
+  with open( filename, 'w' ) as fp:
+    json.dump( data, fp, indent=2, sort_keys=True )
+
+
+def load( filename ):
+  # returns the { title: { name: seconds } } from a file written by save()
+  with open( filename, 'r' ) as fp:
+    return json.load( fp )[ 'results' ]
+
+
+def compare( baseline_map, result_map, threshold=1.25, minimum=0.00001 ):
+  # baseline_map is from load(), result_map is the same as for save()
+  # returns a list of ( title, name, baseline seconds, seconds ) that are more than threshold times slower
+  # than the baseline, results that are not in the baseline are skipped, as are differences of less than
+  # minimum seconds, those are timer noise
+  result = []
+  for ( title, result_list ) in result_map.items():
+    baseline = baseline_map.get( title, {} )
+    for ( name, elapsed ) in result_list:
+      try:
+        baseline_time = baseline[ name ]
+      except KeyError:
+        continue
+
+      if elapsed > baseline_time * threshold and elapsed - baseline_time > minimum:
+        result.append( ( title, name, baseline_time, elapsed ) )
+
+  return result
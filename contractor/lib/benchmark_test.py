@@ -0,0 +1,34 @@
+import os
+import json
+import tempfile
+
+from contractor.lib.benchmark import bench, save, load, compare
+
+
+def test_bench():
+  call_list = []
+  ( name, elapsed ) = bench( 'test', lambda: call_list.append( 1 ), repeat=3, number=2 )
+  assert name == 'test'
+  assert elapsed >= 0
+  assert len( call_list ) == 6
+
+
+def test_save_load():
+  result_map = { 'parse': [ ( 'small', 0.001 ), ( 'big', 0.5 ) ], 'run': [ ( 'loop', 0.25 ) ] }
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    filename = os.path.join( tmp_dir, 'bench.json' )
+    save( filename, result_map )
+    with open( filename, 'r' ) as fp:
+      data = json.load( fp )
+
+    assert 'python' in data
+    assert load( filename ) == { 'parse': { 'small': 0.001, 'big': 0.5 }, 'run': { 'loop': 0.25 } }
+
+
+def test_compare():
+  baseline_map = { 'parse': { 'small': 0.001, 'big': 0.5 }, 'run': { 'loop': 0.25 } }
+  assert compare( baseline_map, { 'parse': [ ( 'small', 0.0011 ), ( 'big', 0.4 ) ], 'run': [ ( 'loop', 0.25 ) ] } ) == []
+  assert compare( baseline_map, { 'parse': [ ( 'small', 0.002 ), ( 'big', 0.7 ) ] } ) == [ ( 'parse', 'small', 0.001, 0.002 ), ( 'parse', 'big', 0.5, 0.7 ) ]
+  assert compare( baseline_map, { 'parse': [ ( 'big', 0.7 ) ] }, threshold=1.5 ) == []
+  assert compare( baseline_map, { 'new': [ ( 'thing', 1.0 ) ], 'parse': [ ( 'other', 1.0 ) ] } ) == []  # not in the baseline
+  assert compare( { 'status': { 'call': 0.000004 } }, { 'status': [ ( 'call', 0.000006 ) ] } ) == []  # noise
@@ -1,18 +1,41 @@
 import copy
+import functools
 import json
+import threading
+from collections import OrderedDict, ChainMap
 from datetime import datetime, timezone
-from jinja2 import Environment, Undefined, TemplateError, TemplateSyntaxError
+from jinja2 import Environment, Undefined, TemplateError, TemplateSyntaxError, meta, nodes
 
 from django.conf import settings
+from django.db.models import Max, Count
 
 from contractor.fields import config_name_regex
 
 VALUE_SORT_ORDER = '-_0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz<>~'
+_VALUE_SORT_MAP = dict( ( c, i ) for ( i, c ) in enumerate( VALUE_SORT_ORDER ) )
+LAYER_CACHE_SIZE = 500
+TEMPLATE_CACHE_SIZE = 5000
 _jinja_environment = None
 
+# merged config_values of site chains and blueprint trees, the layers that
+# everything else is composed from.  The key has the pk and updated of every
+# Site/BluePrint that went into the layer, in the order they were applied, so
+# when one changes the key changes and the old layer falls off the end.
+_layer_cache = OrderedDict()
+_layer_cache_lock = threading.Lock()
+
+# model -> ( check, { pk: ( updated, [ parent pk, ... ] ) } ), so the site and
+# blueprint parents can be walked with out a query per level.  Re-loaded when
+# the check (see _snapshotCheck) changes.
+_snapshot_map = {}
+_snapshot_lock = threading.Lock()
+
 
 def value_key( item ):
-  return VALUE_SORT_ORDER.index( item[0] )
+  try:
+    return _VALUE_SORT_MAP[ item[0] ]
+  except KeyError:
+    raise ValueError( 'invalid config value name "{0}"'.format( item ) )
 
 
 def JSONDefault( obj ):
@@ -140,41 +163,114 @@ def _updateConfig( config_value_map, class_list, config ):
       config[ name ] = value
 
 
-def _siteConfigInternal( site, class_list, config ):
-  last_modified = site.updated
+def clearConfigCache():
+  with _layer_cache_lock:
+    _layer_cache.clear()
 
-  if site.parent is not None:
-    last_modified = max( last_modified, _siteConfigInternal( site.parent, class_list, config ) )
+  with _snapshot_lock:
+    _snapshot_map.clear()
 
-  _updateConfig( copy.deepcopy( site.config_values ), class_list, config )
 
-  return last_modified
+def _snapshotCheck( model, parent_field ):
+  # anything saved bumps the max updated, anything deleted drops the count, a
+  # new parent link bumps the max id of the link table
+  result = model.objects.aggregate( Max( 'updated' ), Count( 'pk' ) )
+  check = ( result[ 'updated__max' ], result[ 'pk__count' ] )
+  if parent_field.many_to_many:
+    result = parent_field.remote_field.through.objects.aggregate( Max( 'pk' ), Count( 'pk' ) )
+    check += ( result[ 'pk__max' ], result[ 'pk__count' ] )
 
+  return check
 
-def _siteConfig( site, class_list, config ):
-  last_modified = _siteConfigInternal( site, class_list, config )
 
-  config[ '_site' ] = site.pk
+def _snapshot( model, parent_name ):
+  parent_field = model._meta.get_field( parent_name )
+  check = _snapshotCheck( model, parent_field )
 
-  return last_modified
+  with _snapshot_lock:
+    try:
+      ( cached_check, snapshot ) = _snapshot_map[ model ]
+      if cached_check == check:
+        return snapshot
+    except KeyError:
+      pass
 
+  if parent_field.many_to_many:
+    snapshot = dict( ( pk, ( updated, [] ) ) for ( pk, updated ) in model.objects.values_list( 'pk', 'updated' ) )
+    through = parent_field.remote_field.through
+    for ( pk, parent_pk ) in through.objects.order_by( 'pk' ).values_list( parent_field.m2m_field_name(), parent_field.m2m_reverse_field_name() ):
+      snapshot[ pk ][1].append( parent_pk )
 
-def _bluePrintConfigInternal( blueprint, class_list, config ):
-  last_modified = blueprint.updated
+  else:
+    snapshot = dict( ( pk, ( updated, [ parent_pk ] if parent_pk is not None else [] ) ) for ( pk, updated, parent_pk ) in model.objects.values_list( 'pk', 'updated', parent_name ) )
 
-  for parent in blueprint.parent_list.all():
-    last_modified = max( last_modified, _bluePrintConfigInternal( parent, class_list, config ) )
+  with _snapshot_lock:
+    _snapshot_map[ model ] = ( check, snapshot )
 
-  _updateConfig( copy.deepcopy( blueprint.config_values ), class_list, config )  # we are deepcopying b/c sometimes something will tweek the values (ie: resords/lib.py stripping passwords) and we don't want that to modify the origional values
-  return last_modified
+  return snapshot
 
 
-def _bluePrintConfig( blueprint, class_list, config ):
-  last_modified = _bluePrintConfigInternal( blueprint, class_list, config )
+def _applyOrder( snapshot, pk, pk_list ):  # parents first, the same order the old recursive walk did, including visiting shared parents more than once
+  for parent_pk in snapshot[ pk ][1]:
+    _applyOrder( snapshot, parent_pk, pk_list )
 
-  config[ '_blueprint' ] = blueprint.pk
+  pk_list.append( pk )
 
-  return last_modified
+
+def _part( model, parent_name, marker, pk ):
+  # ( marker, model, ( ( pk, updated ), ... ) ) for pk and it's parents, ie: one
+  # site chain or blueprint tree
+  snapshot = _snapshot( model, parent_name )
+  pk_list = []
+  _applyOrder( snapshot, pk, pk_list )
+
+  return ( marker, model, tuple( ( i, snapshot[ i ][0] ) for i in pk_list ) )
+
+
+def _sitePart( site_class, site_pk ):
+  return _part( site_class, 'parent', '_site', site_pk )
+
+
+def _bluePrintPart( blueprint_class, blueprint_pk ):
+  return _part( blueprint_class, 'parent_list', '_blueprint', blueprint_pk )
+
+
+def _layer( part_list, class_list ):
+  # the merged config of all the parts, the result is shared, do not modify it
+  key = ( part_list, class_list )
+  with _layer_cache_lock:
+    try:
+      config = _layer_cache[ key ]
+      _layer_cache.move_to_end( key )
+      return config
+    except KeyError:
+      pass
+
+  if len( part_list ) > 1:
+    config = copy.deepcopy( _layer( part_list[ :-1 ], class_list ) )  # so a structure and a foundation on the same blueprint and site share the blueprint layer
+  else:
+    config = {}
+
+  ( marker, model, pk_list ) = part_list[ -1 ]
+  value_map = {}
+  cacheable = True
+  for ( pk, updated, config_values ) in model.objects.filter( pk__in=set( i[0] for i in pk_list ) ).values_list( 'pk', 'updated', 'config_values' ):
+    value_map[ pk ] = config_values
+    cacheable &= ( pk, updated ) in pk_list  # changed since the snapshot, use it but don't keep it under the old key
+
+  for ( pk, _ ) in pk_list:
+    _updateConfig( copy.deepcopy( value_map[ pk ] ), class_list, config )  # deepcopy, a value can be used more than once, and _updateConfig can modify the values it is applying
+
+  config[ marker ] = pk_list[ -1 ][0]
+
+  if cacheable:
+    with _layer_cache_lock:
+      _layer_cache[ key ] = config
+      _layer_cache.move_to_end( key )
+      while len( _layer_cache ) > LAYER_CACHE_SIZE:
+        _layer_cache.popitem( last=False )
+
+  return config
 
 
 def _foundationConfig( foundation, class_list, config ):
@@ -187,37 +283,85 @@ def _foundationConfig( foundation, class_list, config ):
   return foundation.updated
 
 
-def _structureConfig( structure, class_list, config ):
-  _updateConfig( copy.deepcopy( structure.config_values ), class_list, config )
+def _classList( target ):
+  if hasattr( target, 'class_list' ):
+    return target.class_list
+
+  elif hasattr( target, 'foundation' ):
+    return target.foundation.subclass.class_list
+
+  return []
 
-  config.update( structure.configAttributes() )
-  return structure.updated
 
+def _isFoundation( target ):
+  return 'Foundation' in [ i.__name__ for i in target.__class__.__mro__ ]
 
-def getConfig( target ):
-  config = {}
-  last_modified = datetime( 1, 1, 1, tzinfo=timezone.utc )
 
-  if hasattr( target, 'class_list' ):
-    class_list = target.class_list
+def _isAddress( target ):
+  return 'BaseAddress' in [ i.__name__ for i in target.__class__.__mro__ ]
 
-  elif hasattr( target, 'foundation' ):
-    class_list = target.foundation.subclass.class_list
 
-  else:
-    class_list = []
+def _relatedModel( target, field_name ):
+  return target._meta.get_field( field_name ).related_model
 
+
+def _configParts( target ):
   if target.__class__.__name__ == 'Site':
-    last_modified = max( last_modified, _siteConfig( target, class_list, config ) )
+    return ( _sitePart( target.__class__, target.pk ), )
 
   elif target.__class__.__name__ in ( 'BluePrint', 'StructureBluePrint', 'FoundationBluePrint' ):
-    last_modified = max( last_modified, _bluePrintConfig( target, class_list, config ) )
+    return ( _bluePrintPart( target.__class__, target.pk ), )
+
+  elif target.__class__.__name__ == 'Structure' or _isFoundation( target ):
+    return ( _bluePrintPart( _relatedModel( target, 'blueprint' ), target.blueprint_id ), _sitePart( _relatedModel( target, 'site' ), target.site_id ) )
+
+  elif _isAddress( target ):
+    return ( _sitePart( _relatedModel( target.address_block, 'site' ), target.address_block.site_id ), )
+
+  raise ValueError( 'Don\'t know how to get config for "{0}"'.format( target ) )
+
+
+def _partsLastModified( part_list ):
+  last_modified = datetime( 1, 1, 1, tzinfo=timezone.utc )
+  for ( _, _, pk_list ) in part_list:
+    for ( _, updated ) in pk_list:
+      last_modified = max( last_modified, updated )
+
+  return last_modified
+
+
+def getConfigValues( target ):
+  # only the config_values of the blueprints, sites and the structure, merged
+  # together.  Everything in here is covered by the '__last_modified' it
+  # returns, so the result can be cached and handed back to getConfig for as
+  # long as configLastModified( target ) dosen't change.  The generated
+  # attributes (interfaces, addresses, etc) are added by getConfig, they can
+  # change with out the updated of anything changing.
+  part_list = _configParts( target )
+  config = copy.deepcopy( _layer( part_list, tuple( _classList( target ) ) ) )  # we are deepcopying b/c sometimes something will tweek the values (ie: resords/lib.py stripping passwords) and we don't want that to modify the cached values
+  last_modified = _partsLastModified( part_list )
 
-  elif target.__class__.__name__ == 'Structure':
-    last_modified = max( last_modified, _bluePrintConfig( target.blueprint, class_list, config ) )
-    last_modified = max( last_modified, _siteConfig( target.site, class_list, config ) )
-    last_modified = max( last_modified, _foundationConfig( target.foundation.subclass, class_list, config ) )
-    last_modified = max( last_modified, _structureConfig( target, class_list, config ) )
+  if target.__class__.__name__ == 'Structure':  # the top layer, not cached, config_values names can not start with '_', so applying these before the foundation's attributes dosen't change anything
+    _updateConfig( copy.deepcopy( target.config_values ), _classList( target ), config )
+    last_modified = max( last_modified, target.updated )
+
+  config[ '__last_modified' ] = last_modified
+
+  return config
+
+
+def getConfig( target, value_config=None ):
+  # value_config is a result of getConfigValues( target ), if it is None getConfigValues is called
+  if value_config is None:
+    config = getConfigValues( target )
+  else:
+    config = dict( value_config )
+
+  last_modified = config[ '__last_modified' ]
+
+  if target.__class__.__name__ == 'Structure':
+    last_modified = max( last_modified, _foundationConfig( target.foundation.subclass, None, config ) )
+    config.update( target.configAttributes() )
     try:
       job = target.getJob()
       if job is not None:
@@ -231,10 +375,8 @@ def getConfig( target ):
     except AttributeError:
       pass
 
-  elif 'Foundation' in [ i.__name__ for i in target.__class__.__mro__ ]:
-    last_modified = max( last_modified, _bluePrintConfig( target.blueprint, class_list, config ) )
-    last_modified = max( last_modified, _siteConfig( target.site, class_list, config ) )
-    last_modified = max( last_modified, _foundationConfig( target, class_list, config ) )
+  elif _isFoundation( target ):
+    last_modified = max( last_modified, _foundationConfig( target, None, config ) )
     try:
       config[ '_structure_id' ] = target.structure.pk
     except AttributeError:
@@ -247,12 +389,6 @@ def getConfig( target ):
     except AttributeError:
       pass
 
-  elif 'BaseAddress' in [ i.__name__ for i in target.__class__.__mro__ ]:
-    last_modified = max( last_modified, _siteConfig( target.address_block.site, class_list, config ) )
-
-  else:
-    raise ValueError( 'Don\'t know how to get config for "{0}"'.format( target ) )
-
   # Global Attributes
   config[ '__last_modified' ] = last_modified
   config[ '__timestamp' ] = datetime.now( timezone.utc )
@@ -266,39 +402,171 @@ def getConfig( target ):
   return config
 
 
-def _merge( target, value_map ):
-  if isinstance( target, dict ):
-    dirty = False
-    new = {}
-    for key in target.keys():
-      new[ key ], tmp = _merge( target[ key ], value_map )
-      dirty |= tmp
+def _foundationLastModified( foundation ):
+  complex = foundation.complex
+  if complex is not None:
+    return max( foundation.updated, complex.updated )
+
+  return foundation.updated
+
+
+def configLastModified( target ):
+  # the same value getConfig( target ) would put in '__last_modified', with out
+  # loading or merging any of the config_values
+  last_modified = _partsLastModified( _configParts( target ) )
+
+  if target.__class__.__name__ == 'Structure':
+    return max( last_modified, target.updated, _foundationLastModified( target.foundation.subclass ) )
 
-    return new, dirty
+  elif _isFoundation( target ):
+    return max( last_modified, _foundationLastModified( target ) )
 
-  if isinstance( target, list ):
-    dirty = False
-    new = []
-    for i in range( 0, len( target ) ):
-      val, tmp = _merge( target[ i ], value_map )
-      new.append( val )
-      dirty |= tmp
+  return last_modified
+
+
+def _referencePath( node ):
+  # ( name, key, ... ) for a name followed by constant attribute/item lookups, ie: a.b[ 1 ], None if node is not one
+  if isinstance( node, nodes.Name ):
+    return ( node.name, )
 
-    return new, dirty
+  if isinstance( node, nodes.Getattr ):
+    key = node.attr
+  elif isinstance( node, nodes.Getitem ) and isinstance( node.arg, nodes.Const ):
+    key = node.arg.value
+  else:
+    return None
+
+  path = _referencePath( node.node )
+  if path is None:
+    return None
 
-  if isinstance( target, str ):
-    new = _jinjaEnv().from_string( target ).render( **value_map )
-    return new, new != target
+  return path + ( key, )
 
-  return target, False
+
+def _referencePaths( node, name_set, result ):
+  path = _referencePath( node )
+  if path is not None:
+    if path[0] in name_set:
+      result.add( path )
+
+    return
+
+  for child in node.iter_child_nodes():
+    _referencePaths( child, name_set, result )
+
+
+@functools.lru_cache( maxsize=TEMPLATE_CACHE_SIZE )
+def _compile( source ):
+  # returns the compiled template and the set of paths ( name, key, ... ) it references, the
+  # same strings come up in every config, so only parse/compile them once
+  env = _jinjaEnv()
+  ast = env.parse( source )
+
+  reference_set = set()
+  _referencePaths( ast, meta.find_undeclared_variables( ast ), reference_set )
+
+  return ( env.from_string( ast ), frozenset( reference_set ) )
+
+
+def _isLiteral( target ):
+  # strings that render to themselves, jinja would strip a trailing newline
+  # and translate \r\n, so those need to go through jinja too
+  return not ( '{{' in target or '{%' in target or '{#' in target or '\r' in target or target.endswith( '\n' ) )
+
+
+def _render( template, value_map ):
+  # like template.render( **value_map ), with out copying value_map into a
+  # new dict for each render, value_map is used as is and is not modified
+  context = template.new_context( value_map, shared=True )
+  try:
+    return template.environment.concat( template.root_render_func( context ) )
+  except Exception:
+    return template.environment.handle_exception()
+
+
+def _mergeString( target, value_map, resolve ):
+  seen_set = set()
+  while not _isLiteral( target ):  # render until it stops changing, a value can render into another template
+    ( template, reference_set ) = _compile( target )
+    for path in reference_set:
+      resolve( path )
+
+    seen_set.add( target )
+    new = _render( template, value_map )
+    if new == target:
+      break
+
+    if new in seen_set or target in new:  # going around in circles, or it contains it's self ( partly merged ) and will keep growing
+      raise ValueError( 'config value template "{0}" has a circular reference'.format( target ) )
+
+    target = new
+
+  return target
 
 
 def mergeValues( value_map ):
+  # each value is rendered once, after the values it references, ie: a depth
+  # first topological sort, down to the dict/list items, so an item can use
+  # it's siblings.  A value that needs it's self, directly or through other
+  # values, is an error.  A dict/list used as a whole from inside of it's self
+  # gets what is merged so far.
   result = copy.deepcopy( value_map )
+  render_map = ChainMap( result, _jinjaEnv().globals )  # shared=True skips the globals, so they are chained in here
+  state_map = {}  # path -> False while it is being rendered, True when done
+
+  def merge( container, key, path, partial=False ):
+    state = state_map.get( path, None )
+    if state is True:
+      return
+
+    value = container[ key ]
+    if state is False and not isinstance( value, ( dict, list ) ):
+      if partial:  # used as is, it is what is being rendered
+        return
+
+      raise ValueError( 'config value "{0}" has a circular reference'.format( '.'.join( str( i ) for i in path ) ) )
+
+    in_progress = state is False
+    state_map[ path ] = False
+    if isinstance( value, dict ):
+      for child_key in value.keys():
+        merge( value, child_key, path + ( child_key, ), in_progress )
+
+    elif isinstance( value, list ):
+      for index in range( 0, len( value ) ):
+        merge( value, index, path + ( index, ), in_progress )
+
+    elif isinstance( value, str ):
+      container[ key ] = _mergeString( value, render_map, resolve )
+
+    if not in_progress:
+      state_map[ path ] = True
+
+  def resolve( path ):
+    # merges what path points to, as far down as it exists
+    if path[0] not in result:
+      return
+
+    container = result
+    key = path[0]
+    depth = 1
+    for part in path[ 1: ]:
+      value = container[ key ]
+      if isinstance( value, dict ) and part in value:
+        pass
+      elif isinstance( value, list ) and isinstance( part, int ) and not isinstance( part, bool ) and 0 <= part < len( value ):
+        pass
+      else:
+        break
+
+      container = value
+      key = part
+      depth += 1
+
+    merge( container, key, path[ :depth ] )
 
-  dirty = True
-  while dirty:  # going to try and do this breath first, however we don't have a predictable order, not going to promise much
-    result, dirty = _merge( result, result )
+  for name in list( result.keys() ):
+    merge( result, name, ( name, ) )
 
   return result
 
@@ -0,0 +1,99 @@
+import argparse
+import copy
+import random
+
+from contractor.lib.benchmark import bench, report
+from contractor.lib.config import _jinjaEnv, _compile, mergeValues
+
+KEY_COUNT = 5000
+
+
+def makeConfig( key_count=KEY_COUNT, seed=0 ):
+  # roughly what a large site/blueprint config looks like, mostly plain
+  # values, some templates, a few of those referencing other templates
+  rnd = random.Random( seed )
+  config = { 'domain': 'site{0}.example.com'.format( seed ), 'dns_server': '10.0.0.1', 'ntp_server': 'ntp.{{ domain }}' }
+  template_list = []
+  for i in range( 0, key_count - len( config ) ):
+    name = 'value_{0}'.format( i )
+    kind = rnd.random()
+    if kind < 0.60:
+      config[ name ] = 'plain value {0} for something'.format( i )
+    elif kind < 0.70:
+      config[ name ] = rnd.choice( [ i, True, False, None, i * 1.5 ] )
+    elif kind < 0.80:
+      config[ name ] = [ 'item{0}'.format( j ) for j in range( 0, 5 ) ]
+    elif kind < 0.85:
+      config[ name ] = { 'name': 'host{0}'.format( i ), 'port': 8000 + i, 'tags': [ 'a', 'b' ] }
+    elif kind < 0.95 or not template_list:
+      config[ name ] = 'host{0}.{{{{ domain }}}}'.format( i )
+      template_list.append( name )
+    else:  # up to three levels deep
+      config[ name ] = 'http://{{{{ {0} }}}}:{{{{ {1} }}}}/'.format( rnd.choice( template_list ), rnd.choice( [ 'dns_server', 'ntp_server' ] ) )
+      template_list.append( name )
+
+  return config
+
+
+def _oldMerge( target, value_map ):  # mergeValues before the template cache and dependency ordering
+  if isinstance( target, dict ):
+    dirty = False
+    new = {}
+    for key in target.keys():
+      new[ key ], tmp = _oldMerge( target[ key ], value_map )
+      dirty |= tmp
+
+    return new, dirty
+
+  if isinstance( target, list ):
+    dirty = False
+    new = []
+    for i in range( 0, len( target ) ):
+      val, tmp = _oldMerge( target[ i ], value_map )
+      new.append( val )
+      dirty |= tmp
+
+    return new, dirty
+
+  if isinstance( target, str ):
+    new = _jinjaEnv().from_string( target ).render( **value_map )
+    return new, new != target
+
+  return target, False
+
+
+def oldMergeValues( value_map ):
+  result = copy.deepcopy( value_map )
+
+  dirty = True
+  while dirty:
+    result, dirty = _oldMerge( result, result )
+
+  return result
+
+
+def main():
+  parser = argparse.ArgumentParser( description='mergeValues benchmark' )
+  parser.add_argument( '-k', '--keys', help='number of keys in the config (default: {0})'.format( KEY_COUNT ), type=int, default=KEY_COUNT )
+  parser.add_argument( '-o', '--old', help='also run the old fixed point loop, on {0} keys this takes about a minute'.format( KEY_COUNT ), action='store_true' )
+  args = parser.parse_args()
+
+  config = makeConfig( args.keys )
+  result_map = {}
+
+  result_list = []
+  if args.old:
+    result_list.append( bench( 'old fixed point loop', lambda: result_map.update( old=oldMergeValues( config ) ), repeat=1 ) )
+
+  _compile.cache_clear()
+  result_list.append( bench( 'mergeValues, cold template cache', lambda: result_map.update( new=mergeValues( config ) ), repeat=1 ) )
+  result_list.append( bench( 'mergeValues', lambda: mergeValues( config ) ) )
+
+  if args.old:
+    assert result_map[ 'old' ] == result_map[ 'new' ]
+
+  report( 'mergeValues, {0} keys'.format( len( config ) ), result_list, baseline=( 'old fixed point loop' if args.old else None ) )
+
+
+if __name__ == '__main__':
+  main()
@@ -5,7 +5,7 @@ from django.core.exceptions import ValidationError
 from contractor.Site.models import Site
 from contractor.BluePrint.models import StructureBluePrint, FoundationBluePrint
 from contractor.Building.models import Foundation, Structure
-from contractor.lib.config import _updateConfig, mergeValues, getConfig, renderTemplate
+from contractor.lib.config import _updateConfig, _compile, mergeValues, getConfig, getConfigValues, configLastModified, renderTemplate
 
 
 def _strip_base( value ):
@@ -268,6 +268,55 @@ def test_mergeValues():
   assert { 'a': 'c', 'b': 'a', 'd': 'c' } == mergeValues( values )
   assert { 'a': 'c', 'b': 'a', 'd': '{{ "{{" }}{{b}}}}' } == values
 
+  values = { 'a': '{{b}}.{{c}}', 'b': '{{c}}-{{d}}', 'c': '{{d}}', 'd': 'x', 'e': { 'f': [ '{{a}}' ] } }
+  assert { 'a': 'x-x.x', 'b': 'x-x', 'c': 'x', 'd': 'x', 'e': { 'f': [ 'x-x.x' ] } } == mergeValues( values )
+
+  values = { 'a': '{% for i in b %}{{i}}{% endfor %}', 'b': [ '{{c}}', 'd' ], 'c': 'e' }
+  assert { 'a': 'ed', 'b': [ 'e', 'd' ], 'c': 'e' } == mergeValues( values )
+
+  with pytest.raises( ValueError ):
+    mergeValues( { 'a': '{{a}}' } )
+
+  with pytest.raises( ValueError ):
+    mergeValues( { 'a': '{{b}}', 'b': [ '{{c}}' ], 'c': { 'd': '{{a}}' } } )
+
+  with pytest.raises( ValueError ):
+    mergeValues( { 'a': '{{ "{{" }}b}}', 'b': '{{a}}' } )
+
+  # items using their siblings are not circular
+  assert { 'a': { 'x': 'z', 'y': 'z' } } == mergeValues( { 'a': { 'x': '{{ a.y }}', 'y': 'z' } } )
+  assert { 'l': [ 'v', 'v' ] } == mergeValues( { 'l': [ '{{ l[1] }}', 'v' ] } )
+  assert { 'a': { 'x': 'w', 'y': [ 'w', 'w' ] }, 'b': 'w' } == mergeValues( { 'a': { 'x': '{{ a.y[0] }}', 'y': [ '{{ b }}', '{{ a[\'y\'][0] }}' ] }, 'b': 'w' } )
+  assert { 'a': { 'x': '2', 'y': 1 } } == mergeValues( { 'a': { 'x': '{{ a|length }}', 'y': 1 } } )
+
+  with pytest.raises( ValueError ):
+    mergeValues( { 'a': { 'x': '{{ a.y }}', 'y': '{{ a.x }}' } } )
+
+  with pytest.raises( ValueError ):
+    mergeValues( { 'a': { 'x': '{{ a.y }}', 'y': '{{ b }}' }, 'b': '{{ a.x }}' } )
+
+  with pytest.raises( ValueError ):
+    mergeValues( { 'a': { 'x': '{{ a }}' } } )
+
+
+def test_mergeValues_compile_cache():
+  _compile.cache_clear()
+  values = dict( ( 'key{0}'.format( i ), '{{{{ key{0} }}}}x'.format( i + 1 ) ) for i in range( 0, 50 ) )
+  values[ 'key50' ] = 'end'
+  values[ 'list' ] = [ '{{ key0 }}' ] * 100
+  result = mergeValues( values )
+  assert result[ 'key0' ] == 'end' + ( 'x' * 50 )
+  assert result[ 'list' ] == [ result[ 'key0' ] ] * 100
+  assert _compile.cache_info().misses == 51  # only the sources with templates, the literals (and rendered values) are never compiled
+
+  mergeValues( values )
+  assert _compile.cache_info().misses == 51
+
+
+def test_mergeValues_literal():
+  values = { 'a': 'line\n', 'b': 'one\r\ntwo', 'c': '{# note #}text', 'd': '{ not a template }', 'e': '{{ range( 3 )|list }}', 'f': '{{ a }}-' }
+  assert { 'a': 'line', 'b': 'one\ntwo', 'c': 'text', 'd': '{ not a template }', 'e': '[0, 1, 2]', 'f': 'line-' } == mergeValues( values )
+
 
 def test_render():
   assert renderTemplate( 'This is a test', {} ) == 'This is a test'
@@ -384,6 +433,7 @@ def test_site():
   now = datetime.now( timezone.utc )
   tmp = getConfig( s1 )
   assert now - tmp[ '__last_modified' ] < timedelta( seconds=5 )
+  assert configLastModified( s1 ) == tmp[ '__last_modified' ]
   assert now - tmp[ '__timestamp' ] < timedelta( seconds=5 )
 
   del tmp[ '__last_modified' ]
@@ -444,6 +494,7 @@ def test_blueprint():
   now = datetime.now( timezone.utc )
   tmp = getConfig( fb1 )
   assert now - tmp[ '__last_modified' ] < timedelta( seconds=5 )
+  assert configLastModified( fb1 ) == tmp[ '__last_modified' ]
   assert now - tmp[ '__timestamp' ] < timedelta( seconds=5 )
 
   del tmp[ '__last_modified' ]
@@ -488,6 +539,7 @@ def test_blueprint():
   now = datetime.now( timezone.utc )
   tmp = getConfig( sb1 )
   assert now - tmp[ '__last_modified' ] < timedelta( seconds=5 )
+  assert configLastModified( sb1 ) == tmp[ '__last_modified' ]
   assert now - tmp[ '__timestamp' ] < timedelta( seconds=5 )
 
   del tmp[ '__last_modified' ]
@@ -538,6 +590,7 @@ def test_foundation():
   now = datetime.now( timezone.utc )
   tmp = getConfig( f1 )
   assert now - tmp[ '__last_modified' ] < timedelta( seconds=5 )
+  assert configLastModified( f1 ) == tmp[ '__last_modified' ]
   assert now - tmp[ '__timestamp' ] < timedelta( seconds=5 )
 
   del tmp[ '__last_modified' ]
@@ -639,6 +692,7 @@ def test_structure():
   now = datetime.now( timezone.utc )
   tmp = getConfig( str1 )
   assert now - tmp[ '__last_modified' ] < timedelta( seconds=5 )
+  assert configLastModified( str1 ) == tmp[ '__last_modified' ]
   assert now - tmp[ '__timestamp' ] < timedelta( seconds=5 )
 
   del tmp[ '__last_modified' ]
@@ -780,3 +834,66 @@ def test_structure():
                                              '_site': 'site1',
                                              'bob': 'structure'
                                             }
+
+
+@pytest.mark.django_db
+def test_layer_cache( django_assert_num_queries ):
+  s1 = Site( name='site1', description='test site 1' )
+  s1.config_values = { 'under': 'or over' }
+  s1.full_clean()
+  s1.save()
+
+  s2 = Site( name='site2', description='test site 2', parent=s1 )
+  s2.config_values = { '>under': ' here' }
+  s2.full_clean()
+  s2.save()
+
+  s3 = Site( name='site3', description='test site 3', parent=s2 )
+  s3.config_values = { '<under': 'going ' }
+  s3.full_clean()
+  s3.save()
+
+  assert _strip_base( getConfigValues( s3 ) ) == { '_site': 'site3', 'under': 'going or over here' }
+
+  with django_assert_num_queries( 1 ):  # just checking the snapshot, no query per parent
+    tmp = getConfigValues( s3 )
+
+  tmp[ 'under' ] = 'changed'
+  assert _strip_base( getConfigValues( s3 ) ) == { '_site': 'site3', 'under': 'going or over here' }
+
+  s1.config_values = { 'under': 'the sea' }
+  s1.full_clean()
+  s1.save()
+
+  assert _strip_base( getConfigValues( s3 ) ) == { '_site': 'site3', 'under': 'going the sea here' }
+  assert _strip_base( getConfigValues( s2 ) ) == { '_site': 'site2', 'under': 'the sea here' }
+
+  s3.parent = s1
+  s3.full_clean()
+  s3.save()
+
+  assert _strip_base( getConfigValues( s3 ) ) == { '_site': 'site3', 'under': 'going the sea' }
+
+  fb1 = FoundationBluePrint( name='fdnb1', description='Foundation BluePrint 1' )
+  fb1.foundation_type_list = [ 'Unknown' ]
+  fb1.config_values = { 'from': 'inside' }
+  fb1.full_clean()
+  fb1.save()
+
+  fb2 = FoundationBluePrint( name='fdnb2', description='Foundation BluePrint 2' )
+  fb2.foundation_type_list = [ 'Unknown' ]
+  fb2.config_values = { '>from': ' the house' }
+  fb2.full_clean()
+  fb2.save()
+
+  assert _strip_base( getConfigValues( fb2 ) ) == { '_blueprint': 'fdnb2', 'from': ' the house' }
+
+  fb2.parent_list.add( fb1 )  # dosen't change fb2's updated
+
+  assert _strip_base( getConfigValues( fb2 ) ) == { '_blueprint': 'fdnb2', 'from': 'inside the house' }
+
+  f1 = Foundation( site=s3, locator='fdn1', blueprint=fb2 )
+  f1.full_clean()
+  f1.save()
+
+  assert _strip_base( getConfigValues( f1 ) ) == { '_blueprint': 'fdnb2', '_site': 'site3', 'from': 'inside the house', 'under': 'going the sea' }
@@ -1,5 +1,6 @@
 from math import log
-from itertools import groupby
+from socket import inet_pton, inet_ntop, inet_ntoa, AF_INET, AF_INET6
+from ipaddress import IPv6Address
 
 
 def IpIsV4( value ):  # ipv4 is signaled by 0000:0000:0000:0000:0000:FFFF:XXXX:XXXX
@@ -159,13 +160,7 @@ def CIDRNetworkRange( value, prefix, include_unusable=False, as_offsets=False ):
     yield i
 
 
-def StrToIp( value ):
-  if value is None:
-    return None
-
-  if not isinstance( value, str ):
-    raise ValueError( 'Invalid Ip Address' )
-
+def _parseIp( value ):  # the original parser, decides everything inet_pton turns down, so StrToIp accepts/rejects exactly what it always has
   result = 0
 
   if value.find( '.' ) != -1:
@@ -218,6 +213,33 @@ def StrToIp( value ):
   return result
 
 
+def StrToIp( value ):
+  if value is None:
+    return None
+
+  if not isinstance( value, str ):
+    raise ValueError( 'Invalid Ip Address' )
+
+  # inet_pton is stricter than _parseIp (no leading zeros, spaces, etc), what
+  # it does take _parseIp gives the same answer for.  More than 7 ':' is more
+  # than 8 groups for _parseIp, even though inet_pton will take "1:2:3:4:5:6:7::"
+  try:
+    if '.' in value:
+      return int.from_bytes( inet_pton( AF_INET, value[ 6: ] if value.startswith( ':ffff:' ) else value ), 'big' ) + 0x0000000000000000000000000000ffff00000000
+
+    if value.count( ':' ) < 8:
+      return int.from_bytes( inet_pton( AF_INET6, value ), 'big' )
+
+  except ( OSError, ValueError ):
+    pass
+
+  return _parseIp( value )
+
+
+def StrToIpMany( value_list ):
+  return [ StrToIp( value ) for value in value_list ]
+
+
 def IpToStr( value, as_v6=False ):
   if value is None:
     return None
@@ -228,55 +250,17 @@ def IpToStr( value, as_v6=False ):
   if value < 0 or value > 0xffffffffffffffffffffffffffffffff:
     raise ValueError( 'Invalid Ip Address' )
 
-  part_list = []
-  if IpIsV4( value ):
-    for i in range( 0, 4 ):
-      part_list.insert( 0, '{0}'.format( value & 0xff ) )
-      value >>= 8
-
+  if ( value & 0xffffffffffffffffffffffff00000000 ) == 0x00000000000000000000ffff00000000:  # IpIsV4, inline, this gets called a lot
     if as_v6:
-      return ':ffff:{0}'.format( '.'.join( part_list ) )
-    else:
-      return '.'.join( part_list )
+      return ':ffff:' + inet_ntoa( ( value & 0xffffffff ).to_bytes( 4, 'big' ) )
 
-  else:
-    for i in range( 0, 8 ):
-      part_list.insert( 0, '{0:x}'.format( value & 0xffff ) )  # as hex
-      value >>= 16
-
-    item_list = []
-    count_list = []
-    for item, grouper in groupby( part_list ):
-      count = len( list( grouper ) )
-      if item != '0':
-        item_list += [ item ] * count
-        count_list += [ 0 ] * count
-      else:
-        item_list.append( item )
-        count_list.append( count )
-
-    max_count = max( count_list )
-    if max_count == 1:
-      return ':'.join( item_list )
-
-    part_list = []
-    max_index = count_list.index( max_count )
-    for i in range( 0, len( count_list ) ):
-      if item_list[i] != '0':
-        part_list.append( item_list[i] )
-        continue
-
-      if i == max_index:
-        part_list.append( '' )
-      else:
-        part_list += [ '0' ] * count_list[i]
+    return inet_ntoa( ( value & 0xffffffff ).to_bytes( 4, 'big' ) )
+
+  if value >> 32 == 0:  # inet_ntop writes some of these as "::a.b.c.d"
+    return IPv6Address( value ).compressed
 
-    if part_list[0] == '':
-      part_list.insert( 0, '' )
-    elif part_list[-1] == '':
-      part_list.append( '' )
+  return inet_ntop( AF_INET6, value.to_bytes( 16, 'big' ) )
 
-    if len( part_list ) == 2:
-      return '::{0}'.format( part_list[1] )
 
-    return ':'.join( part_list )
+def IpToStrMany( value_list, as_v6=False ):
+  return [ IpToStr( value, as_v6 ) for value in value_list ]
@@ -0,0 +1,145 @@
+import argparse
+import random
+from itertools import groupby
+
+from contractor.lib.benchmark import bench, report
+from contractor.lib.ip import _parseIp, StrToIp, IpToStr, StrToIpMany, IpToStrMany
+
+ADDRESS_COUNT = 5000
+
+# the valid addresses from ip_test.py
+STR_VECTOR_LIST = [ '0.0.0.0', '127.0.0.1', '1.2.3.4', ':ffff:0.0.0.0', ':ffff:127.0.0.1', ':ffff:1.2.3.4', '::', '::1', '::a', '::ffff',
+                    '2001:db8:0:0:1:0:0:1', '2001:0db8:0:0:1:0:0:1', '2001:db8::1:0:0:1', '2001:db8::0:1:0:0:1', '2001:0db8::1:0:0:1',
+                    '2001:db8:0:0:1::1', '2001:db8:0000:0:1::1', '2001:DB8:0:0:1::1', '2001:db8:0:0:0:0:0:1', '2001:DB8:0:0:0:0:0:1',
+                    '2001:db8:0:0:0::1', '2001:db8:0:0::1', '2001:db8:0::1', '2001:db8::1', '2001:0:0:0:1:0:0:1', '2001::1:0:0:1',
+                    '2001:0:0:0:1::1', '2001:0:1:0:1:0:1:0', '2001::', '1:1:1:1:2:3:4:5', '0:0:0:0:2:3:4:5', '1:0:0:0:0:3:4:5',
+                    '1:1:1:1:0:0:4:5', '1:1:1:1:0:0:0:0' ]
+INT_VECTOR_LIST = [ 0, 1, 10, 65535, 42540766411282592856903984951653826561, 42540766411282592856904266426630537217, 42540488161975842760550637900276957185,
+                    42540488161977051686370252529451728896, 42540488161975842760550356425300246528, 281470681743360, 281470681743361, 281472812449793,
+                    281470698652420 ]
+
+
+def oldStrToIp( value ):  # StrToIp before inet_pton, _parseIp is the same parser
+  if value is None:
+    return None
+
+  if not isinstance( value, str ):
+    raise ValueError( 'Invalid Ip Address' )
+
+  return _parseIp( value )
+
+
+def oldIpToStr( value, as_v6=False ):  # IpToStr before inet_ntop
+  if value is None:
+    return None
+
+  if not isinstance( value, int ):
+    raise ValueError( 'Invalid Ip Address' )
+
+  if value < 0 or value > 0xffffffffffffffffffffffffffffffff:
+    raise ValueError( 'Invalid Ip Address' )
+
+  part_list = []
+  if ( value & 0xffffffffffffffffffffffff00000000 ) == 0x00000000000000000000ffff00000000:
+    for i in range( 0, 4 ):
+      part_list.insert( 0, '{0}'.format( value & 0xff ) )
+      value >>= 8
+
+    if as_v6:
+      return ':ffff:{0}'.format( '.'.join( part_list ) )
+    else:
+      return '.'.join( part_list )
+
+  for i in range( 0, 8 ):
+    part_list.insert( 0, '{0:x}'.format( value & 0xffff ) )  # as hex
+    value >>= 16
+
+  item_list = []
+  count_list = []
+  for item, grouper in groupby( part_list ):
+    count = len( list( grouper ) )
+    if item != '0':
+      item_list += [ item ] * count
+      count_list += [ 0 ] * count
+    else:
+      item_list.append( item )
+      count_list.append( count )
+
+  max_count = max( count_list )
+  if max_count == 1:
+    return ':'.join( item_list )
+
+  part_list = []
+  max_index = count_list.index( max_count )
+  for i in range( 0, len( count_list ) ):
+    if item_list[i] != '0':
+      part_list.append( item_list[i] )
+      continue
+
+    if i == max_index:
+      part_list.append( '' )
+    else:
+      part_list += [ '0' ] * count_list[i]
+
+  if part_list[0] == '':
+    part_list.insert( 0, '' )
+  elif part_list[-1] == '':
+    part_list.append( '' )
+
+  if len( part_list ) == 2:
+    return '::{0}'.format( part_list[1] )
+
+  return ':'.join( part_list )
+
+
+def makeAddressList( address_count=ADDRESS_COUNT, seed=0 ):
+  # roughly what a site's addresses look like, mostly ipv4 in a few blocks, some ipv6
+  rnd = random.Random( seed )
+  result = []
+  for i in range( 0, address_count ):
+    if rnd.random() < 0.8:
+      result.append( 0xffff0a000000 + rnd.randrange( 0, 0x10000 ) )
+    else:
+      result.append( 0x20010db8000000000000000000000000 + rnd.randrange( 0, 0x10000000000000000 ) )
+
+  return result
+
+
+def main():
+  parser = argparse.ArgumentParser( description='StrToIp/IpToStr benchmark' )
+  parser.add_argument( '-a', '--addresses', help='number of generated addresses (default: {0})'.format( ADDRESS_COUNT ), type=int, default=ADDRESS_COUNT )
+  args = parser.parse_args()
+
+  assert [ StrToIp( i ) for i in STR_VECTOR_LIST ] == [ oldStrToIp( i ) for i in STR_VECTOR_LIST ]
+  assert [ IpToStr( i, as_v6 ) for i in INT_VECTOR_LIST for as_v6 in ( False, True ) ] == [ oldIpToStr( i, as_v6 ) for i in INT_VECTOR_LIST for as_v6 in ( False, True ) ]
+
+  result_list = []
+  result_list.append( bench( 'old StrToIp', lambda: [ oldStrToIp( i ) for i in STR_VECTOR_LIST ], number=100 ) )
+  result_list.append( bench( 'StrToIp', lambda: [ StrToIp( i ) for i in STR_VECTOR_LIST ], number=100 ) )
+  result_list.append( bench( 'StrToIpMany', lambda: StrToIpMany( STR_VECTOR_LIST ), number=100 ) )
+  report( 'StrToIp, ip_test.py vectors, {0} addresses'.format( len( STR_VECTOR_LIST ) ), result_list, baseline='old StrToIp' )
+
+  result_list = []
+  result_list.append( bench( 'old IpToStr', lambda: [ oldIpToStr( i ) for i in INT_VECTOR_LIST ], number=100 ) )
+  result_list.append( bench( 'IpToStr', lambda: [ IpToStr( i ) for i in INT_VECTOR_LIST ], number=100 ) )
+  result_list.append( bench( 'IpToStrMany', lambda: IpToStrMany( INT_VECTOR_LIST ), number=100 ) )
+  report( 'IpToStr, ip_test.py vectors, {0} addresses'.format( len( INT_VECTOR_LIST ) ), result_list, baseline='old IpToStr' )
+
+  int_list = makeAddressList( args.addresses )
+  str_list = IpToStrMany( int_list )
+  assert str_list == [ oldIpToStr( i ) for i in int_list ]
+  assert StrToIpMany( str_list ) == int_list
+
+  result_list = []
+  result_list.append( bench( 'old StrToIp', lambda: [ oldStrToIp( i ) for i in str_list ] ) )
+  result_list.append( bench( 'StrToIpMany', lambda: StrToIpMany( str_list ) ) )
+  report( 'StrToIp, generated, {0} addresses'.format( len( str_list ) ), result_list, baseline='old StrToIp' )
+
+  result_list = []
+  result_list.append( bench( 'old IpToStr', lambda: [ oldIpToStr( i ) for i in int_list ] ) )
+  result_list.append( bench( 'IpToStrMany', lambda: IpToStrMany( int_list ) ) )
+  report( 'IpToStr, generated, {0} addresses'.format( len( int_list ) ), result_list, baseline='old IpToStr' )
+
+
+if __name__ == '__main__':
+  main()
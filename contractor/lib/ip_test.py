@@ -1,6 +1,6 @@
 import pytest
 
-from contractor.lib.ip import IpIsV4, StrToIp, IpToStr, CIDRNetwork, CIDRNetmask, CIDRNetmaskToPrefix, CIDRNetworkSize, CIDRNetworkBounds, CIDRNetworkRange
+from contractor.lib.ip import IpIsV4, StrToIp, IpToStr, StrToIpMany, IpToStrMany, CIDRNetwork, CIDRNetmask, CIDRNetmaskToPrefix, CIDRNetworkSize, CIDRNetworkBounds, CIDRNetworkRange
 
 
 def test_isv4():
@@ -71,6 +71,10 @@ def test_strtoip():
   assert StrToIp( '2001:DB8:0:0:1::1' ) == 42540766411282592856904266426630537217
   with pytest.raises( ValueError ):
     StrToIp( '2001:db8::1::1' )
+  with pytest.raises( ValueError ):
+    StrToIp( '1:2:3:4:5:6:7::' )
+  assert StrToIp( '1:2:3:4:5:6::8' ) == 5192455318486707404433266432802824
+  assert StrToIp( '01.2.3.4' ) == 281470698652420
   assert StrToIp( '2001:db8:0:0:0:0:0:1' ) == 42540766411282592856903984951653826561
   assert StrToIp( '2001:DB8:0:0:0:0:0:1' ) == 42540766411282592856903984951653826561
   assert StrToIp( '2001:db8:0:0:0::1' ) == 42540766411282592856903984951653826561
@@ -154,6 +158,23 @@ def test_iptostr():
 
   assert IpToStr( None ) is None
 
+  assert IpToStr( 0x10000 ) == '::1:0'  # not "::0.1.0.0"
+  assert IpToStr( 0x01020304 ) == '::102:304'
+  assert IpToStr( 0x1000000000000 ) == '::1:0:0:0'
+
+
+def test_many():
+  assert StrToIpMany( [] ) == []
+  assert StrToIpMany( [ '127.0.0.1', ':ffff:1.2.3.4', '2001:db8::1', None ] ) == [ 281472812449793, 281470698652420, 42540766411282592856903984951653826561, None ]
+  with pytest.raises( ValueError ):
+    StrToIpMany( [ '127.0.0.1', '1:2:3:4:5:6:7::' ] )
+
+  assert IpToStrMany( [] ) == []
+  assert IpToStrMany( [ 281472812449793, 42540766411282592856903984951653826561, None ] ) == [ '127.0.0.1', '2001:db8::1', None ]
+  assert IpToStrMany( [ 281472812449793, 42540766411282592856903984951653826561, None ], True ) == [ ':ffff:127.0.0.1', '2001:db8::1', None ]
+  with pytest.raises( ValueError ):
+    IpToStrMany( [ 1, -1 ] )
+
 
 def test_cidrnetwork():
   assert CIDRNetwork( 24, False ) == StrToIp( '0.0.0.255' )
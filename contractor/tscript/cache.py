@@ -0,0 +1,121 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from contractor.tscript.parser import parse
+from contractor.tscript.compiler import compileAST
+
+# cache of parsed scripts, keyed by the hash of the script text.  The AST that
+# comes out of parse is never modified by the Runner, so the same AST can be
+# handed to every Runner that is running the same script, the same goes for
+# the Program the AST is compiled to.
+
+CACHE_SIZE = 200
+
+_ast_cache = OrderedDict()
+_program_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_store = None
+_store_save = False
+
+
+def scriptHash( script ):
+  return hashlib.sha256( script.encode( 'utf-8' ) ).hexdigest()
+
+
+def registerStore( store, save=True ):
+  # store is used to persist parsed scripts, so other processes (and this one
+  # after a restart) do not have to parse again.  It must have a
+  # loadAST( script_hash ) which returns the AST or None if not found, and
+  # saveAST( script_hash, script, ast ).  If save is False, the store is only read
+  # from, so what was saved before ( and the runners pickled with just the hash ) still
+  # loads.  Set to None to only use the in process cache
+  global _store, _store_save
+
+  _store = store
+  _store_save = store is not None and save
+
+
+def clearCache():
+  with _cache_lock:
+    _ast_cache.clear()
+    _program_cache.clear()
+
+
+def _cacheGet( cache, script_hash ):
+  with _cache_lock:
+    try:
+      value = cache[ script_hash ]
+    except KeyError:
+      return None
+
+    cache.move_to_end( script_hash )
+
+  return value
+
+
+def _cachePut( cache, script_hash, value ):
+  with _cache_lock:
+    cache[ script_hash ] = value
+    cache.move_to_end( script_hash )
+    while len( cache ) > CACHE_SIZE:
+      cache.popitem( last=False )
+
+
+def isPersisted():
+  # True if a script_hash from getAST can be turned back into an AST by
+  # lookupAST in any process
+  return _store_save
+
+
+def _lookup( script_hash ):
+  ast = _cacheGet( _ast_cache, script_hash )
+  if ast is not None:
+    return ast
+
+  if _store is not None:
+    ast = _store.loadAST( script_hash )
+    if ast is not None:
+      _cachePut( _ast_cache, script_hash, ast )
+
+  return ast
+
+
+def getAST( script, script_hash=None ):
+  if script_hash is None:
+    script_hash = scriptHash( script )
+
+  ast = _lookup( script_hash )
+  if ast is not None:
+    return ast
+
+  ast = parse( script )
+  if _store_save:
+    _store.saveAST( script_hash, script, ast )
+
+  _cachePut( _ast_cache, script_hash, ast )
+
+  return ast
+
+
+def lookupAST( script_hash ):
+  ast = _lookup( script_hash )
+  if ast is None:
+    raise KeyError( 'Compiled Script "{0}" not found'.format( script_hash ) )
+
+  return ast
+
+
+def getProgram( ast, script_hash=None, compiler=compileAST ):
+  # the compiled Program for ast, script_hash is the hash of the script the ast came from,
+  # if it is None, the ast is compiled every time.  compiler is function( ast ) -> Program, the Program
+  # is cached for each compiler
+  if script_hash is None:
+    return compiler( ast )
+
+  program = _cacheGet( _program_cache, ( script_hash, compiler ) )
+  if program is None:
+    program = compiler( ast )
+    _cachePut( _program_cache, ( script_hash, compiler ), program )
+
+  return program
@@ -0,0 +1,118 @@
+import pytest
+
+from contractor.tscript import cache
+from contractor.tscript.parser import parse, ParserError
+from contractor.tscript.cache import getAST, lookupAST, getProgram, scriptHash, registerStore, clearCache
+
+
+class testStore():
+  def __init__( self ):
+    self.ast_map = {}
+    self.load_count = 0
+    self.save_count = 0
+
+  def loadAST( self, script_hash ):
+    self.load_count += 1
+    return self.ast_map.get( script_hash, None )
+
+  def saveAST( self, script_hash, script, ast ):
+    self.save_count += 1
+    self.ast_map[ script_hash ] = ast
+
+
+@pytest.fixture
+def store():
+  old_store = cache._store
+  clearCache()
+  store = testStore()
+  registerStore( store )
+  yield store
+  registerStore( old_store )
+  clearCache()
+
+
+@pytest.fixture
+def no_store():
+  old_store = cache._store
+  clearCache()
+  registerStore( None )
+  yield
+  registerStore( old_store )
+  clearCache()
+
+
+def test_hash():
+  assert scriptHash( 'var = 1' ) == scriptHash( 'var = 1' )
+  assert scriptHash( 'var = 1' ) != scriptHash( 'var = 2' )
+  assert len( scriptHash( '' ) ) == 64
+
+
+def test_cache( no_store ):
+  ast = getAST( 'var = 1\nother = 2' )
+  assert ast == parse( 'var = 1\nother = 2' )
+  assert getAST( 'var = 1\nother = 2' ) is ast
+  assert getAST( 'var = 1\nother = 2', scriptHash( 'var = 1\nother = 2' ) ) is ast
+  assert getAST( 'var = 2\nother = 2' ) is not ast
+
+  with pytest.raises( ParserError ):
+    getAST( 'var = ' )
+
+  clearCache()
+  assert getAST( 'var = 1\nother = 2' ) is not ast
+  assert getAST( 'var = 1\nother = 2' ) == ast
+
+
+def test_lru( no_store, mocker ):
+  mocker.patch( 'contractor.tscript.cache.CACHE_SIZE', 2 )
+  ast1 = getAST( 'var = 1' )
+  ast2 = getAST( 'var = 2' )
+  assert getAST( 'var = 1' ) is ast1  # var = 1 is now the most recently used
+  getAST( 'var = 3' )
+  assert len( cache._ast_cache ) == 2
+  assert getAST( 'var = 1' ) is ast1
+  assert getAST( 'var = 2' ) is not ast2
+
+
+def test_store( store ):
+  ast = getAST( 'var = 1' )
+  assert store.load_count == 1
+  assert store.save_count == 1
+  assert store.ast_map == { scriptHash( 'var = 1' ): ast }
+
+  getAST( 'var = 1' )
+  assert store.load_count == 1
+  assert store.save_count == 1
+
+  clearCache()  # simulate another process
+  assert getAST( 'var = 1' ) is ast
+  assert store.load_count == 2
+  assert store.save_count == 1
+
+
+def test_store_read_only( store ):
+  script_hash = scriptHash( 'var = 1' )
+  ast = getAST( 'var = 1' )
+  registerStore( store, False )
+  assert not cache.isPersisted()
+
+  clearCache()
+  assert lookupAST( script_hash ) == ast  # what was saved still loads
+  getAST( 'var = 2' )
+  assert store.save_count == 1
+  assert list( store.ast_map.keys() ) == [ script_hash ]
+
+  clearCache()
+  with pytest.raises( KeyError ):
+    lookupAST( scriptHash( 'var = 2' ) )
+
+
+def test_program( no_store ):
+  script_hash = scriptHash( 'var = 1' )
+  ast = getAST( 'var = 1' )
+  program = getProgram( ast, script_hash )
+  assert getProgram( ast, script_hash ) is program
+  assert getProgram( ast ) is not program  # with out a hash it is not cached
+  assert getProgram( ast ).code == program.code
+
+  clearCache()
+  assert getProgram( ast, script_hash ) is not program
@@ -0,0 +1,329 @@
+import hashlib
+
+from contractor.tscript.parser import Types
+
+# compiles the AST from the parser into a flat list of instructions for the
+# Runner, so the Runner can run the script with a loop instead of walking
+# (and re-walking after every pause) the AST.  The Runner's resumable state is
+# then just the program counter, the value stack and the scope frames.
+#
+# the ttl of the Runner has allways counted the AST nodes entered, and that
+# resuming re-entered all the nodes down to where execution stopped, to keep
+# that the same, each instruction knows how many nodes are entered just before
+# it runs (cost_list) and how many nodes it is inside of (resume_cost_list).
+# The nodes it is inside of (path_list) are also what the status is built from.
+
+
+class Op():
+  NOP = 'nop'
+  LINE = 'line'                        # ( LINE, line no )
+  ENTER_SCOPE = 'enter_scope'          # ( ENTER_SCOPE, max_time )
+  EXIT_SCOPE = 'exit_scope'
+  CONSTANT = 'constant'                # ( CONSTANT, value )
+  COPY_CONSTANT = 'copy_constant'      # ( COPY_CONSTANT, value ), for list/map constants, so the value in the program is not changed
+  VARIABLE = 'variable'                # ( VARIABLE, name )
+  MODULE_VARIABLE = 'module_variable'  # ( MODULE_VARIABLE, module, name )
+  ITEM = 'item'                        # ( ITEM, module, name ), index on the stack
+  ARRAY = 'array'                      # ( ARRAY, item count )
+  MAP = 'map'                          # ( MAP, key list )
+  INFIX = 'infix'                      # ( INFIX, operator )
+  STORE = 'store'                      # ( STORE, name )
+  STORE_ITEM = 'store_item'            # ( STORE_ITEM, name ), index then value on the stack
+  STORE_MODULE = 'store_module'        # ( STORE_MODULE, module, name )
+  BAD_TARGET = 'bad_target'
+  CALL = 'call'                        # ( CALL, module, name, paramater name list, handler ), paramater values on the stack, handler is None if not resolved yet
+  POP = 'pop'
+  JUMP = 'jump'                        # ( JUMP, pc )
+  JUMP_FALSE = 'jump_false'            # ( JUMP_FALSE, pc )
+  EXISTS = 'exists'
+  GOTO = 'goto'                        # ( GOTO, jump point name, pc ), pc is None if the jump point does not exist
+  ERROR = 'error'                      # ( ERROR, message )
+
+
+class Program( object ):
+  def __init__( self ):
+    super().__init__()
+    self.code = []              # list of ( Op, <arguments> )
+    self.cost_list = []         # number of AST nodes entered before each instruction
+    self.resume_cost_list = []  # number of AST nodes each instruction is inside of
+    self.path_list = []         # for each instruction, the AST nodes it is inside of, outer most first, see _Compiler.enter
+    self.exists_list = []       # list of ( first pc, exists pc, stack depth ) a NotDefinedError in is turned into a False, inner most first
+    self.jump_point_map = {}    # jump point name -> pc
+    self.reenter_set = set()    # pcs of the CALLs that are entered again when resuming after their function's Exception was raised
+    self.node_map = {}          # position of an AST node -> ( first pc, pc after ), the position is the tuple of child keys from the top
+    self._fingerprint = None
+
+  @property
+  def fingerprint( self ):
+    # identifies the instructions, a saved pc only means something to the same program, the resolved
+    # handlers are left out, they are not the same in every process and do not move anything
+    if self._fingerprint is None:
+      digest = hashlib.sha256()
+      for op in self.code:
+        if op[0] == Op.CALL:
+          op = op[ :4 ]
+
+        digest.update( repr( op ).encode() )
+
+      self._fingerprint = digest.hexdigest()
+
+    return self._fingerprint
+
+
+class _Compiler( object ):
+  def __init__( self, builtin_function_map ):
+    super().__init__()
+    self.builtin_function_map = builtin_function_map
+    self.program = Program()
+    self.node_list = []  # path entries of the nodes being compiled
+    self.pending = 0     # nodes entered since the last instruction
+    self.stack_depth = 0
+
+  def emit( self, *op, stack_effect=0 ):
+    program = self.program
+    program.code.append( op )
+    program.cost_list.append( self.pending )
+    program.resume_cost_list.append( len( self.node_list ) )
+    program.path_list.append( tuple( self.node_list ) )
+    self.pending = 0
+    self.stack_depth += stack_effect
+
+    return len( program.code ) - 1
+
+  def label( self ):
+    # pc of the next instruction, for jumping back to.  The nodes entered
+    # since the last instruction get a NOP, so jumping back does not count them again
+    if self.pending:
+      self.emit( Op.NOP )
+
+    return len( self.program.code )
+
+  def patch( self, pc ):  # point the jump at pc to the next instruction
+    self.program.code[ pc ] = self.program.code[ pc ][ :-1 ] + ( len( self.program.code ), )
+
+  def enter( self, entry ):
+    # entry is ( type, ... ), with the information status needs
+    #   ( Types.LINE, line no )
+    #   ( Types.SCOPE, options, child index, child count )
+    #   ( Types.WHILE, doing )
+    #   ( Types.IFELSE, branch index, branch count, doing )
+    #   ( Types.FUNCTION, module, name )
+    self.node_list[ -1 ] = entry
+
+  def compile( self, node, key, want_value ):
+    node_type = node[0]
+    start = len( self.program.code )
+    self.pending += 1
+    self.node_list.append( ( node_type, ) )
+
+    try:
+      handler = getattr( self, '_' + _HANDLER_MAP[ node_type ] )
+    except KeyError:
+      handler = self._unimplemented
+
+    has_value = handler( node[1:], key )
+
+    self.node_list.pop()
+    self.program.node_map[ key ] = ( start, len( self.program.code ) )
+
+    if has_value and not want_value:
+      self.emit( Op.POP, stack_effect=-1 )
+
+    elif want_value and not has_value:
+      self.emit( Op.ERROR, 'Assignment does not have a value', stack_effect=1 )
+
+  def _line( self, node, key ):
+    self.enter( ( Types.LINE, node[1] ) )
+    self.emit( Op.LINE, node[1] )
+    self.compile( node[0], key + ( 0, ), False )
+    return False
+
+  def _scope( self, node, key ):
+    options = node[0]
+    child_list = options[ '_children' ]
+    self.enter( ( Types.SCOPE, options, 0, len( child_list ) ) )
+    self.emit( Op.ENTER_SCOPE, options.get( 'max_time', None ) )
+    for i in range( 0, len( child_list ) ):
+      self.enter( ( Types.SCOPE, options, i, len( child_list ) ) )
+      self.compile( child_list[ i ], key + ( i, ), False )
+
+    self.emit( Op.EXIT_SCOPE )
+    return False
+
+  def _constant( self, node, key ):
+    if isinstance( node[0], ( list, dict ) ):  # only from the optimizer
+      self.emit( Op.COPY_CONSTANT, node[0], stack_effect=1 )
+    else:
+      self.emit( Op.CONSTANT, node[0], stack_effect=1 )
+
+    return True
+
+  def _variable( self, node, key ):
+    if node[0][ 'module' ] is None:
+      self.emit( Op.VARIABLE, node[0][ 'name' ], stack_effect=1 )
+    else:
+      self.emit( Op.MODULE_VARIABLE, node[0][ 'module' ], node[0][ 'name' ], stack_effect=1 )
+
+    return True
+
+  def _array( self, node, key ):
+    item_list = node[0]
+    for i in range( 0, len( item_list ) ):
+      self.compile( item_list[ i ], key + ( i, ), True )
+
+    self.emit( Op.ARRAY, len( item_list ), stack_effect=1 - len( item_list ) )
+    return True
+
+  def _map( self, node, key ):
+    item_map = node[0]
+    for name in item_map:
+      self.compile( item_map[ name ], key + ( name, ), True )
+
+    self.emit( Op.MAP, tuple( item_map.keys() ), stack_effect=1 - len( item_map ) )
+    return True
+
+  def _array_map_item( self, node, key ):
+    data = node[0]
+    self.compile( data[ 'index' ], key + ( 'index', ), True )
+    self.emit( Op.ITEM, data[ 'module' ], data[ 'name' ] )
+    return True
+
+  def _assignment( self, node, key ):
+    target_type, target = node[0][ 'target' ]
+    if target_type not in ( Types.VARIABLE, Types.ARRAY_MAP_ITEM ) or ( target_type == Types.ARRAY_MAP_ITEM and target[ 'module' ] is not None ):
+      self.emit( Op.BAD_TARGET )
+      return False
+
+    if target_type == Types.ARRAY_MAP_ITEM:
+      self.compile( target[ 'index' ], key + ( 'index', ), True )
+
+    self.compile( node[0][ 'value' ], key + ( 'value', ), True )
+
+    if target_type == Types.ARRAY_MAP_ITEM:
+      self.emit( Op.STORE_ITEM, target[ 'name' ], stack_effect=-2 )
+    elif target[ 'module' ] is None:
+      self.emit( Op.STORE, target[ 'name' ], stack_effect=-1 )
+    else:
+      self.emit( Op.STORE_MODULE, target[ 'module' ], target[ 'name' ], stack_effect=-1 )
+
+    return False
+
+  def _infix( self, node, key ):
+    data = node[0]
+    self.compile( data[ 'left' ], key + ( 'left', ), True )
+    self.compile( data[ 'right' ], key + ( 'right', ), True )
+    self.emit( Op.INFIX, data[ 'operator' ], stack_effect=-1 )
+    return True
+
+  def _function( self, node, key ):
+    data = node[0]
+    self.enter( ( Types.FUNCTION, data[ 'module' ], data[ 'name' ] ) )
+    for name in data[ 'paramaters' ]:
+      self.compile( data[ 'paramaters' ][ name ], key + ( name, ), True )
+
+    handler = None
+    if data[ 'module' ] is None and self.builtin_function_map is not None:
+      handler = self.builtin_function_map.get( data[ 'name' ], None )
+
+    pc = self.emit( Op.CALL, data[ 'module' ], data[ 'name' ], tuple( data[ 'paramaters' ].keys() ), handler, stack_effect=1 - len( data[ 'paramaters' ] ) )
+    if self.node_list[ -2 ][0] in ( Types.LINE, Types.SCOPE, Types.WHILE, Types.IFELSE, Types.EXISTS ):  # these do not hang on to the value of the function
+      self.program.reenter_set.add( pc )
+
+    return True
+
+  def _while( self, node, key ):
+    data = node[0]
+    self.enter( ( Types.WHILE, 'condition' ) )
+    top = self.label()
+    self.compile( data[ 'condition' ], key + ( 'condition', ), True )
+    done = self.emit( Op.JUMP_FALSE, None, stack_effect=-1 )
+
+    self.enter( ( Types.WHILE, 'expression' ) )
+    self.compile( data[ 'expression' ], key + ( 'expression', ), False )
+    self.emit( Op.JUMP, top )
+    self.patch( done )
+    return False
+
+  def _ifelse( self, node, key ):
+    branch_list = node[0]
+    end_list = []
+    for i in range( 0, len( branch_list ) ):
+      branch = branch_list[ i ]
+      self.enter( ( Types.IFELSE, i, len( branch_list ), 'condition' ) )
+      next_branch = None
+      if branch[ 'condition' ] is not None:
+        self.compile( branch[ 'condition' ], key + ( ( i, 'condition' ), ), True )
+        next_branch = self.emit( Op.JUMP_FALSE, None, stack_effect=-1 )
+
+      self.enter( ( Types.IFELSE, i, len( branch_list ), 'expression' ) )
+      self.compile( branch[ 'expression' ], key + ( ( i, 'expression' ), ), False )
+      if i < len( branch_list ) - 1:
+        end_list.append( self.emit( Op.JUMP, None ) )
+
+      if next_branch is not None:
+        self.patch( next_branch )
+
+    for pc in end_list:
+      self.patch( pc )
+
+    return False
+
+  def _exists( self, node, key ):
+    start = len( self.program.code )
+    stack_depth = self.stack_depth
+    self.compile( node[0], key + ( 0, ), True )
+    self.program.exists_list.append( ( start, self.emit( Op.EXISTS ), stack_depth ) )
+    return True
+
+  def _jump_point( self, node, key ):
+    self.emit( Op.NOP )
+    return False
+
+  def _goto( self, node, key ):
+    self.emit( Op.GOTO, node[0], None )  # the pc is filled in when all the jump points are known
+    return False
+
+  def _unimplemented( self, node, key ):
+    self.emit( Op.ERROR, 'Unimplemented "{0}"'.format( self.node_list[ -1 ][0] ) )
+    return False
+
+
+_HANDLER_MAP = {
+                 Types.LINE: 'line',
+                 Types.SCOPE: 'scope',
+                 Types.CONSTANT: 'constant',
+                 Types.VARIABLE: 'variable',
+                 Types.ARRAY: 'array',
+                 Types.MAP: 'map',
+                 Types.ARRAY_MAP_ITEM: 'array_map_item',
+                 Types.ASSIGNMENT: 'assignment',
+                 Types.INFIX: 'infix',
+                 Types.FUNCTION: 'function',
+                 Types.WHILE: 'while',
+                 Types.IFELSE: 'ifelse',
+                 Types.EXISTS: 'exists',
+                 Types.JUMP_POINT: 'jump_point',
+                 Types.GOTO: 'goto'
+               }
+
+
+def compileAST( ast, builtin_function_map=None ):
+  # if builtin_function_map is passed in, calls to builtin functions are resolved now, instead of when they are called
+  compiler = _Compiler( builtin_function_map )
+  compiler.compile( ast, (), False )
+
+  program = compiler.program
+  program.cost_list.append( 0 )  # for the pc after the last instruction
+  program.resume_cost_list.append( 0 )
+
+  # jump points can only be in the top scope
+  child_list = ast[1][ '_children' ]
+  for i in range( 0, len( child_list ) ):
+    if child_list[ i ][1][0] == Types.JUMP_POINT:
+      program.jump_point_map[ child_list[ i ][1][1] ] = program.node_map[ ( i, ) ][0]
+
+  for pc in range( 0, len( program.code ) ):
+    if program.code[ pc ][0] == Op.GOTO:
+      program.code[ pc ] = ( Op.GOTO, program.code[ pc ][1], program.jump_point_map.get( program.code[ pc ][1], None ) )
+
+  return program
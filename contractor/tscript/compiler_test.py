@@ -0,0 +1,50 @@
+from contractor.tscript.parser import parse
+from contractor.tscript.compiler import Op, compileAST
+
+
+def test_simple():
+  program = compileAST( parse( 'var = ( 1 + 2 )' ) )
+  assert program.code == [
+                           ( Op.ENTER_SCOPE, None ),
+                           ( Op.LINE, 1 ),
+                           ( Op.CONSTANT, 1 ),
+                           ( Op.CONSTANT, 2 ),
+                           ( Op.INFIX, '+' ),
+                           ( Op.STORE, 'var' ),
+                           ( Op.EXIT_SCOPE, )
+                         ]
+  assert program.cost_list == [ 1, 1, 3, 1, 0, 0, 0, 0 ]  # scope, line, assignment + infix + constant, constant
+  assert program.resume_cost_list == [ 1, 2, 5, 5, 4, 3, 1, 0 ]
+  assert program.node_map[ () ] == ( 0, 7 )
+  assert program.node_map[ ( 0, 0, 'value' ) ] == ( 2, 5 )
+
+
+def test_flow():
+  program = compileAST( parse( 'cnt = 0\nwhile ( cnt < 2 ) do cnt = ( cnt + 1 )' ) )
+  jump_false = [ op for op in program.code if op[0] == Op.JUMP_FALSE ]
+  jump = [ op for op in program.code if op[0] == Op.JUMP ]
+  assert jump_false[0][1] == len( program.code ) - 1  # out of the loop is the EXIT_SCOPE
+  assert program.code[ jump[0][1] - 1 ] == ( Op.NOP, )  # the line and while are entered once, before the top of the loop
+  assert program.path_list[ jump[0][1] ][ 2 ] == ( 'W', 'condition' )
+
+  program = compileAST( parse( 'var = 1\n:here\nvar = 2\ngoto here' ) )
+  assert program.jump_point_map == { 'here': program.node_map[ ( 1, ) ][0] }
+  assert program.code[ program.jump_point_map[ 'here' ] ] == ( Op.LINE, 2 )
+
+  program = compileAST( parse( 'if ( var > 1 ) then 1 elif False then 2 else 3' ) )
+  assert [ op[0] for op in program.code if op[0] in ( Op.JUMP, Op.JUMP_FALSE ) ] == [ Op.JUMP_FALSE, Op.JUMP, Op.JUMP_FALSE, Op.JUMP ]
+
+
+def test_exists():
+  program = compileAST( parse( 'var = [ 1, exists( other[2] ) ]' ) )
+  ( start, exists_pc, stack_depth ) = program.exists_list[0]
+  assert program.code[ start ] == ( Op.CONSTANT, 2 )
+  assert program.code[ exists_pc ] == ( Op.EXISTS, )
+  assert stack_depth == 1  # the 1 is still on the stack
+
+
+def test_function():
+  program = compileAST( parse( 'var = len( array=[ 1 ] )\nlen( array=[ 2 ] )' ) )
+  call_list = [ pc for pc in range( 0, len( program.code ) ) if program.code[ pc ][0] == Op.CALL ]
+  assert program.code[ call_list[0] ] == ( Op.CALL, None, 'len', ( 'array', ), None )
+  assert program.reenter_set == set( call_list[ 1: ] )  # the assignment keeps the value, the line does not
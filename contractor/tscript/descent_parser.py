@@ -0,0 +1,620 @@
+import re
+from bisect import bisect_right
+from datetime import timedelta
+
+from contractor.tscript.parser import Types, ParserError, Parser
+
+# hand written recursive descent version of parser.tscript_grammar, each
+# _rule method is the rule of the same name and takes the same ordered choices
+# in the same order, so the AST ( and where it fails ) is the same as
+# parser.Parser.  It is faster because there is no parse tree to build and
+# walk, choices that can not match the next character are skipped, and
+# array_map_item ( which assignment and value_expression both try, without
+# this nested indexes would be exponential ) is only parsed once per position
+#
+# methods return ( node, end position ) or None if the rule does not match
+#
+# register with parser.registerParser() to have parse() and lint() use it
+
+_ws_s = re.compile( r'[ \x09]*' ).match
+_em_s = re.compile( r'[\x0d\x0a \x09]*' ).match
+_em_p = re.compile( r'[\x0d\x0a \x09]+' ).match
+_nl_p = re.compile( r'[\x0d\x0a]+' ).match
+_comment = re.compile( r'#[^\r\n]*' ).match
+_label = re.compile( r'[a-zA-Z][a-zA-Z0-9_]+' ).match
+_reserved = re.compile( r'(begin|end|while|do|goto|exists|continue|break|pass)(?![a-zA-Z0-9_])' ).match  # none are a prefix of another, so the same as the ordered choice
+_other = re.compile( r'continue|break|pass' ).match
+_time = re.compile( r'([0-9]{1,2}:){1,3}[0-9]{1,2}' ).match
+_number_float = re.compile( r'[-+]?[0-9]+\.[0-9]+' ).match
+_number_int = re.compile( r'[-+]?[0-9]+' ).match
+_text = re.compile( r"'([^']*)'|\"([^\"]*)\"" ).match
+_boolean = re.compile( r'[Tt]rue|[Ff]alse' ).match
+_none = re.compile( r'[Nn]one' ).match
+_not = re.compile( r'[Nn]ot' ).match
+_operator = re.compile( r'\.|\^|\*|/|%|\+|-|&|\||and|or|==|!=|<=|>=|>|<' ).match
+
+_LETTERS = frozenset( 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ' )
+_DIGITS = frozenset( '0123456789' )
+_SCOPE_OPTIONS = ( 'description', 'expected_time', 'max_time' )
+
+
+class DescentParser( object ):
+  def __init__( self ):
+    super().__init__()
+    self.line_endings = []
+    self.text = ''
+    self._bad_scope = False
+    self._name_cache = ( None, None )
+    self._array_map_item_cache = {}
+
+  def lint( self, script ):
+    try:
+      ast = self._parse( script )
+    except ParserError as e:
+      return 'Incomplete Parsing on line: {0} column: {1}'.format( e.line, e.column )
+
+    try:
+      self._checkScopes( ast )
+    except Exception as e:
+      return 'Exception Parsing "{0}"'.format( e )
+
+    try:
+      self._check( ast )
+    except ParserError as e:
+      return 'Invalid Script "{0}", line: {1} column: {2}'.format( e.msg, e.line, e.column )
+
+    return None
+
+  def parse( self, script ):
+    ast = self._parse( script )
+    self._checkScopes( ast )
+    self._check( ast )
+
+    # if there is allready one Scope over the full script use it
+    if len( ast ) == 1 and ast[0][1][0] == Types.SCOPE:
+      return ast[0][1]
+
+    # otherwise create a wrapper Scope
+    return ( Types.SCOPE, { '_children': ast } )
+
+  _check = Parser._check
+
+  def _parse( self, script ):
+    text = script + '\n'  # just incase the end of the script lacks a \n otherwise the *line* will not match
+    self.text = text
+    self.line_endings = [ i for i, c in enumerate( text ) if c == '\n' ]
+    self._bad_scope = False
+    self._name_cache = ( None, None )
+    self._array_map_item_cache = {}
+
+    ast, pos = self._lines( 0 )
+    if pos < len( text ):  # line and column the same way as parsimonious
+      try:
+        column = pos - text.rindex( '\n', 0, pos )
+      except ValueError:
+        column = pos + 1
+
+      raise ParserError( text.count( '\n', 0, pos ) + 1, column, 'Incomplete Parse' )
+
+    return ast
+
+  def _checkScopes( self, ast ):  # the Parser checks the scope options as it evaluates, the first bad one in the script is the one raised
+    if not self._bad_scope:
+      return
+
+    for line in ast:
+      self._checkScopeNode( line[1] )
+
+  def _checkScopeNode( self, node ):
+    if node[0] == Types.SCOPE:
+      for name in node[1].keys():
+        if name not in _SCOPE_OPTIONS and name != '_children':
+          raise Exception( 'Scope option "{0}" not valid'.format( name ) )
+
+      for line in node[1][ '_children' ]:
+        self._checkScopeNode( line[1] )
+
+    elif node[0] == Types.WHILE:
+      self._checkScopeNode( node[1][ 'expression' ] )
+
+    elif node[0] == Types.IFELSE:
+      for branch in node[1]:
+        self._checkScopeNode( branch[ 'expression' ] )
+
+  # rules
+
+  def _lines( self, pos ):  # always matches
+    result = []
+    while True:
+      item = self._line( pos )
+      if item is None:
+        return ( result, pos )
+
+      node, pos = item
+      if node is not None:
+        result.append( node )
+
+  def _line( self, pos ):  # node is None for blank lines
+    text = self.text
+    item = self._expression( pos )
+    if item is None:
+      node = None
+      end = _ws_s( text, pos ).end()
+    else:
+      node, end = item
+      node = ( Types.LINE, node, bisect_right( self.line_endings, pos ) + 1 )
+
+    match = _comment( text, end )
+    if match is not None:
+      end = match.end()
+
+    match = _nl_p( text, end )
+    if match is None:
+      return None
+
+    return ( node, match.end() )
+
+  def _expression( self, pos ):
+    text = self.text
+    pos = _ws_s( text, pos ).end()
+    try:
+      char = text[ pos ]
+    except IndexError:
+      return None
+
+    if char in _LETTERS:
+      item = None
+      if char == 'g':
+        item = self._goto( pos )
+      if item is None:
+        item = self._function( pos )
+      if item is None and char == 'i':
+        item = self._ifelse( pos )
+      if item is None and char == 'w':
+        item = self._whiledo( pos )
+      if item is None and char == 'b':
+        item = self._block( pos )
+      if item is None:
+        item = self._assignment( pos )
+      if item is None:
+        item = self._letterConstant( pos, char )
+      if item is None and char in 'cbp':
+        match = _other( text, pos )
+        if match is not None:
+          item = ( ( Types.OTHER, match.group() ), match.end() )
+      if item is None:
+        item = self._array_map_item( pos )
+      if item is None:
+        item = self._variable( pos )
+
+    elif char == ':':
+      item = self._jump_point( pos )
+
+    else:
+      item = self._symbolValue( pos, char )
+
+    if item is None:
+      return None
+
+    return ( item[0], _ws_s( text, item[1] ).end() )
+
+  def _value_expression( self, pos ):
+    text = self.text
+    pos = _ws_s( text, pos ).end()
+    try:
+      char = text[ pos ]
+    except IndexError:
+      return None
+
+    if char in _LETTERS:
+      item = self._function( pos )
+      if item is None:
+        item = self._assignment( pos )
+      if item is None:
+        item = self._letterConstant( pos, char )
+      if item is None:
+        item = self._array_map_item( pos )
+      if item is None:
+        item = self._variable( pos )
+
+    else:
+      item = self._symbolValue( pos, char )
+
+    if item is None:
+      return None
+
+    return ( item[0], _ws_s( text, item[1] ).end() )
+
+  def _constant_expression( self, pos ):
+    text = self.text
+    pos = _ws_s( text, pos ).end()
+    try:
+      char = text[ pos ]
+    except IndexError:
+      return None
+
+    if char in 'TtFf':
+      item = self._boolean( pos )
+    elif char in 'Nn':
+      item = self._none( pos )
+    elif char in _DIGITS or char in '+-':
+      item = self._number( pos, char )
+    elif char in '\'"':
+      item = self._text( pos )
+    else:
+      item = None
+
+    if item is None:
+      return None
+
+    return ( item[0], _ws_s( text, item[1] ).end() )
+
+  def _letterConstant( self, pos, char ):  # boolean / not_ / none / exists, in that order
+    if char in 'TtFf':
+      return self._boolean( pos )
+
+    if char in 'Nn':
+      item = self._not_( pos )
+      if item is None:
+        item = self._none( pos )
+
+      return item
+
+    if char == 'e':
+      return self._exists( pos )
+
+    return None
+
+  def _symbolValue( self, pos, char ):  # infix / array / map / time / number_float / number_int / text, in that order
+    if char == '(':
+      return self._infix( pos )
+
+    if char == '[':
+      return self._array( pos )
+
+    if char == '{':
+      return self._map( pos )
+
+    if char in _DIGITS or char in '+-':
+      return self._number( pos, char )
+
+    if char in '\'"':
+      return self._text( pos )
+
+    return None
+
+  def _number( self, pos, char ):  # time / number_float / number_int
+    text = self.text
+    if char in _DIGITS:
+      match = _time( text, pos )
+      if match is not None:
+        parts = [ int( i ) for i in match.group().split( ':' ) ]  # days:hours:mins:seconds
+        if len( parts ) == 4:
+          value = timedelta( days=parts[0], hours=parts[1], minutes=parts[2], seconds=parts[3] )
+        elif len( parts ) == 3:
+          value = timedelta( hours=parts[0], minutes=parts[1], seconds=parts[2] )
+        else:
+          value = timedelta( minutes=parts[0], seconds=parts[1] )
+
+        return ( ( Types.CONSTANT, value ), match.end() )
+
+    match = _number_float( text, pos )
+    if match is not None:
+      return ( ( Types.CONSTANT, float( match.group() ) ), match.end() )
+
+    match = _number_int( text, pos )
+    if match is not None:
+      return ( ( Types.CONSTANT, int( match.group() ) ), match.end() )
+
+    return None
+
+  def _text( self, pos ):
+    match = _text( self.text, pos )
+    if match is None:
+      return None
+
+    value = match.group( 1 )
+    if value is None:
+      value = match.group( 2 )
+
+    return ( ( Types.CONSTANT, value ), match.end() )
+
+  def _boolean( self, pos ):
+    match = _boolean( self.text, pos )
+    if match is None:
+      return None
+
+    return ( ( Types.CONSTANT, match.group().lower() == 'true' ), match.end() )
+
+  def _none( self, pos ):
+    match = _none( self.text, pos )
+    if match is None:
+      return None
+
+    return ( ( Types.CONSTANT, None ), match.end() )
+
+  def _not_( self, pos ):  # we are going to abuse the INFIX functino for this one
+    match = _not( self.text, pos )
+    if match is None:
+      return None
+
+    item = self._value_expression( match.end() )
+    if item is None:
+      return None
+
+    return ( ( Types.INFIX, { 'operator': 'not', 'left': item[0], 'right': ( Types.CONSTANT, None ) } ), item[1] )
+
+  def _jump_point( self, pos ):
+    match = _label( self.text, pos + 1 )
+    if match is None:
+      return None
+
+    return ( ( Types.JUMP_POINT, match.group() ), match.end() )
+
+  def _goto( self, pos ):
+    if not self.text.startswith( 'goto ', pos ):
+      return None
+
+    match = _label( self.text, pos + 5 )
+    if match is None:
+      return None
+
+    return ( ( Types.GOTO, match.group() ), match.end() )
+
+  def _name( self, pos ):  # !reserved ( label "." )? label, returns ( module, name, end ) or None
+    if self._name_cache[0] == pos:  # function, assignment, array_map_item and variable all start with this
+      return self._name_cache[1]
+
+    text = self.text
+    result = None
+    if _reserved( text, pos ) is None:
+      match = _label( text, pos )
+      if match is not None:
+        end = match.end()
+        if text.startswith( '.', end ):
+          name = _label( text, end + 1 )
+          if name is not None:
+            result = ( match.group(), name.group(), name.end() )
+
+        else:
+          result = ( None, match.group(), end )
+
+    self._name_cache = ( pos, result )
+    return result
+
+  def _variable( self, pos ):
+    name = self._name( pos )
+    if name is None or self.text.startswith( '(', name[2] ):
+      return None
+
+    return ( ( Types.VARIABLE, { 'module': name[0], 'name': name[1] } ), name[2] )
+
+  def _function( self, pos ):
+    name = self._name( pos )
+    if name is None or not self.text.startswith( '(', name[2] ):
+      return None
+
+    params, end = self._paramater_map( name[2] + 1, self._value_expression )
+    if not self.text.startswith( ')', end ):
+      return None
+
+    return ( ( Types.FUNCTION, { 'module': name[0], 'name': name[1], 'paramaters': params } ), end + 1 )
+
+  def _array_map_item( self, pos ):
+    try:
+      return self._array_map_item_cache[ pos ]
+    except KeyError:
+      pass
+
+    result = None
+    item = self._variable( pos )
+    if item is not None and self.text.startswith( '[', item[1] ):
+      index = self._value_expression( item[1] + 1 )
+      if index is not None and self.text.startswith( ']', index[1] ):
+        variable = item[0][1]
+        result = ( ( Types.ARRAY_MAP_ITEM, { 'module': variable[ 'module' ], 'name': variable[ 'name' ], 'index': index[0] } ), index[1] + 1 )
+
+    self._array_map_item_cache[ pos ] = result
+    return result
+
+  def _assignment( self, pos ):
+    target = self._array_map_item( pos )
+    if target is None:
+      target = self._variable( pos )
+      if target is None:
+        return None
+
+    end = _ws_s( self.text, target[1] ).end()
+    if not self.text.startswith( '=', end ):
+      return None
+
+    value = self._value_expression( end + 1 )
+    if value is None:
+      return None
+
+    return ( ( Types.ASSIGNMENT, { 'target': target[0], 'value': value[0] } ), value[1] )
+
+  def _infix( self, pos ):
+    left = self._value_expression( pos + 1 )
+    if left is None:
+      return None
+
+    match = _operator( self.text, left[1] )
+    if match is None:
+      return None
+
+    right = self._value_expression( match.end() )
+    if right is None or not self.text.startswith( ')', right[1] ):
+      return None
+
+    return ( ( Types.INFIX, { 'operator': match.group(), 'left': left[0], 'right': right[0] } ), right[1] + 1 )
+
+  def _exists( self, pos ):
+    text = self.text
+    if not text.startswith( 'exists(', pos ):
+      return None
+
+    pos = _ws_s( text, pos + 7 ).end()
+    item = self._array_map_item( pos )
+    if item is None:
+      item = self._variable( pos )
+      if item is None:
+        return None
+
+    end = _ws_s( text, item[1] ).end()
+    if not text.startswith( ')', end ):
+      return None
+
+    return ( ( Types.EXISTS, item[0] ), end + 1 )
+
+  def _paramater_map( self, pos, value_expression ):  # always matches, returns ( dict, end )
+    # ( ( ws_s label ws_s "=" value "," )* ws_s label ws_s "=" value )? ws_s
+    # the repeat is greedy, so if the last one has a trailing ',' there is nothing left
+    # for the required one after it, and the whole optional part matches nothing
+    text = self.text
+    item_list = []
+    cur = pos
+    while True:
+      start = _ws_s( text, cur ).end()
+      match = _label( text, start )
+      if match is None:
+        break
+
+      end = _ws_s( text, match.end() ).end()
+      if not text.startswith( '=', end ):
+        break
+
+      value = value_expression( end + 1 )
+      if value is None:
+        break
+
+      item_list.append( ( match.group(), value[0] ) )
+      if not text.startswith( ',', value[1] ):
+        return ( dict( item_list ), _ws_s( text, value[1] ).end() )
+
+      cur = value[1] + 1
+
+    return ( {}, _ws_s( text, pos ).end() )
+
+  def _array( self, pos ):
+    text = self.text
+    value_list = []
+    cur = pos + 1
+    end = cur
+    while True:
+      value = self._value_expression( cur )
+      if value is None:
+        value_list = []
+        break
+
+      value_list.append( value[0] )
+      if not text.startswith( ',', value[1] ):
+        end = value[1]
+        break
+
+      cur = value[1] + 1
+
+    end = _ws_s( text, end ).end()
+    if not text.startswith( ']', end ):
+      return None
+
+    return ( ( Types.ARRAY, value_list ), end + 1 )
+
+  def _map( self, pos ):
+    values, end = self._paramater_map( pos + 1, self._value_expression )
+    if not self.text.startswith( '}', end ):
+      return None
+
+    return ( ( Types.MAP, values ), end + 1 )
+
+  def _block( self, pos ):
+    text = self.text
+    if not text.startswith( 'begin(', pos ):
+      return None
+
+    options, end = self._paramater_map( pos + 6, self._constant_expression )
+    if not text.startswith( ')', end ):
+      return None
+
+    children, end = self._lines( end + 1 )
+    end = _ws_s( text, end ).end()
+    if not text.startswith( 'end', end ):
+      return None
+
+    options = dict( ( name, value[1] ) for ( name, value ) in options.items() )
+    for name in options.keys():
+      if name not in _SCOPE_OPTIONS:
+        self._bad_scope = True  # raised after, it might not be in the final AST
+
+    options[ '_children' ] = children
+
+    return ( ( Types.SCOPE, options ), end + 3 )
+
+  def _whiledo( self, pos ):
+    text = self.text
+    if not text.startswith( 'while', pos ):
+      return None
+
+    condition = self._value_expression( pos + 5 )
+    if condition is None or not text.startswith( 'do', condition[1] ):
+      return None
+
+    match = _em_p( text, condition[1] + 2 )
+    if match is None:
+      return None
+
+    expression = self._expression( match.end() )
+    if expression is None:
+      return None
+
+    return ( ( Types.WHILE, { 'condition': condition[0], 'expression': expression[0] } ), expression[1] )
+
+  def _ifelse( self, pos ):
+    text = self.text
+    if not text.startswith( 'if', pos ):
+      return None
+
+    branch = self._branch( pos + 2 )
+    if branch is None:
+      return None
+
+    branch_list = [ branch[0] ]
+    end = branch[1]
+    while True:
+      start = _em_s( text, end ).end()
+      if not text.startswith( 'elif', start ):
+        break
+
+      branch = self._branch( start + 4 )
+      if branch is None:
+        break
+
+      branch_list.append( branch[0] )
+      end = branch[1]
+
+    start = _em_s( text, end ).end()
+    if text.startswith( 'else', start ):
+      match = _em_p( text, start + 4 )
+      if match is not None:
+        expression = self._expression( match.end() )
+        if expression is not None:
+          branch_list.append( { 'condition': None, 'expression': expression[0] } )
+          end = expression[1]
+
+    return ( ( Types.IFELSE, branch_list ), end )
+
+  def _branch( self, pos ):  # value_expression "then" em_p expression
+    text = self.text
+    condition = self._value_expression( pos )
+    if condition is None or not text.startswith( 'then', condition[1] ):
+      return None
+
+    match = _em_p( text, condition[1] + 4 )
+    if match is None:
+      return None
+
+    expression = self._expression( match.end() )
+    if expression is None:
+      return None
+
+    return ( { 'condition': condition[0], 'expression': expression[0] }, expression[1] )
@@ -0,0 +1,89 @@
+import pytest
+import random
+
+from contractor.tscript import parser
+from contractor.tscript.parser import Parser, ParserError
+from contractor.tscript.descent_parser import DescentParser
+
+from contractor.tscript.parser_test import *  # noqa: F401,F403  the whole parser_test corpus again, with DescentParser registered by the fixture below
+
+
+@pytest.fixture( autouse=True )
+def descent_parser():
+  parser.registerParser( DescentParser )
+  try:
+    yield
+  finally:
+    parser.registerParser( Parser )
+
+
+def test_registered():
+  assert isinstance( parser._parser_class(), DescentParser )
+
+
+def _result( instance, script ):
+  try:
+    return ( 'ast', instance.parse( script ) )
+  except ParserError as e:
+    return ( 'error', e.line, e.column, e.msg )
+  except Exception as e:
+    return ( 'exception', str( e ) )
+
+
+_peg = Parser()  # building the grammar is most of the time, it is reusable
+_descent = DescentParser()
+
+
+def _compare( script ):
+  assert _result( _descent, script ) == _result( _peg, script ), script
+  assert _descent.lint( script ) == _peg.lint( script ), script
+
+
+def test_same_as_peg():
+  for script in (
+                  'a[ b[ cc ] ]\nvar = a[ 1 ]\nnotthere = not there\nTruest = Trueish',
+                  'if True then begin( bogus=1 )\nend\nbegin( description="ok", other=2 )\nend',
+                  'begin()\nbegin( desc=1 )\n:here\nend\nend',
+                  'while ( cnt < 10 ) do\n  begin( description="loop" )\n    cnt = ( cnt + 1 )  # comment\n  end\nbreakfast',
+                  'foo( aa=1, bb=[ 1, 2, ], cc={ dd=1, } )',
+                  'if aa then 1\nelif bb then 2\n\n  else 3\nelif cc then 4',
+                  'exists( aa.bb[ 1 ] )\nexists(aa)\nexists( aa. )',
+                  'goto  here\n:here\ngoto here',
+                  '10:30\n1:2:3:4\n12:345\n-1.5\n+2\n"" . \'\'',
+                  'var = 1\r\nother = 2\rmore = 3',
+                  'aa.bb( cc=dd.ee, ff=( gg.hh[ ii ] == None ) )',
+                ):
+    _compare( script )
+
+
+TOKEN_LIST = [
+               ' ', ' ', '  ', '\t', '\n', '\n', '\r\n', 'aa', 'bb', 'cc.dd', 'ee', 'if', 'then', 'elif', 'else', 'while', 'do', 'begin(', ')', '(', 'end',
+               '=', '==', '+', '-', '*', '.', 'and', 'not', 'Not', 'True', 'false', 'None', 'exists(', '[', ']', '{', '}', ',', ':', 'goto ', 'pass', 'break',
+               '1', '12', '1.5', '-3', '10:20', '"str"', "'s'", '#', 'description=', 'max_time=', 'other=', 'ff='
+             ]
+
+
+def _randomScript( rnd ):
+  return ''.join( rnd.choice( TOKEN_LIST ) for _ in range( 0, rnd.randint( 1, 40 ) ) )
+
+
+def _mutate( rnd, script ):  # valid scripts with a bit changed, so it gets part way in
+  pos = rnd.randint( 0, len( script ) )
+  return script[ :pos ] + rnd.choice( TOKEN_LIST ) + script[ pos + rnd.randint( 0, 3 ): ]
+
+
+VALID_LIST = [
+               'begin( description="test" )\n  aa = [ 1, 2, ( 3 + bb ) ]\n  cc = { dd=1, ee=aa[ 0 ] }\nend',
+               'if ( aa == 1 ) then\n  bb = 2\nelif not cc then begin()\n  dd = 3\nend\nelse\n  ee = 4',
+               'while ( aa < 10 ) do aa = ( aa + 1 )\n:here\nmod.func( val=exists( mod.val ) )\ngoto here',
+               'aa = 10:30\nbb = -1.5\ncc = "str"  # comment\ndd = None\nee = True',
+             ]
+
+
+def test_random():
+  rnd = random.Random( 0 )
+  for _ in range( 0, 1000 ):
+    _compare( _randomScript( rnd ) )
+
+  for _ in range( 0, 1000 ):
+    _compare( _mutate( rnd, rnd.choice( VALID_LIST ) ) )
@@ -0,0 +1,221 @@
+import datetime
+
+from contractor.tscript.parser import Types
+
+# optional pass over the AST from the parser before it is compiled, the parts
+# of the script that are the same every time it runs are worked out once here
+# instead of every time the Runner gets to them:
+#   infix of constants are folded, ie: ( 1 + 2 ) -> 3
+#   arrays and maps of constants become constants
+#   if/elif branches with constant conditions are dropped or become the else,
+#   and while loops with a constant False condition are dropped
+#
+# the script does the same thing, however the ttl is charged for fewer nodes
+# and the status percentages are of what is left, so a Runner has to be
+# optimized or not for it's whole life, see Runner( optimize= )
+#
+# infix errors ( ie: ( 1 + 'a' ) ) are left for the Runner to raise when it
+# gets there, so they still come with the line number.
+
+# values a folded infix can be, anything else is left to the Runner, a list/map
+# of these is fine for arrays and maps, the compiler makes a copy each time
+SCALAR_TYPES = ( bool, int, float, str, type( None ), datetime.timedelta )
+
+
+class _Optimizer( object ):
+  def __init__( self, infix ):
+    super().__init__()
+    self.infix = infix  # function( operator, left, right ) -> value, same as the Runner does it
+
+  def optimize( self, node ):  # returns the new node, or None if the node does nothing and can be removed
+    try:
+      handler = getattr( self, '_' + _HANDLER_MAP[ node[0] ] )
+    except KeyError:
+      return node
+
+    return handler( node )
+
+  def _expression( self, node ):  # for where there has to be something
+    node = self.optimize( node )
+    if node is None:
+      return ( Types.CONSTANT, None )
+
+    return node
+
+  def _line( self, node ):
+    child = self.optimize( node[1] )
+    if child is None:
+      return None
+
+    return ( Types.LINE, child, node[2] )
+
+  def _scope( self, node ):
+    options = dict( node[1] )
+    child_list = [ self.optimize( child ) for child in options[ '_children' ] ]
+    options[ '_children' ] = [ child for child in child_list if child is not None ]
+    return ( Types.SCOPE, options )
+
+  def _array( self, node ):
+    item_list = [ self.optimize( item ) for item in node[1] ]
+    if all( item[0] == Types.CONSTANT for item in item_list ):
+      return ( Types.CONSTANT, [ item[1] for item in item_list ] )
+
+    return ( Types.ARRAY, item_list )
+
+  def _map( self, node ):
+    item_map = dict( ( key, self.optimize( value ) ) for ( key, value ) in node[1].items() )
+    if all( item[0] == Types.CONSTANT for item in item_map.values() ):
+      return ( Types.CONSTANT, dict( ( key, item[1] ) for ( key, item ) in item_map.items() ) )
+
+    return ( Types.MAP, item_map )
+
+  def _array_map_item( self, node ):
+    data = dict( node[1] )
+    data[ 'index' ] = self.optimize( data[ 'index' ] )
+    return ( Types.ARRAY_MAP_ITEM, data )
+
+  def _assignment( self, node ):
+    data = dict( node[1] )
+    data[ 'target' ] = self.optimize( data[ 'target' ] )
+    data[ 'value' ] = self.optimize( data[ 'value' ] )
+    return ( Types.ASSIGNMENT, data )
+
+  def _infix( self, node ):
+    data = dict( node[1] )
+    data[ 'left' ] = self.optimize( data[ 'left' ] )
+    data[ 'right' ] = self.optimize( data[ 'right' ] )
+    if data[ 'left' ][0] == Types.CONSTANT and data[ 'right' ][0] == Types.CONSTANT and isinstance( data[ 'left' ][1], SCALAR_TYPES ) and isinstance( data[ 'right' ][1], SCALAR_TYPES ):
+      try:
+        value = self.infix( data[ 'operator' ], data[ 'left' ][1], data[ 'right' ][1] )
+      except Exception:  # left for the Runner to raise when it gets there
+        pass
+      else:
+        if isinstance( value, SCALAR_TYPES ):
+          return ( Types.CONSTANT, value )
+
+    return ( Types.INFIX, data )
+
+  def _function( self, node ):
+    data = dict( node[1] )
+    data[ 'paramaters' ] = dict( ( key, self.optimize( value ) ) for ( key, value ) in data[ 'paramaters' ].items() )
+    return ( Types.FUNCTION, data )
+
+  def _while( self, node ):
+    condition = self.optimize( node[1][ 'condition' ] )
+    if condition[0] == Types.CONSTANT and not condition[1]:
+      return None
+
+    return ( Types.WHILE, { 'condition': condition, 'expression': self._expression( node[1][ 'expression' ] ) } )
+
+  def _ifelse( self, node ):
+    branch_list = []
+    for branch in node[1]:
+      condition = branch[ 'condition' ]
+      if condition is not None:
+        condition = self.optimize( condition )
+        if condition[0] == Types.CONSTANT:
+          if not condition[1]:  # never taken
+            continue
+
+          condition = None  # allways taken, the rest are never gotten to
+
+      branch_list.append( { 'condition': condition, 'expression': self._expression( branch[ 'expression' ] ) } )
+      if condition is None:
+        break
+
+    if not branch_list:
+      return None
+
+    if branch_list[0][ 'condition' ] is None:
+      return branch_list[0][ 'expression' ]
+
+    return ( Types.IFELSE, branch_list )
+
+  def _exists( self, node ):
+    return ( Types.EXISTS, self.optimize( node[1] ) )
+
+
+_HANDLER_MAP = {
+                 Types.LINE: 'line',
+                 Types.SCOPE: 'scope',
+                 Types.ARRAY: 'array',
+                 Types.MAP: 'map',
+                 Types.ARRAY_MAP_ITEM: 'array_map_item',
+                 Types.ASSIGNMENT: 'assignment',
+                 Types.INFIX: 'infix',
+                 Types.FUNCTION: 'function',
+                 Types.WHILE: 'while',
+                 Types.IFELSE: 'ifelse',
+                 Types.EXISTS: 'exists'
+               }
+
+
+def optimize( ast, infix ):
+  # infix is function( operator, left, right ) that returns the value of the infix or raises an Exception
+  return _Optimizer( infix ).optimize( ast )
+
+
+def _walk( node, line ):  # yields ( line, node ) for every node
+  yield ( line, node )
+
+  node_type = node[0]
+  if node_type == Types.LINE:
+    child_list = [ node[1] ]
+    line = node[2]
+  elif node_type == Types.SCOPE:
+    child_list = node[1][ '_children' ]
+  elif node_type == Types.ARRAY:
+    child_list = node[1]
+  elif node_type == Types.MAP:
+    child_list = node[1].values()
+  elif node_type == Types.ARRAY_MAP_ITEM:
+    child_list = [ node[1][ 'index' ] ]
+  elif node_type == Types.ASSIGNMENT:
+    child_list = [ node[1][ 'target' ], node[1][ 'value' ] ]
+  elif node_type == Types.INFIX:
+    child_list = [ node[1][ 'left' ], node[1][ 'right' ] ]
+  elif node_type == Types.FUNCTION:
+    child_list = node[1][ 'paramaters' ].values()
+  elif node_type == Types.WHILE:
+    child_list = [ node[1][ 'condition' ], node[1][ 'expression' ] ]
+  elif node_type == Types.IFELSE:
+    child_list = [ i for branch in node[1] for i in ( branch[ 'condition' ], branch[ 'expression' ] ) if i is not None ]
+  elif node_type == Types.EXISTS:
+    child_list = [ node[1] ]
+  else:
+    child_list = []
+
+  for child in child_list:
+    yield from _walk( child, line )
+
+
+def unknownReferences( ast, function_map, value_map ):
+  # returns a sorted list of ( line, 'module.name' ) for the module functions and values
+  # the script uses that are not in function_map/value_map ( the Runner's function_map and value_map ),
+  # the Runner would raise NotDefinedError when it got to them.  References inside of exists() are
+  # skipped, not being there is ok for them
+  result = set()
+  skip_set = set()
+  for ( line, node ) in _walk( ast, 0 ):
+    if node[0] == Types.EXISTS:
+      skip_set |= set( id( i[1] ) for i in _walk( node[1], line ) )
+      continue
+
+    if id( node ) in skip_set:
+      continue
+
+    if node[0] == Types.FUNCTION:
+      module_map = function_map
+    elif node[0] in ( Types.VARIABLE, Types.ARRAY_MAP_ITEM ):
+      module_map = value_map
+    else:
+      continue
+
+    module = node[1][ 'module' ]
+    if module is None:
+      continue
+
+    if module not in module_map or node[1][ 'name' ] not in module_map[ module ]:
+      result.add( ( line, '{0}.{1}'.format( module, node[1][ 'name' ] ) ) )
+
+  return sorted( result )
@@ -0,0 +1,89 @@
+import os
+import glob
+import argparse
+import tomllib
+
+from contractor.lib.benchmark import bench, report
+from contractor.tscript.parser import parse
+from contractor.tscript.compiler import compileAST
+from contractor.tscript.cache import scriptHash, getAST, clearCache
+from contractor.tscript.runner import Runner, compileOptimized
+
+RESOURCE_DIR = os.path.join( os.path.dirname( __file__ ), '..', '..', 'lib', 'resources' )
+LOOP_COUNT = 1000
+
+
+def resourceScripts():
+  # ( name, script ) of the scripts shipped in lib/resources
+  result = []
+  for filename in sorted( glob.glob( os.path.join( RESOURCE_DIR, '*.toml' ) ) ):
+    with open( filename, 'rb' ) as fp:
+      data = tomllib.load( fp )
+
+    for ( name, script ) in data.get( 'script', {} ).items():
+      result.append( ( name, script[ 'script' ] ) )
+
+  return result
+
+
+def makeScript( loop_count=LOOP_COUNT ):
+  # the kind of thing the optimizer is for, sizes worked out from constants,
+  # lists of constants and debugging branches turned off
+  return """cnt = 0
+total = 0
+while ( cnt < ( {0} * 1 ) ) do
+begin()
+  size = ( ( 1024 * 1024 ) * 4 )
+  disk_list = [ 'sda', 'sdb', ( 'sd' . 'c' ) ]
+  options = {{ size=size, mode=( 'raid' . 1 ) }}
+  if ( 1 > 2 ) then
+    total = -1
+  elif ( cnt > 10000 ) then
+    total = -2
+  else
+    total = ( total + len( array=disk_list ) )
+  cnt = ( cnt + 1 )
+end
+""".format( loop_count )
+
+
+def _run( script, script_hash, optimize ):
+  runner = Runner( getAST( script, script_hash ), script_hash, optimize )
+  runner.run( ttl=1000000 )  # no timeout, the loop is what is being timed
+  return runner
+
+
+def main():
+  parser = argparse.ArgumentParser( description='tscript optimizer benchmark' )
+  parser.add_argument( '-l', '--loops', help='number of times the loop in the synthetic script goes around (default: {0})'.format( LOOP_COUNT ), type=int, default=LOOP_COUNT )
+  args = parser.parse_args()
+
+  # the resource scripts are mostly calls out to plugins, so there is not much to fold, this is the
+  # size of what the Runner has to step through and what the optimizing costs at compile time
+  print( 'lib/resources scripts, instruction count' )
+  result_list = []
+  for ( name, script ) in resourceScripts():
+    ast = parse( script )
+    print( '  {0:<40} {1:>6} -> {2:>6}'.format( name, len( compileAST( ast ).code ), len( compileOptimized( ast ).code ) ) )
+    result_list.append( bench( '{0} compile'.format( name ), lambda: compileAST( ast ), number=100 ) )
+    result_list.append( bench( '{0} compile optimized'.format( name ), lambda: compileOptimized( ast ), number=100 ) )
+
+  report( 'lib/resources scripts, compile', result_list )
+
+  script = makeScript( args.loops )
+  ast = parse( script )
+  print( 'synthetic script, instruction count {0} -> {1}'.format( len( compileAST( ast ).code ), len( compileOptimized( ast ).code ) ) )
+
+  # the script_hash is set so the program is compiled once and reused, like the job runners do
+  clearCache()
+  script_hash = scriptHash( script )
+  assert _run( script, script_hash, True ).variable_map == _run( script, script_hash, False ).variable_map
+
+  result_list = []
+  result_list.append( bench( 'run', lambda: _run( script, script_hash, False ) ) )
+  result_list.append( bench( 'run optimized', lambda: _run( script, script_hash, True ) ) )
+  report( 'synthetic script, {0} loops'.format( args.loops ), result_list, baseline='run' )
+
+
+if __name__ == '__main__':
+  main()
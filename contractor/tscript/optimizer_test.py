@@ -0,0 +1,111 @@
+import pytest
+import pickle
+
+from contractor.tscript.parser import parse, Types
+from contractor.tscript.optimizer import optimize
+from contractor.tscript.runner import Runner, ParamaterError, NotDefinedError, _infixValue
+
+
+def _optimize( script ):
+  return optimize( parse( script ), _infixValue )
+
+
+def _run( script, optimize ):
+  runner = Runner( parse( script ), optimize=optimize )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  while not runner.done:
+    runner.run()
+
+  return runner
+
+
+def test_fold():
+  ast = _optimize( 'var = ( ( 1 + 2 ) * 3 )' )
+  assert ast[1][ '_children' ][0][1][1][ 'value' ] == ( Types.CONSTANT, 9 )
+
+  ast = _optimize( 'var = ( "a" . 1 )' )
+  assert ast[1][ '_children' ][0][1][1][ 'value' ] == ( Types.CONSTANT, 'a1' )
+
+  ast = _optimize( 'var = ( other + 2 )' )  # not constant
+  assert ast[1][ '_children' ][0][1][1][ 'value' ][0] == Types.INFIX
+
+  ast = _optimize( 'var = ( 1 + "a" )' )  # left for the runner
+  assert ast[1][ '_children' ][0][1][1][ 'value' ][0] == Types.INFIX
+
+  ast = _optimize( 'var = [ 1, ( 2 + 3 ), { aa=4 } ]' )
+  assert ast[1][ '_children' ][0][1][1][ 'value' ] == ( Types.CONSTANT, [ 1, 5, { 'aa': 4 } ] )
+
+
+def test_dead_branches():
+  ast = _optimize( 'if False then var = 1\nvar = 2' )
+  assert len( ast[1][ '_children' ] ) == 1
+  assert ast[1][ '_children' ][0][2] == 2
+
+  ast = _optimize( 'while ( 1 > 2 ) do var = 1' )
+  assert ast[1][ '_children' ] == []
+
+  ast = _optimize( 'if ( 1 > 2 ) then var = 1 elif True then var = 2 else var = 3' )
+  assert ast[1][ '_children' ][0][1][0] == Types.ASSIGNMENT
+  assert ast[1][ '_children' ][0][1][1][ 'value' ] == ( Types.CONSTANT, 2 )
+
+  ast = _optimize( 'if other then var = 1 elif True then var = 2 else var = 3' )
+  assert ast[1][ '_children' ][0][1][0] == Types.IFELSE
+  assert [ i[ 'condition' ] for i in ast[1][ '_children' ][0][1][1] ] == [ ( Types.VARIABLE, { 'module': None, 'name': 'other' } ), None ]
+
+
+def test_runner():
+  for script in (
+                  'var = ( ( 1 + 2 ) * 3 )\nif ( var > 5 ) then big = True else big = False',
+                  'cnt = 0\nwhile ( cnt < ( 2 * 5 ) ) do begin()\ncnt = ( cnt + 1 )\nif False then cnt = 100\nend',
+                  'arr = [ 1, 2, { aa=3 } ]\narr[1] = 4\nlist = append( array=[ 1, 2 ], value=3 )\nlen = len( array=arr )',
+                  'var = testing.multiply( value=( 2 + 3 ) )\nstuff = testing.bigstuff',
+                  'var = 1\n:here\nvar = ( var + 1 )\nif ( var < 4 ) then goto here'
+                ):
+    optimized = _run( script, True )
+    assert optimized.variable_map == _run( script, False ).variable_map
+    assert optimized.status[0][0] == 100.0
+
+  # constants are copied, changing one does not change the next time it is run
+  runner = Runner( parse( 'cnt = 0\nwhile ( cnt < 3 ) do begin()\nlast = pop( array=[ 1, 2 ] )\narr = [ 1, 2 ]\narr[0] = ( arr[0] + 10 )\ncnt = ( cnt + 1 )\nend' ), optimize=True )
+  runner.run()
+  assert runner.variable_map == { 'cnt': 3, 'last': 2, 'arr': [ 11, 2 ] }
+
+
+def test_runner_errors():
+  runner = Runner( parse( 'var = 1\nvar = ( 1 + "a" )' ), optimize=True )
+  with pytest.raises( ParamaterError ) as e:
+    runner.run()
+  assert e.value.line_no == 2
+
+  runner = Runner( parse( 'var = 1\ngoto nowhere' ), optimize=True )
+  with pytest.raises( NotDefinedError ) as e:
+    runner.run()
+  assert e.value.line_no == 2
+
+  runner = Runner( parse( 'var = 1\nnothere()' ), optimize=True )
+  with pytest.raises( NotDefinedError ) as e:
+    runner.run()
+  assert e.value.line_no == 2
+
+
+def test_pickle():
+  runner = Runner( parse( 'var = ( 1 + 2 )\ntesting.count( stop_at=2, count_by=1 )\nvar2 = [ var, ( 3 + 4 ) ]' ), optimize=True )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  runner.run()
+  assert not runner.done
+
+  runner = pickle.loads( pickle.dumps( runner ) )
+  assert runner.optimize
+  while not runner.done:
+    runner.run()
+
+  assert runner.variable_map == { 'var': 3, 'var2': [ 3, 7 ] }
+
+
+def test_unknown_references():
+  runner = Runner( parse( 'var = testing.bigstuff\ntesting.nothere()\nother.thing = 1\nif exists( other.maybe ) then var = 2\nvar = testing.multiply( value=missing.value )' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  assert runner.unknownReferences() == [ ( 2, 'testing.nothere' ), ( 3, 'other.thing' ), ( 5, 'missing.value' ) ]
+
+  runner = Runner( parse( 'var = testing.bigstuff' ) )
+  assert runner.unknownReferences() == [ ( 1, 'testing.bigstuff' ) ]
@@ -87,13 +87,25 @@ class ParserError( Exception ):
     return 'ParseError, line: {0}, column: {1}, "{2}"'.format( self.line, self.column, self.msg )
 
 
+AST_VERSION = 1  # change when the AST the parsers produce changes, stored ASTs of other versions are parsed again
+
+_parser_class = None  # set to Parser after it is defined
+
+
+def registerParser( parser_class ):
+  # the class lint() and parse() use, Parser ( the default ), or
+  # descent_parser.DescentParser, they produce the same results
+  global _parser_class
+  _parser_class = parser_class
+
+
 def lint( script ):
-  parser = Parser()
+  parser = _parser_class()
   return parser.lint( script )
 
 
 def parse( script ):
-  parser = Parser()
+  parser = _parser_class()
   return parser.parse( script )
 
 
@@ -358,3 +370,6 @@ class Parser( object ):
 
         elif node[0] == Types.SCOPE:
           node_stack.append( ( node[1][ '_children' ], stack_depth + 1 ) )
+
+
+registerParser( Parser )
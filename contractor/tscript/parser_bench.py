@@ -0,0 +1,89 @@
+import argparse
+import random
+
+from contractor.lib.benchmark import bench, report
+from contractor.tscript.parser import Parser
+from contractor.tscript.descent_parser import DescentParser
+
+LINE_COUNT_LIST = [ 10, 100, 1000, 10000 ]
+
+
+def _value( rnd, depth=0 ):
+  kind = rnd.random()
+  if depth > 2 or kind < 0.4:
+    return rnd.choice( [ '42', '-1.5', '"some text"', "'more'", 'True', 'None', '0:10:00', 'counter', 'config.value', 'item_list[ 2 ]' ] )
+
+  if kind < 0.6:
+    return '( {0} {1} {2} )'.format( _value( rnd, depth + 1 ), rnd.choice( [ '+', '-', '*', '.', '==', '<', 'and' ] ), _value( rnd, depth + 1 ) )
+
+  if kind < 0.75:
+    return '[ {0} ]'.format( ', '.join( _value( rnd, depth + 1 ) for _ in range( 0, rnd.randint( 0, 4 ) ) ) )
+
+  if kind < 0.85:
+    return '{{ {0} }}'.format( ', '.join( 'key{0}={1}'.format( i, _value( rnd, depth + 1 ) ) for i in range( 0, rnd.randint( 0, 3 ) ) ) )
+
+  return 'plugin.lookup( name={0}, default={1} )'.format( _value( rnd, depth + 1 ), _value( rnd, depth + 1 ) )
+
+
+def makeScript( line_count, seed=0 ):
+  # roughly what the blueprint scripts look like, blocks, if/elif/else, while
+  # loops, plugin calls, assignments and comments, line_count is approximate
+  rnd = random.Random( seed )
+  line_list = []
+  indent = ''
+  open_count = 0
+  while len( line_list ) < line_count:
+    kind = rnd.random()
+    if kind < 0.05 and open_count < 5:
+      line_list.append( '{0}begin( description="step {1}" )'.format( indent, len( line_list ) ) )
+      open_count += 1
+      indent += '  '
+    elif kind < 0.10 and open_count > 0:
+      indent = indent[ :-2 ]
+      open_count -= 1
+      line_list.append( '{0}end'.format( indent ) )
+    elif kind < 0.20:
+      line_list.append( '{0}# comment about the next step'.format( indent ) )
+    elif kind < 0.30:
+      line_list.append( '{0}if ( counter > {1} ) then'.format( indent, rnd.randint( 0, 100 ) ) )
+      line_list.append( '{0}  counter = {1}'.format( indent, _value( rnd ) ) )
+      line_list.append( '{0}elif not done then'.format( indent ) )
+      line_list.append( '{0}  plugin.step( value={1} )'.format( indent, _value( rnd ) ) )
+      line_list.append( '{0}else'.format( indent ) )
+      line_list.append( '{0}  done = True'.format( indent ) )
+    elif kind < 0.35:
+      line_list.append( '{0}while ( counter < 10 ) do counter = ( counter + 1 )'.format( indent ) )
+    elif kind < 0.60:
+      line_list.append( '{0}plugin.action( target=structure.name, value={1} )'.format( indent, _value( rnd ) ) )
+    else:
+      line_list.append( '{0}var{1} = {2}'.format( indent, len( line_list ), _value( rnd ) ) )
+
+  while open_count > 0:
+    indent = indent[ :-2 ]
+    open_count -= 1
+    line_list.append( '{0}end'.format( indent ) )
+
+  return '\n'.join( line_list )
+
+
+def main():
+  parser = argparse.ArgumentParser( description='tscript parser benchmark' )
+  parser.add_argument( '-l', '--lines', help='script sizes to parse (default: {0})'.format( ' '.join( str( i ) for i in LINE_COUNT_LIST ) ), type=int, nargs='+', default=LINE_COUNT_LIST )
+  parser.add_argument( '-r', '--repeat', help='number of times to parse each script, the best time is reported (default: 3)', type=int, default=3 )
+  args = parser.parse_args()
+
+  for line_count in args.lines:
+    script = makeScript( line_count )
+    assert DescentParser().parse( script ) == Parser().parse( script )
+
+    # a new parser each time, the same as tscript.parser.parse() does
+    result_list = []
+    result_list.append( bench( 'Parser', lambda: Parser().parse( script ), repeat=args.repeat ) )
+    result_list.append( bench( 'DescentParser', lambda: DescentParser().parse( script ), repeat=args.repeat ) )
+    report( '{0} lines'.format( line_count ), result_list, baseline='Parser' )
+    for ( name, elapsed ) in result_list:
+      print( '  {0:<40} {1:>12.0f} lines/s'.format( name, line_count / elapsed ) )
+
+
+if __name__ == '__main__':
+  main()
@@ -4,10 +4,15 @@ import traceback
 import datetime
 import copy
 import logging
+import collections
+from types import ModuleType
 from importlib import import_module
 from django.conf import settings
 
 from contractor.tscript.parser import Types
+from contractor.tscript.compiler import Op, compileAST
+from contractor.tscript.optimizer import optimize, unknownReferences
+from contractor.tscript.cache import lookupAST, isPersisted, getProgram
 
 
 # thrown when the scipt would like to pause execution, calling run() resumes execution
@@ -373,790 +378,839 @@ def _delta_to_string( delta ):
     return '{0}{1:02}:{2:02}'.format( sign, minutes, seconds )
 
 
-class Runner( object ):
-  def __init__( self, ast ):
+class _ModuleMap( dict ):
+  # map of module name -> values/functions map, the values/functions map is only built
+  # the first time the module name is looked up.  Objects like the ConfigPlugin can be
+  # expensive to get the map from, and most steps of a script only use one or two modules
+  def __init__( self, source_map, module_attribute, object_function ):
     super().__init__()
-    self.ast = ast
+    self._source_map = source_map
+    self._module_attribute = module_attribute
+    self._object_function = object_function
+
+  def __missing__( self, name ):
+    source = self._source_map[ name ]  # a KeyError here is the same as a unregistered module
+    if isinstance( source, ModuleType ):
+      result = getattr( source, self._module_attribute )
+    else:
+      result = getattr( source, self._object_function )()
 
-    # serilize
-    self.module_list = []   # list of the loaded modules
-    self.object_list = []   # list of loaded embeded objects
-    self.state = []         # list of ( <type>, work values, [ return value ] ), for each level of the AST to the curent execution point
-    self.variable_map = {}  # map of the variables, they are all global
-    self.cur_line = 0
-    self.contractor_cookie = None
+    self[ name ] = result
+    return result
 
-    # do not serlize
-    self.jump_point_map = {}
-    self.function_map = {}
-    self.value_map = {}
+  def __contains__( self, name ):
+    return name in self._source_map
 
-    # scan for all the jump points
-    for i in range( 0, len( ast[1][ '_children' ] ) ):
-      child = ast[1][ '_children' ][i][1]  # jump into the line
-      if child[0] == Types.JUMP_POINT:
-        self.jump_point_map[ child[1] ] = i
+  def __iter__( self ):
+    return iter( list( self._source_map.keys() ) )
 
-  @property
-  def line( self ):
-    return self.cur_line
+  def __len__( self ):
+    return len( self._source_map )
 
-  @property
-  def done( self ):
-    return self.state == 'DONE'
+  def keys( self ):
+    return list( self._source_map.keys() )
 
-  @property
-  def aborted( self ):
-    return self.state == 'ABORTED'
+  def values( self ):
+    return [ self[ name ] for name in self._source_map ]
 
-  @property
-  def status( self ):  # list of ( % complete, operation, paramaters )
-    logging.debug( 'runner: status state: {0}'.format( self.state ) )
-    if self.done or self.aborted:
-      return [ ( 100.0, 'Scope', None ) ]
-    if len( self.state ) == 0:
-      return [ ( 0.0, 'Scope', None ) ]
+  def items( self ):
+    return [ ( name, self[ name ] ) for name in self._source_map ]
 
-    item_list = []  # ( scope position, scope length, scope type, scope data )
-    operation = self.ast
-    for step in self.state:  # condense into on loop, last status may be a blocking function with remote and status values
-      step_type = step[0]
-      try:
-        step_data = step[1]
-      except IndexError:
-        step_data = None
+  def get( self, name, default=None ):
+    try:
+      return self[ name ]
+    except KeyError:
+      return default
 
-      if step_type == Types.SCOPE:
-        tmp = {}
-        for item in ( 'description', ):
-          try:
-            tmp[ item ] = operation[1][ item ]
-          except ( KeyError, TypeError ):
-            pass
+  def forget( self, name ):
+    try:
+      dict.__delitem__( self, name )
+    except KeyError:
+      pass
 
-        try:
-          elapsed = datetime.datetime.now( datetime.UTC ) - step[2]
-        except IndexError:
-          elapsed = datetime.timedelta(0)
-        tmp[ 'time_elapsed' ] = _delta_to_string( elapsed )
-        if 'expected_time' in operation[1]:
-          tmp[ 'time_remaining' ] = _delta_to_string( operation[1][ 'expected_time' ] - elapsed )
 
-        if step_data is None:  # no point in continuing, we don't know where we are
-          item_list.append( ( 0, len( operation[1][ '_children' ] ), 'Scope', tmp ) )
-          break
+# set Runner.tracer to follow what the script is doing, when it is None (the default) none of this is called
+# and nothing is spent working out what to tell it.  The tracer is not pickled with the Runner.
+# entry is ( <node type>, ... ), the node type is from parser.Types, see compiler._Compiler.enter for the rest
 
-        item_list.append( ( step_data, len( operation[1][ '_children' ] ), 'Scope', tmp ) )
-        operation = operation[1][ '_children' ][ step_data ]
+class Tracer( object ):
+  def enter( self, runner, entry ):
+    # a node of the script is entered, this is called for each node the ttl is charged for, so when
+    # run() picks back up, the nodes it is inside of are entered again, same after a goto
+    pass
 
-      elif step_type == Types.WHILE:  # if a while loop is on the stack, we must be in it, keep on going
-        item_list.append( ( 0, 1, 'While', { 'doing': step_data[ 'doing' ] } ) )
-        if step_data[ 'doing' ] == 'expression':
-          operation = operation[1][ 'expression' ]
-        elif step_data[ 'doing' ] == 'condition':
-          operation = operation[1][ 'condition' ]
-        else:
-          raise Exception( 'Unknown While doing "{0}"'.format( step_data[ 'doing' ] ) )
-
-      elif step_type == Types.IFELSE:
-        item_list.append( ( step_data[ 'index' ], len( operation[1] ), 'IfElse', { 'doing': step_data[ 'doing' ] } ) )
-        if step_data[ 'doing' ] == 'expression':
-          operation = operation[1][ step_data[ 'index' ] ][ 'expression' ]
-        elif step_data[ 'doing' ] == 'condition':
-          operation = operation[1][ step_data[ 'index' ] ][ 'condition' ]
-        else:
-          raise Exception( 'Unknown IfElse doing "{0}"'.format( step_data[ 'doing' ] ) )
+  def exit( self, runner, entry ):
+    # the node is done
+    pass
 
-      elif step_type == Types.LINE:
-        operation = operation[1]
+  def dispatch( self, runner, module, name, paramaters ):
+    # the function is called, this is only called once per call, even if the function takes many run()s to finish
+    # module is None for builtin functions
+    pass
 
-      elif step_type == Types.FUNCTION:
-        tmp = {}
-        for item in ( 'dispatched', ):
-          try:
-            tmp[ item ] = step_data[ item ]
-          except ( TypeError, KeyError ):
-            pass
+  def goto( self, runner, name ):
+    pass
 
-        for item in ( 'module', 'name' ):
-          try:
-            tmp[ item ] = operation[1][ item ]
-          except ( TypeError, KeyError ):
-            pass
+  def interrupt( self, runner, exception ):
+    # run() is stopping before the script is done, exception is the Interrupt, Pause, Timeout, etc that
+    # is stopping it.  NOTE: the nodes it is in are not exited
+    pass
 
-        item_list.append( ( 0, 1, 'Function', tmp ) )
 
-      elif step_type == Types.ASSIGNMENT:
-        if operation[1][ 'target' ][0] == Types.ARRAY_MAP_ITEM and ( step_data is None or 'index' not in step_data ):
-          operation = operation[1][ 'target' ][1][ 'index' ]
-        elif step_data is None or 'value' not in step_data:
-          operation = operation[1][ 'value' ]
-        else:
-          raise Exception( 'status - assignment confused' )
+class StructuredTracer( Tracer ):
+  # keeps the last max_events events as dicts, and if log is True sends them to logging.debug
+  def __init__( self, max_events=1000, log=True ):
+    super().__init__()
+    self.event_list = collections.deque( maxlen=max_events )
+    self.log = log
 
-      elif step_type == Types.INFIX:
-        try:
-          step_data[ 'left' ]
-          try:
-            step_data[ 'right' ]
-            raise Exception( 'Unknown Infix doing "{0}"'.format( step_data[ 'doing' ] ) )
-          except KeyError:
-            operation = operation[1][ 'right' ]
-        except (TypeError, KeyError ):  # NOTE: TypeError occurs when there is no step data, in this case we are still after the left side
-          operation = operation[1][ 'left' ]
+  def _event( self, runner, event ):
+    event.setdefault( 'line', runner.cur_line )
+    self.event_list.append( event )
+    if self.log:
+      logging.debug( 'runner: trace %s', event )
 
-      elif step_type in ( Types.CONSTANT, Types.VARIABLE, Types.GOTO ):
-        pass
-        # raise Exception( 'Not suposed to get here, interesting.' )
+  def _nodeEvent( self, runner, event, entry ):
+    result = { 'event': event, 'type': entry[0] }
+    if entry[0] == Types.LINE and len( entry ) > 1:
+      result[ 'line' ] = entry[1]
+    elif entry[0] == Types.SCOPE and len( entry ) > 1:
+      result[ 'index' ] = entry[2]
+    elif entry[0] == Types.WHILE and len( entry ) > 1:
+      result[ 'doing' ] = entry[1]
+    elif entry[0] == Types.IFELSE and len( entry ) > 1:
+      result[ 'index' ] = entry[1]
+      result[ 'doing' ] = entry[3]
+    elif entry[0] == Types.FUNCTION and len( entry ) > 1:
+      result[ 'module' ] = entry[1]
+      result[ 'name' ] = entry[2]
 
-      else:
-        raise Exception( 'Confused step type "{0}"'.format( step_type ) )
+    self._event( runner, result )
 
-    logging.debug( 'runner: status item_list {0}'.format( item_list ) )
+  def enter( self, runner, entry ):
+    self._nodeEvent( runner, 'enter', entry )
 
-    result = []
-    last_perc_complete = 0
-    for item in reversed( item_list ):  # work backwards, as we go up, we scale the last perc_complete acording to the % of the curent scope
-      # before + -> scaling the last % complete .... after the +  -> the curent %
-      perc_complete = ( 1.0 / item[1] ) * last_perc_complete + ( 100.0 * item[0] ) / item[1]
-      result.insert( 0, ( perc_complete, item[2], item[3] ) )
-      last_perc_complete = perc_complete
+  def exit( self, runner, entry ):
+    self._nodeEvent( runner, 'exit', entry )
 
-    return result
+  def dispatch( self, runner, module, name, paramaters ):
+    self._event( runner, { 'event': 'dispatch', 'module': module, 'name': name, 'paramaters': paramaters } )
 
-  def goto( self, jump_point ):
-    try:
-      pos = self.jump_point_map[ jump_point ]
-    except KeyError:
-      raise NotDefinedError( jump_point )
+  def goto( self, runner, name ):
+    self._event( runner, { 'event': 'goto', 'name': name } )
 
-    self.state = [ [ Types.SCOPE, pos ] ]
+  def interrupt( self, runner, exception ):
+    self._event( runner, { 'event': 'interrupt', 'exception': type( exception ).__name__, 'message': str( exception ) } )
 
-  def run( self, ttl=1000 ):
-    logging.debug( 'runner: run start' )
-    if self.aborted:
-      return 'aborted'
 
-    if self.done:
-      return 'done'
+def _infixValue( operator, left_val, right_val, line_no=None ):
+  if operator in infix_string_operator_map:  # the string group
+    if not isinstance( left_val, str ):
+      left_val = str( left_val )
+    if not isinstance( right_val, str ):
+      right_val = str( right_val )
 
-    self.ttl = ttl
+    return infix_string_operator_map[ operator ]( left_val, right_val )
 
-    while True:  # we are a while loop for the benifit of the goto
-      try:
-        self._evaluate( self.ast, 0 )
-        return ''
+  elif operator in infix_math_operator_map:  # the number group
+    if not isinstance( left_val, ( int, float, bool ) ):
+      raise ParamaterError( 'left of operator', 'must be numeric', line_no )
+    if not isinstance( right_val, ( int, float, bool ) ):
+      raise ParamaterError( 'right of operator', 'must be numeric', line_no )
 
-      except Goto as e:  # yank the stack to this jump point,  NOTE: jump points can only be in the global scope
-        try:
-          self.goto( e.name )
-        except NotDefinedError:
-          self.state = 'ABORTED'
-          raise NotDefinedError( e.name, e.line_no )
+    return infix_math_operator_map[ operator ]( left_val, right_val )
 
-      except Interrupt as e:
-        return str( e )
+  elif operator in infix_logical_operator_map:  # the logical group
+    return infix_logical_operator_map[ operator ]( left_val, right_val )
 
-      except ( Pause, ExecutionError ) as e:
-        raise e
+  raise NotDefinedError( operator, line_no )
 
-      except ( UnrecoverableError, ParamaterError, NotDefinedError, ScriptError ) as e:
-        self.state = 'ABORTED'
-        raise e
 
-      except Exception as e:
-        self.state = 'ABORTED'  # TODO: watch some kind of DEBUG flag to enable/disable the stack trace
-        logging.exception( 'runner: Unahndled Exception' )
-        raise UnrecoverableError( 'Unahndled Exception ({0}): "{1}"\ntrace:\n{2}'.format( type( e ).__name__, str( e ), traceback.format_exc() ) )
+def _copyConstant( value ):  # faster than deepcopy for the constants the optimizer makes
+  if isinstance( value, list ):
+    return [ _copyConstant( i ) for i in value ]
 
-    logging.debug( 'runner: run finish' )
+  if isinstance( value, dict ):
+    return dict( ( key, _copyConstant( i ) ) for ( key, i ) in value.items() )
 
-  def _evaluate( self, operation, state_index ):
-    logging.debug( 'runner: _evaluate level: "{0}" operation: "{1}"'.format( state_index, operation ) )
-    logging.debug( 'runner: _evaluate level: "{0}" start state: "{1}"'.format( state_index, self.state ) )
+  return value
 
-    op_type = operation[0]
-    op_data = operation[1]
-    try:
-      if self.state[ state_index ][0] != op_type:
-        raise Exception( 'State type does not match AST type at {0}. Expected "{1}" got "{2}"'.format( state_index, self.state[ state_index ][0], op_type ) )
-    except IndexError:
-      self.state.append( [ op_type ] )
 
-    if self.ttl <= 0:
-      raise Timeout( self.cur_line )
+def compilePlain( ast ):
+  return compileAST( ast, builtin_function_map )
 
-    self.ttl -= 1
 
-    # NOTE:
-    # the logic here can seem a bit funny, however you have to keep
-    # in mind that this has to be "re-entrant" ( for lack of a better word )
-    # anytime you call _evaluate, execution may be aborted to take care of
-    # a blocking function, so you have to check if your state has been setup
-    # and sometimes it has to be set up in stages and checked as if you
-    # have or haven't been through it before.
-    if op_type == Types.LINE:
-      self.cur_line = operation[2]
-      self._evaluate( op_data, state_index + 1 )
+def compileOptimized( ast ):  # see optimizer.py
+  return compileAST( optimize( ast, _infixValue ), builtin_function_map )
 
-    elif op_type == Types.SCOPE:
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( 0 )
-        self.state[ state_index ].append( datetime.datetime.now( datetime.UTC ) )
-        if 'max_time' in op_data:
-          self.state[ state_index ].append( op_data[ 'max_time' ] + datetime.datetime.now( datetime.UTC )  )
 
-      try:
-        if self.state[ state_index ][3] is None:
-          self.state[ state_index ][3] = datetime.datetime.now( datetime.UTC )  # last time was a timeout, so set it so next run will timeout
+_CALL_RAISED = 'raised'  # Runner.call when the function returned an Exception, and it was raised
 
-        elif datetime.datetime.now( datetime.UTC ) > self.state[ state_index ][3]:
-          self.state[ state_index ][3] = None
-          raise Pause( 'Max Time Elapsed' )
 
-      except IndexError:  # no max time
-        pass
+def _newFrame( max_time ):  # frame for a scope, [ start time ] or [ start time, max time ]
+  now = datetime.datetime.now( datetime.UTC )
+  if max_time is None:
+    return [ now ]
 
-      while self.state[ state_index ][1] < len( op_data[ '_children' ] ):
-        self._evaluate( op_data[ '_children' ][ self.state[ state_index ][ 1 ] ], state_index + 1 )
-        self.state[ state_index ][1] += 1
+  return [ now, now + max_time ]
 
-    elif op_type == Types.CONSTANT:  # reterieve constant value
-      try:
-        self.state[ state_index ][2] = op_data
-      except IndexError:
-        self.state[ state_index ] += [ None, op_data ]
 
-    elif op_type == Types.VARIABLE:  # reterieve variable value
-      if op_data[ 'module' ] is None:
-        try:
-          value = self.variable_map[ op_data[ 'name' ] ]
-        except KeyError:
-          raise NotDefinedError( op_data[ 'name' ], self.cur_line )
+def _checkMaxTime( frame ):
+  try:
+    if frame[1] is None:
+      frame[1] = datetime.datetime.now( datetime.UTC )  # last time was a timeout, so set it so next run will timeout
 
-      else:
-        try:
-          module = self.value_map[ op_data[ 'module' ] ]
-        except KeyError:
-          raise NotDefinedError( op_data[ 'module' ], self.cur_line )
+    elif datetime.datetime.now( datetime.UTC ) > frame[1]:
+      frame[1] = None
+      raise Pause( 'Max Time Elapsed' )
 
-        try:
-          getter = module[ op_data[ 'name' ] ][0]  # index 0 is the getter
-        except KeyError:
-          raise NotDefinedError( '{0}" of module "{1}'.format( op_data[ 'name' ], op_data[ 'module' ] ), self.cur_line )
+  except IndexError:  # no max time
+    pass
 
-        if getter is None:
-          raise ParamaterError( 'target', '"{0}" of module "{1}" is not gettable'.format( op_data[ 'name' ], op_data[ 'module' ] ), self.cur_line )
 
-        try:
-          value = getter()
-        except Exception as e:
-          _debugDump( 'getter "{0}" in module "{1}" error during setup on line "{2}"'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line ), e, self.ast, self.state )
-          raise UnrecoverableError( 'getter "{0}" in module "{1}" error during setup on line "{2}": "{3}"({4})'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line, str( e ), e.__class__.__name__) )
+def _runnerFromScriptHash( cls, script_hash, optimize=False ):
+  return cls( lookupAST( script_hash ), script_hash, optimize )
 
-      try:
-        self.state[ state_index ][2] = value
-      except IndexError:
-        self.state[ state_index ] += [ None, value ]
 
-    elif op_type == Types.ARRAY:  # return array
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( [] )
+class Runner( object ):
+  def __init__( self, ast, script_hash=None, optimize=False ):  # script_hash is the tscript.cache hash of the script the ast came from, if set, the ast is not pickled, just the hash
+    super().__init__()
+    self.ast = ast
+    self.script_hash = script_hash
+    self.optimize = optimize  # run the script through the optimizer first, see optimizer.py
+    self.program = getProgram( ast, script_hash, compileOptimized if optimize else compilePlain )
 
-      for i in range( len( self.state[ state_index ][1] ), len( op_data ) ):
-        try:
-          self.state[ state_index + 1 ][2]
-        except IndexError:
-          self._evaluate( op_data[ i ], state_index + 1 )
+    # serilize
+    self.module_list = []   # list of the loaded modules
+    self.object_list = []   # list of loaded embeded objects
+    self.pc = 0             # index of the next instruction in program.code
+    self.stack = []         # values of the expressions being evaluated
+    self.frame_list = []    # for each scope we are in, [ start time ] or [ start time, max time ]
+    self.call = None        # the function call the instruction at pc is working on, see _call
+    self.end_state = None   # 'DONE' or 'ABORTED' once the script is no longer running
+    self.variable_map = {}  # map of the variables, they are all global
+    self.cur_line = 0
+    self.contractor_cookie = None
 
-        self.state[ state_index ][1].append( self.state[ state_index + 1 ][2] )
-        self.state = self.state[ :( state_index + 1 ) ]
+    # do not serlize
+    self.jump_point_map = self.program.jump_point_map
+    self.tracer = None  # see Tracer
+    self._trace_path = ()  # the nodes the tracer was last told we are in
+    self._source_map = {}  # module name -> python module or object the values and functions come from
+    self.function_map = _ModuleMap( self._source_map, 'TSCRIPT_FUNCTIONS', 'getFunctions' )
+    self.value_map = _ModuleMap( self._source_map, 'TSCRIPT_VALUES', 'getValues' )
 
-      self.state[ state_index ].append( self.state[ state_index ][1] )
-      self.state[ state_index ][1] = None
+  @property
+  def line( self ):
+    return self.cur_line
 
-    elif op_type == Types.MAP:  # return map
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( {} )
+  @property
+  def done( self ):
+    return self.end_state == 'DONE'
 
-      for key in op_data:
-        try:
-          self.state[ state_index + 1 ][2]
-        except IndexError:
-          self._evaluate( op_data[ key ], state_index + 1 )
+  @property
+  def aborted( self ):
+    return self.end_state == 'ABORTED'
 
-        self.state[ state_index ][1][ key ] = self.state[ state_index + 1 ][2]
-        self.state = self.state[ :( state_index + 1 ) ]
+  @property
+  def _running( self ):
+    return self.end_state is None and ( self.pc > 0 or len( self.frame_list ) > 0 )
 
-      self.state[ state_index ].append( self.state[ state_index ][1] )
-      self.state[ state_index ][1] = None
+  @property
+  def state( self ):
+    # where the script is at, as list of [ <type>, work values ] for each level of the AST down to the
+    # curent instruction, the same as the Runner kept before it was compiled, 'DONE', 'ABORTED', or [] if not started
+    if self.end_state is not None:
+      return self.end_state
 
-    elif op_type == Types.ARRAY_MAP_ITEM:  # reterieve array index value
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( {} )
+    if not self._running:
+      return []
 
-      # evaluate the index
-      try:
-        self.state[ state_index ][1][ 'index' ]
-      except KeyError:
+    result = []
+    scope_index = 0
+    for entry in self.program.path_list[ self.pc ]:
+      if entry[0] == Types.SCOPE:
         try:
-          self.state[ state_index + 1 ][2]
+          result.append( [ Types.SCOPE, entry[2] ] + self.frame_list[ scope_index ] )
         except IndexError:
-          self._evaluate( op_data[ 'index' ], state_index + 1 )
+          result.append( [ Types.SCOPE ] )
+        scope_index += 1
 
-        self.state[ state_index ][1][ 'index' ] = self.state[ state_index + 1 ][2]
-        self.state = self.state[ :( state_index + 1 ) ]
+      elif entry[0] == Types.WHILE:
+        result.append( [ Types.WHILE, { 'doing': entry[1] } ] )
 
-      # look up the variable
-      if op_data[ 'module' ] is None:
-        try:
-          value = self.variable_map[ op_data[ 'name' ] ]
-        except KeyError:
-          raise NotDefinedError( op_data[ 'name' ], self.cur_line )
+      elif entry[0] == Types.IFELSE:
+        result.append( [ Types.IFELSE, { 'index': entry[1], 'doing': entry[3] } ] )
 
       else:
-        try:
-          module = self.value_map[ op_data[ 'module' ] ]
-        except KeyError:
-          raise NotDefinedError( op_data[ 'module' ], self.cur_line )
+        result.append( [ entry[0] ] )
 
-        try:
-          getter = module[ op_data[ 'name' ] ][0]  # index 0 is the getter
-        except KeyError:
-          raise NotDefinedError( '{0}" of "{1}'.format( op_data[ 'module' ], op_data[ 'name' ] ), self.cur_line )
+    if self.call == _CALL_RAISED:
+      result[ -1 ] = [ Types.FUNCTION, None, None ]
+    elif self.call is not None:
+      result[ -1 ] = [ Types.FUNCTION, self.call ]
 
-        if getter is None:
-          raise ParamaterError( 'target', '"{0}" of "{1}" is not gettable'.format( op_data[ 'module' ], op_data[ 'name' ] ), self.cur_line )
+    return result
+
+  @property
+  def status( self ):  # list of ( % complete, operation, paramaters )
+    if self.done or self.aborted:
+      return [ ( 100.0, 'Scope', None ) ]
+    if not self._running:
+      return [ ( 0.0, 'Scope', None ) ]
+
+    item_list = []  # ( scope position, scope length, scope type, scope data )
+    now = datetime.datetime.now( datetime.UTC )
+    path = self.program.path_list[ self.pc ]
+    scope_index = 0
+    for entry in path:
+      entry_type = entry[0]
+      if entry_type == Types.SCOPE:
+        options = entry[1]
+        tmp = {}
+        if 'description' in options:
+          tmp[ 'description' ] = options[ 'description' ]
 
         try:
-          value = getter()
-        except Exception as e:
-          _debugDump( 'getter "{0}" in module "{1}" error during setup on line "{2}"'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line ), e, self.ast, self.state )
-          raise UnrecoverableError( 'getter "{0}" in module "{1}" error during setup on line "{2}": "{3}"({4})'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line, str( e ), e.__class__.__name__) )
+          elapsed = now - self.frame_list[ scope_index ][0]
+        except IndexError:
+          elapsed = datetime.timedelta(0)
+        tmp[ 'time_elapsed' ] = _delta_to_string( elapsed )
+        if 'expected_time' in options:
+          tmp[ 'time_remaining' ] = _delta_to_string( options[ 'expected_time' ] - elapsed )
 
-      index = self.state[ state_index ][1][ 'index' ]
+        item_list.append( ( entry[2], entry[3], 'Scope', tmp ) )
+        scope_index += 1
 
-      try:
-        value = value[ index ]
-      except ( IndexError, KeyError ):
-        raise NotDefinedError( 'Index/Key does not exist', self.cur_line )
+      elif entry_type == Types.WHILE:  # if a while loop is on the stack, we must be in it, keep on going
+        item_list.append( ( 0, 1, 'While', { 'doing': entry[1] } ) )
 
-      self.state[ state_index ][1] = None
-      try:
-        self.state[ state_index ][2] = value
-      except IndexError:
-        self.state[ state_index ].append( value )
+      elif entry_type == Types.IFELSE:
+        item_list.append( ( entry[1], entry[2], 'IfElse', { 'doing': entry[3] } ) )
 
-    elif op_type == Types.ASSIGNMENT:  # get the value from 'value', and assign it to the variable defined in 'target'
-      if op_data[ 'target' ][0] not in ( Types.VARIABLE, Types.ARRAY_MAP_ITEM ) or ( op_data[ 'target' ][0] == Types.ARRAY_MAP_ITEM and op_data[ 'target' ][1][ 'module' ] is not None ):
-        raise ParamaterError( 'target', 'Can only assign to variables', self.cur_line )
+      elif entry_type == Types.FUNCTION:
+        tmp = { 'module': entry[1], 'name': entry[2] }
+        if entry is path[ -1 ] and isinstance( self.call, dict ) and 'dispatched' in self.call:
+          tmp[ 'dispatched' ] = self.call[ 'dispatched' ]
 
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( {} )
+        item_list.append( ( 0, 1, 'Function', tmp ) )
 
-      if op_data[ 'target' ][0] == Types.ARRAY_MAP_ITEM:
-        try:
-          self.state[ state_index ][1][ 'index' ]
-        except KeyError:
-          try:
-            self.state[ state_index + 1 ][2]
-          except IndexError:
-            self._evaluate( op_data[ 'target' ][1][ 'index' ], state_index + 1 )
+    result = []
+    last_perc_complete = 0
+    for item in reversed( item_list ):  # work backwards, as we go up, we scale the last perc_complete acording to the % of the curent scope
+      # before + -> scaling the last % complete .... after the +  -> the curent %
+      length = max( item[1], 1 )
+      perc_complete = ( 1.0 / length ) * last_perc_complete + ( 100.0 * item[0] ) / length
+      result.insert( 0, ( perc_complete, item[2], item[3] ) )
+      last_perc_complete = perc_complete
 
-          self.state[ state_index ][1][ 'index' ] = self.state[ state_index + 1 ][2]
-          self.state = self.state[ :( state_index + 1 ) ]
+    return result
 
-      try:
-        self.state[ state_index ][1][ 'value' ]
-      except KeyError:
-        try:
-          self.state[ state_index + 1 ][2]
-        except IndexError:
-          self._evaluate( op_data[ 'value' ], state_index + 1 )
+  def goto( self, jump_point ):
+    try:
+      pc = self.jump_point_map[ jump_point ]
+    except KeyError:
+      raise NotDefinedError( jump_point )
 
-        self.state[ state_index ][1][ 'value' ] = self.state[ state_index + 1 ][2]
-        self.state = self.state[ :( state_index + 1 ) ]
+    if self.tracer is not None:
+      self.tracer.goto( self, jump_point )
 
-      target = op_data[ 'target' ][1]
-      value = copy.deepcopy( self.state[ state_index ][1][ 'value' ] )
+    self._goto( pc )
 
-      if target[ 'module' ] is None:  # we don't evaluate the target, it can only be a variable
-        if op_data[ 'target' ][0] == Types.ARRAY_MAP_ITEM:
-          self.variable_map[ target[ 'name' ] ][ self.state[ state_index ][1][ 'index' ] ] = value
-        else:
-         self.variable_map[ target[ 'name' ] ] = value
+  def _goto( self, pc ):  # jump points are only in the top scope, so everything but the top scope is dropped
+    if not self.frame_list:
+      self.frame_list.append( _newFrame( self.program.code[0][1] ) )
 
-      else:
-        try:
-          module = self.value_map[ target[ 'module' ] ]
-        except KeyError:
-          raise NotDefinedError( target[ 'module' ], self.cur_line )
+    del self.frame_list[ 1: ]
+    self.stack.clear()
+    self.call = None
+    self.end_state = None
+    self.pc = pc
 
-        try:
-          setter = module[ target[ 'name' ] ][1]  # index 1 is the setter
-        except KeyError:
-          raise NotDefinedError( '{0}" of "{1}'.format( target[ 'module' ], target[ 'name' ] ), self.cur_line )
+  def run( self, ttl=1000 ):
+    logging.debug( 'runner: run start' )
+    if self.aborted:
+      return 'aborted'
 
-        if setter is None:
-          raise ParamaterError( 'target', '"{0}" of "{1}" is not settable'.format( target[ 'module' ], target[ 'name' ] ), self.cur_line )
+    if self.done:
+      return 'done'
 
-        try:
-          setter( value )
-        except Exception as e:
-          _debugDump( 'setter "{0}" in module "{1}" error on line "{2}"'.format( target[ 'name' ], target[ 'module' ], self.cur_line ), e, self.ast, self.state )
-          raise UnrecoverableError( 'setter "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( target[ 'name' ], target[ 'module' ], self.cur_line, str( e ), e.__class__.__name__) )
+    self.ttl = ttl
 
-    elif op_type == Types.INFIX:  # infix type operators
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( {} )
+    try:
+      self._execute()
 
-      try:
-        self.state[ state_index ][1][ 'left' ]
-      except KeyError:
-        try:
-          self.state[ state_index + 1 ][2]
-        except IndexError:
-          self._evaluate( op_data[ 'left' ], state_index + 1 )
+    except Interrupt as e:
+      return str( e )
 
-        self.state[ state_index ][1][ 'left' ] = self.state[ state_index + 1 ][2]
-        self.state = self.state[ :( state_index + 1 ) ]
+    except ( Pause, ExecutionError ) as e:
+      raise e
 
-      try:
-        self.state[ state_index ][1][ 'right' ]
-      except KeyError:
-        try:
-          self.state[ state_index + 1 ][2]
-        except IndexError:
-          self._evaluate( op_data[ 'right' ], state_index + 1 )
+    except ( UnrecoverableError, ParamaterError, NotDefinedError, ScriptError ) as e:
+      self.end_state = 'ABORTED'
+      raise e
 
-        self.state[ state_index ][1][ 'right' ] = self.state[ state_index + 1 ][2]
-        self.state = self.state[ :( state_index + 1 ) ]
+    except Exception as e:
+      self.end_state = 'ABORTED'  # TODO: watch some kind of DEBUG flag to enable/disable the stack trace
+      logging.exception( 'runner: Unahndled Exception' )
+      raise UnrecoverableError( 'Unahndled Exception ({0}): "{1}"\ntrace:\n{2}'.format( type( e ).__name__, str( e ), traceback.format_exc() ) )
 
-      left_val = self.state[ state_index ][1][ 'left' ]
-      right_val = self.state[ state_index ][1][ 'right' ]
+    logging.debug( 'runner: run finish' )
+    return ''
 
-      if op_data[ 'operator' ] in infix_string_operator_map:  # the string group
-        if not isinstance( left_val, str ):
-          left_val = str( left_val )
-        if not isinstance( right_val, str ):
-          right_val = str( right_val )
+  def _execute( self ):
+    program = self.program
+    code = program.code
+    cost_list = program.cost_list
+    end = len( code )
+    stack = self.stack
+    push = stack.append
+    pop = stack.pop
+    variable_map = self.variable_map
+    tracer = self.tracer
+    pc = self.pc
+    ttl = self.ttl
+
+    # resuming, the ttl is charged for all the nodes we are in, and the max time of the scopes checked
+    cost = program.resume_cost_list[ pc ]
+    if self.call == _CALL_RAISED and pc not in program.reenter_set:  # the function has its value, it is not entered again
+      cost -= 1
+
+    if ttl < cost:
+      raise Timeout( self.cur_line )
+    ttl -= cost
+    cost = 0
 
-        value = infix_string_operator_map[ op_data[ 'operator' ] ]( left_val, right_val )
+    if tracer is not None:
+      self._trace_path = ()
+      self._trace( pc, len( program.path_list[ pc ] ) if pc < end else 0 )
 
-      elif op_data[ 'operator' ] in infix_math_operator_map:  # the number group
-        if not isinstance( left_val, ( int, float, bool ) ):
-          raise ParamaterError( 'left of operator', 'must be numeric', self.cur_line )
-        if not isinstance( right_val, ( int, float, bool ) ):
-          raise ParamaterError( 'right of operator', 'must be numeric', self.cur_line )
+    for frame in self.frame_list:
+      _checkMaxTime( frame )
 
-        value = infix_math_operator_map[ op_data[ 'operator' ] ]( left_val, right_val )
+    try:
+      while True:
+        try:
+          while pc < end:
+            if cost:
+              if ttl < cost:
+                raise Timeout( self.cur_line )
+              ttl -= cost
+
+            if tracer is not None:
+              self._trace( pc, cost )
+
+            op = code[ pc ]
+            opcode = op[0]
+
+            if opcode == Op.CONSTANT:
+              push( op[1] )
+
+            elif opcode == Op.VARIABLE:
+              try:
+                push( variable_map[ op[1] ] )
+              except KeyError:
+                raise NotDefinedError( op[1], self.cur_line )
+
+            elif opcode == Op.LINE:
+              self.cur_line = op[1]
+
+            elif opcode == Op.STORE:
+              variable_map[ op[1] ] = copy.deepcopy( pop() )
+
+            elif opcode == Op.INFIX:
+              right_val = pop()
+              stack[ -1 ] = _infixValue( op[1], stack[ -1 ], right_val, self.cur_line )
+
+            elif opcode == Op.COPY_CONSTANT:
+              push( _copyConstant( op[1] ) )
+
+            elif opcode == Op.JUMP_FALSE:
+              if not pop():
+                pc = op[1]
+                cost = cost_list[ pc ]
+                continue
+
+            elif opcode == Op.JUMP:
+              pc = op[1]
+              cost = cost_list[ pc ]
+              continue
+
+            elif opcode == Op.POP:
+              pop()
+
+            elif opcode == Op.CALL:
+              call = self.call
+              if call == _CALL_RAISED:  # the Exception is allready raised, the value of the function is None
+                self.call = None
+                push( None )
+
+              else:
+                if call is None:
+                  name_list = op[3]
+                  if name_list:
+                    call = dict( zip( name_list, stack[ -len( name_list ): ] ) )
+                    del stack[ -len( name_list ): ]
+                  else:
+                    call = {}
+                  call = self.call = { 'paramaters': call }
+                  if tracer is not None:
+                    tracer.dispatch( self, op[1], op[2], call[ 'paramaters' ] )
+
+                self.pc = pc
+                value = self._call( op, call )
+                if isinstance( value, Exception ):
+                  self.call = _CALL_RAISED
+                  raise value
+
+                self.call = None
+                push( value )
+
+            elif opcode == Op.ARRAY:
+              if op[1]:
+                value = stack[ -op[1]: ]
+                del stack[ -op[1]: ]
+              else:
+                value = []
+              push( value )
+
+            elif opcode == Op.MAP:
+              if op[1]:
+                value = dict( zip( op[1], stack[ -len( op[1] ): ] ) )
+                del stack[ -len( op[1] ): ]
+              else:
+                value = {}
+              push( value )
+
+            elif opcode == Op.ITEM:
+              stack[ -1 ] = self._getItem( op[1], op[2], stack[ -1 ] )
+
+            elif opcode == Op.MODULE_VARIABLE:
+              push( self._getModuleValue( op[1], op[2] ) )
+
+            elif opcode == Op.STORE_ITEM:
+              value = copy.deepcopy( pop() )
+              variable_map[ op[1] ][ pop() ] = value
+
+            elif opcode == Op.STORE_MODULE:
+              self._setModuleValue( op[1], op[2], copy.deepcopy( pop() ) )
+
+            elif opcode == Op.ENTER_SCOPE:
+              frame = _newFrame( op[1] )
+              self.frame_list.append( frame )
+              pc += 1
+              cost = cost_list[ pc ]
+              _checkMaxTime( frame )
+              continue
+
+            elif opcode == Op.EXIT_SCOPE:
+              self.frame_list.pop()
+
+            elif opcode == Op.EXISTS:
+              stack[ -1 ] = True
+
+            elif opcode == Op.NOP:
+              pass
+
+            elif opcode == Op.GOTO:  # yank the stack to this jump point,  NOTE: jump points can only be in the global scope
+              if op[2] is None:
+                raise NotDefinedError( op[1], self.cur_line )
+
+              pc = op[2]
+
+              if tracer is not None:
+                tracer.goto( self, op[1] )
+
+              self._goto( pc )
+              cost = program.resume_cost_list[ pc ]
+              continue
+
+            elif opcode == Op.BAD_TARGET:
+              raise ParamaterError( 'target', 'Can only assign to variables', self.cur_line )
+
+            elif opcode == Op.ERROR:
+              raise ScriptError( op[1], self.cur_line )
+
+            else:
+              raise ScriptError( 'Unknown instruction "{0}"'.format( opcode ), self.cur_line )
+
+            pc += 1
+            cost = cost_list[ pc ]
 
-      elif op_data[ 'operator' ] in infix_logical_operator_map:  # the logical group
-        value = infix_logical_operator_map[ op_data[ 'operator' ] ]( left_val, right_val )
+          break
 
-      else:
-        raise NotDefinedError( op_data[ 'operator' ], self.cur_line )
+        except NotDefinedError:  # inside of exists() this is a False
+          for ( start, exists_pc, stack_depth ) in program.exists_list:
+            if start <= pc <= exists_pc:
+              break
+          else:
+            raise
 
-      self.state[ state_index ][1] = None
-      self.state[ state_index ].append( value )
+          del stack[ stack_depth: ]
+          push( False )
+          self.call = None
+          pc = exists_pc + 1
+          cost = cost_list[ pc ]
 
-    elif op_type == Types.FUNCTION:  # FUNCTION
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( { 'paramaters': {} } )
+    except Exception as e:
+      if tracer is not None:
+        tracer.interrupt( self, e )
 
-      if self.state[ state_index ][1] is None:  # TODO: is there a better way to handle this?
-        pass
-        # function allready executed and was an Exception last time, just let things pass by us
+      raise
 
-      else:
-        # get the paramaters
-        for key in op_data[ 'paramaters' ]:
-          try:
-            self.state[ state_index ][1][ 'paramaters' ][ key ]
-          except KeyError:
-            try:
-              self.state[ state_index + 1 ][2]
-            except IndexError:
-              self._evaluate( op_data[ 'paramaters' ][ key ], state_index + 1 )
+    finally:
+      self.pc = pc
+      self.ttl = ttl
 
-            self.state[ state_index ][1][ 'paramaters' ][ key ] = self.state[ state_index + 1 ][2]
-            self.state = self.state[ :( state_index + 1 ) ]
+    if tracer is not None:
+      self._trace( pc, 0 )
 
-        try:
-          handler = self.state[ state_index ][1][ 'handler' ]
-        except KeyError:  # handler dosen't exist, let's find it and set it up
-          if op_data[ 'module' ] is None:  # built in function
-            try:
-              handler = builtin_function_map[ op_data[ 'name' ] ]
-            except KeyError:
-              raise NotDefinedError( op_data[ 'name' ], self.cur_line )
-
-            module = '<builtin>'
-
-          else:  # external function
-            try:
-              module = self.function_map[ op_data[ 'module' ] ]
-            except KeyError:
-              raise NotDefinedError( op_data[ 'module' ], self.cur_line )
-
-            try:
-              handler = module[ op_data[ 'name' ] ]()
-            except KeyError:
-              raise NotDefinedError( '{0}" of "{1}'.format( op_data[ 'module' ], op_data[ 'name' ] ), self.cur_line )
-            except TypeError:  # hm.... this is bad
-              raise UnrecoverableError( 'Handler init function failed "{0}" on line {1}, possibly trying to call the function directly?'.format( op_data[ 'name' ], self.cur_line ) )
-
-            module = op_data[ 'module' ]
-
-          if isinstance( handler, tuple ):
-            module = handler[0]  # yes, overlay what ever was here
-            handler = handler[1]
-
-          if isinstance( handler, ExternalFunction ):
-            handler._runner = self
-            try:
-              handler.setup( self.state[ state_index ][1][ 'paramaters' ] )
-
-            except ( ParamaterError, Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
-              raise e
-
-            except Exception as e:
-              _debugDump( 'Handler "{0}" in module "{1}" error on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
-              raise UnrecoverableError( 'Handler "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
-
-            self.contractor_cookie = str( uuid.uuid4() )
-            self.state[ state_index ][1][ 'handler' ] = handler
-            self.state[ state_index ][1][ 'module' ] = module
-            self.state[ state_index ][1][ 'dispatched' ] = False
+    self.end_state = 'DONE'
+    self.cur_line = None
 
-          else:
-            try:
-              paramaters = self.state[ state_index ][1][ 'paramaters' ]
-            except TypeError as e:
-              raise ParamaterError( '<unknown>', e, self.cur_line )
-
-            try:
-              value = handler( **paramaters )
-            except ( ParamaterError, Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
-              raise e
-
-            except Exception as e:
-              _debugDump( 'Handler "{0}" in module "{1}" error on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
-              raise UnrecoverableError( 'Handler "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
-
-        if isinstance( handler, ExternalFunction ):  # else was allready run and set a value above
-          handler._runner = self
-          try:
-            if not handler.done:
-              handler.run()
-              raise Interrupt( handler.message )
+  def _trace( self, pc, cost ):
+    # tell the tracer about the nodes exited and entered getting to the instruction at pc, the last cost nodes the
+    # instruction is inside of are new, anything the tracer was told about past that is done
+    try:
+      path = self.program.path_list[ pc ]
+    except IndexError:  # past the end
+      path = ()
 
-            value = handler.value
+    keep = len( path ) - cost
+    for entry in reversed( self._trace_path[ keep: ] ):
+      self.tracer.exit( self, entry )
 
-          except ( Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
-            raise e
+    for entry in path[ keep: ]:
+      self.tracer.enter( self, entry )
 
-          except Exception as e:
-            module = op_data.get( 'module', '<builtin>' )
-            _debugDump( 'Handler "{0}" in module "{1}" error during done/message/run/value on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
-            raise UnrecoverableError( 'Handler "{0}" in module "{1}" error during done/message/run/value on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
+    self._trace_path = path
 
-        self.state[ state_index ][1] = None
-        if isinstance( value, Exception ):
-          self.state[ state_index ].append( None )
-          raise value
+  def _getModuleValue( self, module_name, name ):
+    try:
+      module = self.value_map[ module_name ]
+    except KeyError:
+      raise NotDefinedError( module_name, self.cur_line )
 
-        else:
-          self.state[ state_index ].append( value )
+    try:
+      getter = module[ name ][0]  # index 0 is the getter
+    except KeyError:
+      raise NotDefinedError( '{0}" of module "{1}'.format( name, module_name ), self.cur_line )
 
-    elif op_type == Types.WHILE:
+    if getter is None:
+      raise ParamaterError( 'target', '"{0}" of module "{1}" is not gettable'.format( name, module_name ), self.cur_line )
+
+    try:
+      return getter()
+    except Exception as e:
+      _debugDump( 'getter "{0}" in module "{1}" error during setup on line "{2}"'.format( name, module_name, self.cur_line ), e, self.ast, self.state )
+      raise UnrecoverableError( 'getter "{0}" in module "{1}" error during setup on line "{2}": "{3}"({4})'.format( name, module_name, self.cur_line, str( e ), e.__class__.__name__) )
+
+  def _getItem( self, module_name, name, index ):
+    if module_name is None:
       try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( { 'doing': 'condition' } )  # this is so we remember what it was we were doing when interrupted
+        value = self.variable_map[ name ]
+      except KeyError:
+        raise NotDefinedError( name, self.cur_line )
 
-      while True:
-        if self.state[ state_index ][1][ 'doing' ] == 'condition':
-          self._evaluate( op_data[ 'condition' ], state_index + 1 )
-          if not self.state[ state_index + 1 ][2]:
-            break
+    else:
+      try:
+        module = self.value_map[ module_name ]
+      except KeyError:
+        raise NotDefinedError( module_name, self.cur_line )
 
-          self.state[ state_index ][1][ 'doing' ] = 'expression'
-          self.state = self.state[ :( state_index + 1 ) ]
+      try:
+        getter = module[ name ][0]  # index 0 is the getter
+      except KeyError:
+        raise NotDefinedError( '{0}" of "{1}'.format( module_name, name ), self.cur_line )
 
-        if self.state[ state_index ][1][ 'doing' ] == 'expression':
-          self._evaluate( op_data[ 'expression' ], state_index + 1 )
-          self.state[ state_index ][1][ 'doing' ] = 'condition'
-          self.state = self.state[ :( state_index + 1 ) ]
+      if getter is None:
+        raise ParamaterError( 'target', '"{0}" of "{1}" is not gettable'.format( module_name, name ), self.cur_line )
 
-    elif op_type == Types.IFELSE:
       try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( { 'index': 0, 'doing': 'condition' } )
-
-      while self.state[ state_index ][1][ 'index' ] < len( op_data ):
-        if self.state[ state_index ][1][ 'doing' ] == 'condition':
-          if op_data[ self.state[ state_index ][1][ 'index' ] ][ 'condition' ] is None:
-            do_expression = True
-          else:
-            self._evaluate( op_data[ self.state[ state_index ][1][ 'index' ] ][ 'condition' ], state_index + 1 )
-            do_expression = self.state[ state_index + 1 ][2]
-            self.state = self.state[ :( state_index + 1 ) ]
+        value = getter()
+      except Exception as e:
+        _debugDump( 'getter "{0}" in module "{1}" error during setup on line "{2}"'.format( name, module_name, self.cur_line ), e, self.ast, self.state )
+        raise UnrecoverableError( 'getter "{0}" in module "{1}" error during setup on line "{2}": "{3}"({4})'.format( name, module_name, self.cur_line, str( e ), e.__class__.__name__) )
 
-          if not do_expression:
-            self.state[ state_index ][1][ 'index' ] += 1
-            continue
+    try:
+      return value[ index ]
+    except ( IndexError, KeyError ):
+      raise NotDefinedError( 'Index/Key does not exist', self.cur_line )
 
-          self.state[ state_index ][1][ 'doing' ] = 'expression'
+  def _setModuleValue( self, module_name, name, value ):
+    try:
+      module = self.value_map[ module_name ]
+    except KeyError:
+      raise NotDefinedError( module_name, self.cur_line )
 
-        if self.state[ state_index ][1][ 'doing' ] == 'expression':
-          self._evaluate( op_data[ self.state[ state_index ][1][ 'index' ] ][ 'expression' ], state_index + 1 )
-          break
+    try:
+      setter = module[ name ][1]  # index 1 is the setter
+    except KeyError:
+      raise NotDefinedError( '{0}" of "{1}'.format( module_name, name ), self.cur_line )
 
-        self.state = self.state[ :( state_index + 1 ) ]
+    if setter is None:
+      raise ParamaterError( 'target', '"{0}" of "{1}" is not settable'.format( module_name, name ), self.cur_line )
 
-    elif op_type == Types.EXISTS:
-      try:
-        self.state[ state_index ][1]
-      except IndexError:
-        self.state[ state_index ].append( None )
+    try:
+      setter( value )
+    except Exception as e:
+      _debugDump( 'setter "{0}" in module "{1}" error on line "{2}"'.format( name, module_name, self.cur_line ), e, self.ast, self.state )
+      raise UnrecoverableError( 'setter "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( name, module_name, self.cur_line, str( e ), e.__class__.__name__) )
 
-      try:
-        self._evaluate( op_data, state_index + 1 )
-        result = True
-      except NotDefinedError:
-        result = False
+  def _call( self, op, call ):
+    # call the function for the CALL instruction op, call is self.call, it starts as { 'paramaters': { .. } }
+    # and gets the handler, module and dispatched added when the handler is an ExternalFunction
+    # returns the value of the function, raises Interrupt if the ExternalFunction is not done
+    try:
+      handler = call[ 'handler' ]
+    except KeyError:  # handler dosen't exist, let's find it and set it up
+      if op[1] is None:  # built in function
+        handler = op[4]  # resolved when it was compiled
+        if handler is None:
+          try:
+            handler = builtin_function_map[ op[2] ]
+          except KeyError:
+            raise NotDefinedError( op[2], self.cur_line )
+
+        module = '<builtin>'
+
+      else:  # external function
+        try:
+          module = self.function_map[ op[1] ]
+        except KeyError:
+          raise NotDefinedError( op[1], self.cur_line )
 
+        try:
+          handler = module[ op[2] ]()
+        except KeyError:
+          raise NotDefinedError( '{0}" of "{1}'.format( op[1], op[2] ), self.cur_line )
+        except TypeError:  # hm.... this is bad
+          raise UnrecoverableError( 'Handler init function failed "{0}" on line {1}, possibly trying to call the function directly?'.format( op[2], self.cur_line ) )
+
+        module = op[1]
+
+      if isinstance( handler, tuple ):
+        module = handler[0]  # yes, overlay what ever was here
+        handler = handler[1]
+
+      if not isinstance( handler, ExternalFunction ):
+        try:
+          return handler( **call[ 'paramaters' ] )
+        except ( ParamaterError, Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
+          raise e
+
+        except Exception as e:
+          _debugDump( 'Handler "{0}" in module "{1}" error on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
+          raise UnrecoverableError( 'Handler "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
+
+      handler._runner = self
       try:
-        self.state[ state_index ][2] = result
-      except IndexError:
-        self.state[ state_index ].append( result )
+        handler.setup( call[ 'paramaters' ] )
 
-    elif op_type == Types.JUMP_POINT:  # just a NOP execution wise
-      pass
+      except ( ParamaterError, Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
+        raise e
 
-    elif op_type == Types.GOTO:
-      raise Goto( op_data, self.cur_line )
+      except Exception as e:
+        _debugDump( 'Handler "{0}" in module "{1}" error on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
+        raise UnrecoverableError( 'Handler "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
 
-    else:
-      raise ScriptError( 'Unimplemented "{0}"'.format( op_type ), self.cur_line )
+      self.contractor_cookie = str( uuid.uuid4() )
+      call[ 'handler' ] = handler
+      call[ 'module' ] = module
+      call[ 'dispatched' ] = False
 
-    # if the op_type we just ran does not return a value, make sure it is cleaned up
-    if op_type not in ( Types.CONSTANT, Types.VARIABLE, Types.ARRAY, Types.MAP, Types.ARRAY_MAP_ITEM, Types.INFIX, Types.FUNCTION, Types.EXISTS ):  # all the things that "return" a value
-      self.state = self.state[ :state_index ]  # remove this an evertying after from the state
-    else:
-      self.state = self.state[ :state_index + 1 ]  # remove everything after this one, save this one's return value on the stack
+    handler._runner = self
+    try:
+      if not handler.done:
+        handler.run()
+        raise Interrupt( handler.message )
 
-    logging.debug( 'runner: _evaluate level: "{0}" final state: {1}'.format( state_index, self.state ) )
-    if self.state == []:
-      self.state = 'DONE'
-      self.cur_line = None
+      return handler.value
 
-  def toSubcontractor( self, subcontractor_module_list ):
-    # return None if we done, or not started
-    if self.done or self.aborted or self.state == []:
-      return None
+    except ( Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
+      raise e
 
-    operation = self.state[ -1 ]
+    except Exception as e:
+      _debugDump( 'Handler "{0}" in module "{1}" error during done/message/run/value on line "{2}"'.format( handler.__class__.__name__, op[1], self.cur_line ), e, self.ast, self.state )
+      raise UnrecoverableError( 'Handler "{0}" in module "{1}" error during done/message/run/value on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, op[1], self.cur_line, str( e ), e.__class__.__name__) )
 
-    if operation[0] != Types.FUNCTION and operation[0]:  # not a function
+  def _externalCall( self ):  # the call of the ExternalFunction we are waiting on, None if not waiting on one
+    if not self._running or not isinstance( self.call, dict ) or 'handler' not in self.call:
       return None
 
-    if operation[1] is None:  # the operation isn't setup yet
+    return self.call
+
+  def toSubcontractor( self, subcontractor_module_list ):
+    # return None if we done, or not started
+    call = self._externalCall()
+    if call is None:
       return None
 
-    try:
-      if operation[1][ 'module' ] not in subcontractor_module_list:
-        return None
-    except KeyError:
-      return None  # function is not external
+    if subcontractor_module_list is not None and call[ 'module' ] not in subcontractor_module_list:  # None is any module
+      return None
 
-    if operation[1][ 'dispatched' ] is True:  # allready dispatchced, don't send anything else until something comes back
+    if call[ 'dispatched' ] is True:  # allready dispatchced, don't send anything else until something comes back
       return None
 
-    handler = operation[1][ 'handler' ]
+    handler = call[ 'handler' ]
     handler._runner = self
     try:
       paramaters = handler.toSubcontractor()
     except Exception as e:
-      _debugDump( 'Handler "{0}" in module "{1}" error during toSubcontractor on line "{2}"'.format( handler.__class__.__name__, operation[1][ 'module' ], self.cur_line ), e, self.ast, self.state )
+      _debugDump( 'Handler "{0}" in module "{1}" error during toSubcontractor on line "{2}"'.format( handler.__class__.__name__, call[ 'module' ], self.cur_line ), e, self.ast, self.state )
       return None  # TODO: log something?
 
     if paramaters is None:
       return None
 
-    operation[1][ 'dispatched' ] = True
+    call[ 'dispatched' ] = True
 
-    return { 'module': operation[1][ 'module' ], 'function': paramaters[0], 'cookie': self.contractor_cookie, 'paramaters': paramaters[1] }
+    return { 'module': call[ 'module' ], 'function': paramaters[0], 'cookie': self.contractor_cookie, 'paramaters': paramaters[1] }
 
   def fromSubcontractor( self, cookie, data ):
-    if self.done or self.aborted or self.state == []:
+    if not self._running:
       return ( 'Script not Running', None )
 
     if cookie != self.contractor_cookie:
       return ( 'Bad Cookie', None )
 
-    operation = self.state[ -1 ]
-
-    if operation[0] != Types.FUNCTION:
+    call = self._externalCall()
+    if call is None:
       return ( 'Not At a Function', None )
 
-    if operation[1][ 'dispatched' ] is False:
+    if call[ 'dispatched' ] is False:
       return ( 'Not Expecting Anything', None )
 
-    handler = operation[1][ 'handler' ]
+    handler = call[ 'handler' ]
     handler._runner = self
     try:
       handler.fromSubcontractor( data )
     except Exception as e:
-      _debugDump( 'Handler "{0}" in module "{1}" error during fromSubcontractor on line "{2}"'.format( handler.__class__.__name__, operation[1][ 'module' ], self.cur_line ), e, self.ast, self.state )
+      _debugDump( 'Handler "{0}" in module "{1}" error during fromSubcontractor on line "{2}"'.format( handler.__class__.__name__, call[ 'module' ], self.cur_line ), e, self.ast, self.state )
       return ( 'Error', None )  # TODO: log something?
 
-    operation[1][ 'dispatched' ] = False
+    call[ 'dispatched' ] = False
 
     return ( 'Accepted', handler.message )
 
   def clearDispatched( self ):
-    if self.done or self.aborted or self.state == []:
-      return
-
-    operation = self.state[ -1 ]
-
-    if operation[0] != Types.FUNCTION:
-      return
-
-    if not isinstance( operation[1], dict ) or 'dispatched' not in operation[1]:
+    call = self._externalCall()
+    if call is None:
       return  # or?: raise Exception( 'Function is not dispatched or has allready returned its value' ), we don't say anything if it's not a function
 
-    operation[1][ 'dispatched' ] = False
+    call[ 'dispatched' ] = False
 
     return
 
   def rollback( self ):  # TODO: make to/from subcontractor and  rollback consistant in how they handle errors, this will take some work with the things calling them
-    if self.done or self.aborted or self.state == []:
+    if not self._running:
       return 'Script not Running'
 
-    operation = self.state[ -1 ]
-
-    if operation[0] != Types.FUNCTION:
+    call = self._externalCall()
+    if call is None:
       return 'Not At a Function'
 
-    handler = operation[1][ 'handler' ]
+    handler = call[ 'handler' ]
     try:
       handler.rollback()
 
@@ -1164,30 +1218,34 @@ class Runner( object ):
       return 'Rollback not possible'
 
     except Exception as e:
-      _debugDump( 'Handler "{0}" in module "{1}" error starting rollback on line "{2}"'.format( handler.__class__.__name__, operation[1][ 'module' ], self.cur_line ), e, self.ast, self.state )
+      _debugDump( 'Handler "{0}" in module "{1}" error starting rollback on line "{2}"'.format( handler.__class__.__name__, call[ 'module' ], self.cur_line ), e, self.ast, self.state )
       return 'Exception while trying to rollback'  # TODO: log?
 
     self.contractor_cookie = str( uuid.uuid4() )  # revoke any outstanding tasks, TODO: do we also rotate cookie on reset?  if not, should we rotate keys even if rollback is  not possible
-    operation[1][ 'dispatched' ] = False
+    call[ 'dispatched' ] = False
 
     return 'Done'
 
+  def _registerSource( self, name, source ):  # the values/functions are loaded when the module name is first used
+    self._source_map[ name ] = source
+    self.function_map.forget( name )
+    self.value_map.forget( name )
+
   def registerModule( self, name ):
     module = import_module( name )
-
-    self.function_map[ module.TSCRIPT_NAME ] = module.TSCRIPT_FUNCTIONS
-    self.value_map[ module.TSCRIPT_NAME ] = module.TSCRIPT_VALUES
+    self._registerSource( module.TSCRIPT_NAME, module )
 
     self.module_list.append( name )
 
   def registerObject( self, obj ):  # all objects must be serializable, if not use the module, thoes are not serilized into the stored pickle, just the names so they can be auto-registered when unpickled
-    name = obj.TSCRIPT_NAME
-
-    self.function_map[ name ] = obj.getFunctions()
-    self.value_map[ name ] = obj.getValues()
+    self._registerSource( obj.TSCRIPT_NAME, obj )
 
     self.object_list.append( obj )
 
+  def unknownReferences( self ):
+    # list of ( line, 'module.name' ) the script uses that are not in the registered modules/objects
+    return unknownReferences( self.ast, self.function_map, self.value_map )
+
   def getValue( self, module, name ):
     try:
       module = self.value_map[ module ]
@@ -1204,17 +1262,154 @@ class Runner( object ):
 
     return getter()
 
+  def _loadState( self, state ):
+    # the state from a Runner from before scripts were compiled, the list of [ <type>, work values, [ return value ] ]
+    # for each level of the AST down to where execution stopped, is turned into the pc, stack, frames and call
+    if state in ( 'DONE', 'ABORTED' ):
+      self.end_state = state
+      return
+
+    node_map = self.program.node_map
+    node = self.ast
+    key = ()
+    for entry in state:
+      node_type = node[0]
+      if entry[0] != node_type:
+        raise ValueError( 'Saved state type "{0}" does not match the script type "{1}"'.format( entry[0], node_type ) )
+
+      if node_type == Types.SCOPE and len( entry ) > 1:
+        self.frame_list.append( list( entry[ 2: ] ) or [ datetime.datetime.now( datetime.UTC ) ] )  # a goto did not set the start time
+        child_key = entry[1]
+        if child_key >= len( node[1][ '_children' ] ):
+          self.pc = node_map[ key ][1] - 1  # the EXIT_SCOPE
+          return
+
+        child = node[1][ '_children' ][ child_key ]
+
+      elif node_type == Types.LINE:
+        self.cur_line = node[2]  # the saved line could be from before a Timeout
+        child_key = 0
+        child = node[1]
+
+      elif node_type == Types.WHILE and len( entry ) > 1:
+        child_key = entry[1][ 'doing' ]
+        child = node[1][ child_key ]
+
+      elif node_type == Types.IFELSE and len( entry ) > 1:
+        child_key = ( entry[1][ 'index' ], entry[1][ 'doing' ] )
+        child = node[1][ child_key[0] ][ child_key[1] ]
+
+      elif len( entry ) > 2:  # the value is done, waiting to be used
+        if node_type == Types.FUNCTION:  # the function returned an Exception
+          self.call = _CALL_RAISED
+          self.pc = node_map[ key ][1] - 1  # the CALL
+        else:
+          self.stack.append( entry[2] )
+          self.pc = node_map[ key ][1]
+
+        return
+
+      elif node_type == Types.EXISTS and len( entry ) > 1:
+        child_key = 0
+        child = node[1]
+
+      elif len( entry ) < 2 or entry[1] is None:  # has not started
+        self.pc = node_map[ key ][0]
+        return
+
+      elif node_type == Types.INFIX:
+        if 'left' in entry[1]:
+          self.stack.append( entry[1][ 'left' ] )
+          child_key = 'right'
+        else:
+          child_key = 'left'
+
+        child = node[1][ child_key ]
+
+      elif node_type == Types.ASSIGNMENT:
+        target = node[1][ 'target' ]
+        if 'index' in entry[1]:
+          self.stack.append( entry[1][ 'index' ] )
+          child_key = 'value'
+        elif target[0] == Types.ARRAY_MAP_ITEM:
+          child_key = 'index'
+        else:
+          child_key = 'value'
+
+        child = target[1][ 'index' ] if child_key == 'index' else node[1][ 'value' ]
+
+      elif node_type == Types.ARRAY:
+        self.stack += entry[1]
+        child_key = len( entry[1] )
+        child = node[1][ child_key ]
+
+      elif node_type == Types.MAP:
+        for child_key in node[1]:
+          if child_key not in entry[1]:
+            break
+
+          self.stack.append( entry[1][ child_key ] )
+
+        child = node[1][ child_key ]
+
+      elif node_type == Types.ARRAY_MAP_ITEM:
+        child_key = 'index'
+        child = node[1][ 'index' ]
+
+      elif node_type == Types.FUNCTION:
+        paramaters = entry[1][ 'paramaters' ]
+        if 'handler' in entry[1] or len( paramaters ) == len( node[1][ 'paramaters' ] ):
+          self.call = entry[1]
+          self.pc = node_map[ key ][1] - 1  # the CALL
+          return
+
+        for child_key in node[1][ 'paramaters' ]:
+          if child_key not in paramaters:
+            break
+
+          self.stack.append( paramaters[ child_key ] )
+
+        child = node[1][ 'paramaters' ][ child_key ]
+
+      else:
+        self.pc = node_map[ key ][0]
+        return
+
+      node = child
+      key = key + ( child_key, )
+
+    self.pc = node_map[ key ][0]  # the last level had not started on this one
+
   def __reduce__( self ):
-    return ( self.__class__, ( self.ast, ), self.__getstate__() )
+    if self.script_hash is not None and isPersisted():
+      return ( _runnerFromScriptHash, ( self.__class__, self.script_hash, self.optimize ), self.__getstate__() )
+
+    return ( self.__class__, ( self.ast, self.script_hash, self.optimize ), self.__getstate__() )  # the ast has to go with it, the hash still gets the compiled program from the cache
 
   def __getstate__( self ):
-    return { 'module_list': self.module_list, 'object_list': self.object_list, 'state': self.state, 'variable_map': self.variable_map, 'cur_line': self.cur_line, 'contractor_cookie': self.contractor_cookie }
+    # the pc is only good for the program it came from, if the compiler changes the path
+    # based state is used instead, it can not hold part done expressions, so only when the stack is empty
+    path = self.state if not self.stack else None
+    return { 'module_list': self.module_list, 'object_list': self.object_list, 'program': self.program.fingerprint, 'pc': self.pc, 'stack': self.stack, 'frame_list': self.frame_list, 'call': self.call, 'end_state': self.end_state, 'path': path, 'variable_map': self.variable_map, 'cur_line': self.cur_line, 'contractor_cookie': self.contractor_cookie }
 
   def __setstate__( self, state ):
-    self.state = state[ 'state' ]
     self.variable_map = state[ 'variable_map' ]
     self.cur_line = state[ 'cur_line' ]
     self.contractor_cookie = state[ 'contractor_cookie' ]
+    if 'state' in state:  # pickled before scripts were compiled
+      self._loadState( state[ 'state' ] )
+    elif state.get( 'program', self.program.fingerprint ) != self.program.fingerprint:
+      if state.get( 'path' ) is None:
+        raise UnrecoverableError( 'Saved state is from a different compiled program and can not be resumed' )
+
+      self._loadState( state[ 'path' ] )
+    else:
+      self.pc = state[ 'pc' ]
+      self.stack = state[ 'stack' ]
+      self.frame_list = state[ 'frame_list' ]
+      self.call = state[ 'call' ]
+      self.end_state = state[ 'end_state' ]
+
     for module in state[ 'module_list' ]:
       self.registerModule( module )
 
@@ -1,9 +1,12 @@
 import pytest
 import pickle
 import time
+import datetime
 
+from contractor.tscript import cache
 from contractor.tscript.parser import parse
-from contractor.tscript.runner import Runner, ExecutionError, UnrecoverableError, ParamaterError, NotDefinedError, Timeout, Pause
+from contractor.tscript.compiler import Op
+from contractor.tscript.runner import Runner, builtin_function_map, StructuredTracer, ExecutionError, UnrecoverableError, ParamaterError, NotDefinedError, Timeout, Pause
 
 # TODO: test the assignment deepcopy, ie: a = {}, b = a  make sure changes to b are not reflected in a
 
@@ -407,6 +410,53 @@ def test_object_values():
   assert runner3.object_list[0].dataRO == 'read me'
 
 
+class testCountingObject( object ):
+  TSCRIPT_NAME = 'counting'
+  value_calls = 0
+  function_calls = 0
+
+  def getValues( self ):
+    testCountingObject.value_calls += 1
+    return { 'value': ( lambda: 42, None ) }
+
+  def getFunctions( self ):
+    testCountingObject.function_calls += 1
+    return {}
+
+  def __reduce__( self ):
+    return ( self.__class__, () )
+
+
+def test_lazy_registration():
+  testCountingObject.value_calls = 0
+  testCountingObject.function_calls = 0
+
+  runner = Runner( parse( 'aa = 1\nbb = counting.value\ncc = test_obj.dataRO' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  runner.registerObject( testCountingObject() )
+  runner.registerObject( testExternalObject( 'mod me', 'write me', 'read me' ) )
+  assert testCountingObject.value_calls == 0
+  assert testCountingObject.function_calls == 0
+  assert 'counting' in runner.value_map
+  assert 'bogus' not in runner.value_map
+  assert testCountingObject.value_calls == 0
+
+  runner = pickle.loads( pickle.dumps( runner ) )
+  assert testCountingObject.value_calls == 0
+  assert runner.run() == ''
+  assert runner.done
+  assert runner.variable_map == { 'aa': 1, 'bb': 42, 'cc': 'read me' }
+  assert testCountingObject.value_calls == 1
+  assert testCountingObject.function_calls == 0
+
+  assert sorted( runner.value_map ) == [ 'counting', 'test_obj', 'testing' ]
+  assert testCountingObject.value_calls == 1
+
+  runner.registerObject( testCountingObject() )  # re-registering replaces the allready loaded values
+  assert runner.value_map[ 'counting' ][ 'value' ][0]() == 42
+  assert testCountingObject.value_calls == 2
+
+
 def test_infix():
   runner = Runner( parse( 'myvar = ( 1 + 2 )' ) )
   assert runner.variable_map == {}
@@ -633,6 +683,8 @@ def test_pause_error():
 
 def test_builtin_functions():
   runner = Runner( parse( 'ary = [ 1,2,3,4 ]\nvar = len( array=ary )' ) )
+  for optimize in ( False, True ):  # resolved when compiled
+    assert [ op[4] for op in Runner( runner.ast, optimize=optimize ).program.code if op[0] == Op.CALL ] == [ builtin_function_map[ 'len' ] ]
   assert runner.variable_map == {}
   runner.run()
   assert runner.done
@@ -912,6 +964,20 @@ def test_external_remote_functions():
 # TODO: test function rollback
 
 
+def test_external_remote_functions_any_module():  # None is any module, for the scheduler
+  runner = Runner( parse( 'testing.remote()' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  assert runner.toSubcontractor( None ) is None
+  assert runner.run() == 'Not Initilized'
+  assert runner.toSubcontractor( [ 'sdf' ] ) is None
+  assert runner.toSubcontractor( None ) == { 'cookie': runner.contractor_cookie, 'module': 'testing', 'function': 'remote_func', 'paramaters': 'the count "1"' }
+  assert runner.toSubcontractor( None ) is None  # allready dispatched
+  assert runner.fromSubcontractor( runner.contractor_cookie, True ) == ( 'Accepted', 'Current State "True"' )
+  assert runner.run() == ''
+  assert runner.done
+  assert runner.toSubcontractor( None ) is None
+
+
 def test_serilizer():
   runner = Runner( parse( 'testing.count( stop_at=2, count_by=1 )' ) )
   runner.registerModule( 'contractor.tscript.runner_plugins_test' )
@@ -952,6 +1018,157 @@ def test_serilizer():
   assert runner2.done
 
 
+class testScriptStore():
+  def __init__( self ):
+    self.ast_map = {}
+
+  def loadAST( self, script_hash ):
+    return self.ast_map.get( script_hash, None )
+
+  def saveAST( self, script_hash, script, ast ):
+    self.ast_map[ script_hash ] = ast
+
+
+def test_serilizer_script_hash():
+  old_store = cache._store
+  store = testScriptStore()
+  cache.registerStore( store )
+  cache.clearCache()
+  try:
+    script = 'testing.count( stop_at=2, count_by=1 )\n' + '\n'.join( [ 'var{0} = ( {0} + 1 )'.format( i ) for i in range( 0, 100 ) ] )
+    script_hash = cache.scriptHash( script )
+
+    runner = Runner( cache.getAST( script, script_hash ), script_hash )
+    runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+    runner.run()
+    assert not runner.done
+
+    buff = pickle.dumps( runner )
+    assert len( buff ) < len( pickle.dumps( Runner( runner.ast ) ) )  # the ast is not in the pickle
+
+    cache.clearCache()  # make sure it comes from the store
+    runner2 = pickle.loads( buff )
+    assert runner2.ast == runner.ast
+    assert runner2.script_hash == script_hash
+    runner2.run()
+    assert not runner2.done
+    runner2.run()
+    assert runner2.done
+    assert runner2.variable_map[ 'var99' ] == 100
+
+    runner2 = pickle.loads( pickle.dumps( runner2 ) )
+    assert runner2.done
+
+    store.ast_map = {}
+    cache.clearCache()
+    with pytest.raises( KeyError ):
+      pickle.loads( buff )
+
+    cache.registerStore( None )  # with out a store, the ast has to go with the runner
+    runner = pickle.loads( pickle.dumps( Runner( cache.getAST( script, script_hash ), script_hash ) ) )
+    cache.clearCache()
+    runner = pickle.loads( pickle.dumps( runner ) )
+    assert runner.ast == parse( script )
+
+  finally:
+    cache.registerStore( old_store )
+    cache.clearCache()
+
+
+def test_serilizer_no_store():  # the ast goes with the runner, but the script_hash is kept, so the compiled program is reused
+  old_store = cache._store
+  cache.registerStore( None )
+  cache.clearCache()
+  try:
+    script = 'testing.count( stop_at=2, count_by=1 )\nvar = ( 1 + 2 )'
+    script_hash = cache.scriptHash( script )
+    for optimize in ( False, True ):
+      runner = Runner( cache.getAST( script, script_hash ), script_hash, optimize )
+      runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+      runner.run()
+
+      runner2 = pickle.loads( pickle.dumps( runner ) )
+      assert runner2.script_hash == script_hash
+      assert runner2.optimize == optimize
+      assert runner2.program is runner.program
+      runner2.run()
+      runner2.run()
+      assert runner2.done
+      assert runner2.variable_map == { 'var': 3 }
+
+  finally:
+    cache.registerStore( old_store )
+    cache.clearCache()
+
+
+def test_serilizer_program_changed():  # the program was compiled differently when the runner was saved, the pc does not mean the same thing
+  script = 'var = 1\ntesting.count( stop_at=2, count_by=1 )\nvar = ( var + 1 )'
+  runner = Runner( parse( script ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  runner.run()
+  assert not runner.done
+
+  state = runner.__getstate__()
+  assert state[ 'program' ] == runner.program.fingerprint
+  state[ 'program' ] = 'something else'
+  state[ 'pc' ] = 0
+  runner2 = Runner( parse( script ) )
+  runner2.__setstate__( state )
+  assert runner2.state == runner.state
+  runner2.run()
+  assert not runner2.done
+  runner2.run()
+  assert runner2.done
+  assert runner2.variable_map == { 'var': 2 }
+
+  state[ 'path' ] = None  # stopped with values on the stack, there is no path to go by
+  runner2 = Runner( parse( script ) )
+  with pytest.raises( UnrecoverableError ):
+    runner2.__setstate__( state )
+
+  assert Runner( parse( script ) ).program.fingerprint == runner.program.fingerprint
+
+
+def test_serilizer_legacy():  # pickled before the scripts were compiled, the state was a list of where the runner was in the AST
+  from contractor.tscript.runner_plugins_test import Count
+
+  start = datetime.datetime.now( datetime.UTC )
+  runner = Runner( parse( 'cnt = 1\nwhile True do cnt = ( cnt + 1 )' ) )
+  runner.__setstate__( { 'module_list': [], 'object_list': [], 'state': [ [ 'S', 1, start ], [ 'L' ], [ 'W', { 'doing': 'expression' } ], [ 'A', {} ], [ 'X', { 'left': 3 } ], [ 'C' ] ], 'variable_map': { 'cnt': 3 }, 'cur_line': 2, 'contractor_cookie': None } )
+  assert runner.status[0][0] == 50.0
+  assert runner.state == [ [ 'S', 1, start ], [ 'L' ], [ 'W', { 'doing': 'expression' } ], [ 'A' ], [ 'X' ], [ 'C' ] ]
+  with pytest.raises( Timeout ):
+    runner.run( 20 )
+  assert runner.variable_map == { 'cnt': 6 }
+
+  handler = Count()
+  handler.setup( { 'stop_at': 2, 'count_by': 1 } )
+  handler.run()
+  runner = Runner( parse( 'testing.count( stop_at=2, count_by=1 )\nvar = 5' ) )
+  runner.__setstate__( { 'module_list': [ 'contractor.tscript.runner_plugins_test' ], 'object_list': [], 'state': [ [ 'S', 0, start ], [ 'L' ], [ 'F', { 'paramaters': { 'stop_at': 2, 'count_by': 1 }, 'handler': handler, 'module': 'testing', 'dispatched': False } ] ], 'variable_map': {}, 'cur_line': 1, 'contractor_cookie': 'cookie' } )
+  assert runner.status[1][2] == { 'module': 'testing', 'name': 'count', 'dispatched': False }
+  assert runner.run() == 'at 2 of 2'
+  assert not runner.done
+  assert runner.run() == ''
+  assert runner.done
+  assert runner.variable_map == { 'var': 5 }
+
+  runner = Runner( parse( 'var = pause( msg="stop" )\nvar2 = var' ) )
+  runner.__setstate__( { 'module_list': [], 'object_list': [], 'state': [ [ 'S', 0, start ], [ 'L' ], [ 'A', {} ], [ 'F', None, None ] ], 'variable_map': {}, 'cur_line': 1, 'contractor_cookie': None } )
+  runner.run()
+  assert runner.done
+  assert runner.variable_map == { 'var': None, 'var2': None }
+
+  runner = Runner( parse( 'var = 1' ) )
+  runner.__setstate__( { 'module_list': [], 'object_list': [], 'state': 'DONE', 'variable_map': { 'var': 1 }, 'cur_line': None, 'contractor_cookie': None } )
+  assert runner.done
+  assert runner.run() == 'done'
+
+  runner = Runner( parse( 'var = 1' ) )
+  with pytest.raises( ValueError ):
+    runner.__setstate__( { 'module_list': [], 'object_list': [], 'state': [ [ 'S', 0, start ], [ 'W', { 'doing': 'condition' } ] ], 'variable_map': {}, 'cur_line': 1, 'contractor_cookie': None } )
+
+
 def test_while():
   # first we will test the ttl
   runner = Runner( parse( 'while True do 1' ) )
@@ -1440,6 +1657,50 @@ def test_status():
   assert runner.done
 
 
+def test_tracer():
+  runner = Runner( parse( 'var = ( 1 + 2 )\n:here\nif ( var < 4 ) then begin()\nvar = 4\ngoto here\nend\npause( msg="stop" )' ) )
+  assert runner.tracer is None
+  tracer = StructuredTracer( log=False )
+  runner.tracer = tracer
+  with pytest.raises( Pause ):
+    runner.run()
+
+  event_list = list( tracer.event_list )
+  assert event_list[ :9 ] == [
+                               { 'event': 'enter', 'type': 'S', 'index': 0, 'line': 0 },
+                               { 'event': 'enter', 'type': 'L', 'line': 1 },
+                               { 'event': 'enter', 'type': 'A', 'line': 1 },
+                               { 'event': 'enter', 'type': 'X', 'line': 1 },
+                               { 'event': 'enter', 'type': 'C', 'line': 1 },
+                               { 'event': 'exit', 'type': 'C', 'line': 1 },
+                               { 'event': 'enter', 'type': 'C', 'line': 1 },
+                               { 'event': 'exit', 'type': 'C', 'line': 1 },
+                               { 'event': 'exit', 'type': 'X', 'line': 1 }
+                             ]
+  assert [ i for i in event_list if i[ 'event' ] not in ( 'enter', 'exit' ) ] == [
+                                                                                   { 'event': 'goto', 'name': 'here', 'line': 5 },
+                                                                                   { 'event': 'dispatch', 'module': None, 'name': 'pause', 'paramaters': { 'msg': 'stop' }, 'line': 7 },
+                                                                                   { 'event': 'interrupt', 'exception': 'Pause', 'message': 'stop', 'line': 7 }
+                                                                                 ]
+  assert len( [ i for i in event_list if i[ 'event' ] == 'enter' and i[ 'type' ] == 'J' ] ) == 2  # once from the top, once from the goto
+  assert len( [ i for i in event_list if i[ 'event' ] == 'enter' ] ) == 1000 - runner.ttl  # the nodes entered are what the ttl is charged for
+
+  tracer.event_list.clear()
+  runner.run()
+  assert runner.done
+  assert [ ( i[ 'event' ], i[ 'type' ] ) for i in tracer.event_list ] == [ ( 'enter', 'S' ), ( 'enter', 'L' ), ( 'enter', 'F' ), ( 'exit', 'F' ), ( 'exit', 'L' ), ( 'exit', 'S' ) ]
+
+  tracer = StructuredTracer( max_events=2, log=False )
+  runner = Runner( parse( 'var = exists( nothing )\nvar2 = 2' ) )
+  runner.tracer = tracer
+  runner.run()
+  assert list( tracer.event_list ) == [ { 'event': 'exit', 'type': 'L', 'line': 2 }, { 'event': 'exit', 'type': 'S', 'index': 1, 'line': 2 } ]
+  assert runner.variable_map == { 'var': False, 'var2': 2 }
+
+  runner = pickle.loads( pickle.dumps( runner ) )
+  assert runner.tracer is None
+
+
 def test_exists():
   runner = Runner( parse( 'aa = 1' ) )
   runner.run()
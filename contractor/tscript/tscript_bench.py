@@ -0,0 +1,167 @@
+import sys
+import pickle
+import argparse
+
+from contractor.lib.benchmark import bench, report, save, load, compare
+from contractor.tscript import parser
+from contractor.tscript.parser import parse
+from contractor.tscript.descent_parser import DescentParser
+from contractor.tscript.compiler import compileAST
+from contractor.tscript.cache import scriptHash, getAST, clearCache
+from contractor.tscript.runner import Runner
+from contractor.tscript.parser_bench import makeScript
+
+# the job hot path, parsing and compiling when the job is created, then
+# run(), status and the pickle round trip every time the job is processed
+#
+# save a run with --output, then check later ones against it with --baseline,
+# it exits 1 if anything is more than --threshold times slower
+
+LINE_COUNT_LIST = [ 10, 100, 1000, 10000 ]
+LOOP_COUNT_LIST = [ 1000, 10000 ]
+DEPTH_LIST = [ 10, 50 ]
+VARIABLE_COUNT_LIST = [ 100, 10000 ]
+
+
+def loopScript( loop_count ):
+  return """cnt = 0
+total = 0
+while ( cnt < {0} ) do
+begin()
+  if ( ( cnt % 2 ) == 0 ) then
+    total = ( total + cnt )
+  else
+    total = ( total - 1 )
+  item_list = [ cnt, total ]
+  cnt = ( cnt + 1 )
+end
+""".format( loop_count )
+
+
+def nestedScript( depth, middle='' ):
+  # begin/end and if blocks nested depth deep, with middle at the bottom
+  line_list = []
+  for i in range( 0, depth ):
+    if i % 2:
+      line_list.append( 'if ( level{0} == {0} ) then begin( description="level {0}" )'.format( i - 1 ) )
+    else:
+      line_list.append( 'begin( description="level {0}" )'.format( i ) )
+      line_list.append( 'level{0} = {0}'.format( i ) )
+
+  line_list.append( middle )
+  line_list += [ 'end' ] * depth
+
+  return '\n'.join( line_list )
+
+
+def variableScript( variable_count ):
+  # lots of variables, some of them lists and maps, then waits
+  line_list = []
+  for i in range( 0, variable_count ):
+    kind = i % 4
+    if kind == 0:
+      line_list.append( 'var{0} = {0}'.format( i ) )
+    elif kind == 1:
+      line_list.append( 'var{0} = "value number {0}"'.format( i ) )
+    elif kind == 2:
+      line_list.append( 'var{0} = [ {0}, "item", 1.5, True ]'.format( i ) )
+    else:
+      line_list.append( 'var{0} = {{ name="host{0}", port={0}, tags=[ "aa", "bb" ] }}'.format( i ) )
+
+  line_list.append( 'delay( seconds=300 )' )
+  line_list.append( 'done = True' )
+
+  return '\n'.join( line_list )
+
+
+def _runner( script ):  # the program is compiled once and reused, like the job runners do
+  script_hash = scriptHash( script )
+  return Runner( getAST( script, script_hash ), script_hash )
+
+
+def _runToEnd( script ):
+  runner = _runner( script )
+  runner.run( ttl=1000000 )
+  assert runner.done
+  return runner
+
+
+def _paused( script ):  # a runner waiting in the delay
+  runner = _runner( script )
+  runner.run( ttl=1000000 )
+  assert not runner.done
+  return runner
+
+
+def benchParse( result_map, repeat ):
+  for line_count in LINE_COUNT_LIST:
+    script = makeScript( line_count )
+    ast = parse( script )
+    number = max( 1, 1000 // line_count )  # the small ones are too quick to time once
+    result_map[ 'parse {0} lines'.format( line_count ) ] = [
+                                                              bench( 'parse', lambda: parse( script ), repeat=repeat, number=number ),
+                                                              bench( 'compile', lambda: compileAST( ast ), repeat=repeat, number=number )
+                                                            ]
+
+
+def benchRun( result_map, repeat ):
+  for loop_count in LOOP_COUNT_LIST:
+    script = loopScript( loop_count )
+    result_map[ 'run loop {0}'.format( loop_count ) ] = [ bench( 'run', lambda: _runToEnd( script ), repeat=repeat ) ]
+
+  for depth in DEPTH_LIST:
+    script = nestedScript( depth, loopScript( 100 ) )
+    runner = _paused( nestedScript( depth, 'delay( seconds=300 )' ) )
+    result_map[ 'nested {0} deep'.format( depth ) ] = [
+                                                        bench( 'run', lambda: _runToEnd( script ), repeat=repeat, number=10 ),
+                                                        bench( 'status', lambda: runner.status, repeat=repeat, number=1000 )
+                                                      ]
+
+
+def benchPickle( result_map, repeat ):
+  for variable_count in VARIABLE_COUNT_LIST:
+    runner = _paused( variableScript( variable_count ) )
+    buff = pickle.dumps( runner )
+    number = max( 1, 1000 // variable_count )
+    result_map[ 'pickle {0} variables'.format( variable_count ) ] = [
+                                                                      bench( 'dumps', lambda: pickle.dumps( runner ), repeat=repeat, number=number ),
+                                                                      bench( 'loads', lambda: pickle.loads( buff ), repeat=repeat, number=number ),
+                                                                      bench( 'status', lambda: runner.status, repeat=repeat, number=1000 )
+                                                                    ]
+
+
+def main():
+  argparser = argparse.ArgumentParser( description='tscript parse, run, status and pickle benchmarks' )
+  argparser.add_argument( '-o', '--output', help='save the results to this json file' )
+  argparser.add_argument( '-b', '--baseline', help='json file from a previous --output to compare against' )
+  argparser.add_argument( '-t', '--threshold', help='how many times slower than the baseline is a regression (default: 1.25)', type=float, default=1.25 )
+  argparser.add_argument( '-r', '--repeat', help='number of times to run each benchmark, the best time is used (default: 5)', type=int, default=5 )
+  argparser.add_argument( '-p', '--parser', help='parser to use (default: descent)', choices=[ 'descent', 'peg' ], default='descent' )
+  args = argparser.parse_args()
+
+  if args.parser == 'descent':
+    parser.registerParser( DescentParser )
+
+  clearCache()
+  result_map = {}
+  benchParse( result_map, args.repeat )
+  benchRun( result_map, args.repeat )
+  benchPickle( result_map, args.repeat )
+
+  for ( title, result_list ) in result_map.items():
+    report( title, result_list )
+
+  if args.output:
+    save( args.output, result_map )
+
+  if args.baseline:
+    regression_list = compare( load( args.baseline ), result_map, args.threshold )
+    for ( title, name, baseline_time, elapsed ) in regression_list:
+      print( 'REGRESSION {0}, {1}: {2:.3f} ms -> {3:.3f} ms'.format( title, name, baseline_time * 1000, elapsed * 1000 ) )
+
+    if regression_list:
+      sys.exit( 1 )
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import os
+
+os.environ.setdefault( 'DJANGO_SETTINGS_MODULE', 'contractor.settings' )
+
+import django
+django.setup()
+
+import sys
+import time
+import signal
+import logging
+import argparse
+
+from django.db import transaction, close_old_connections
+
+from contractor.Site.models import Site
+from contractor.Foreman.lib import scheduleJobs
+
+# runs the jobs continuously, independent of subcontractor's polling, and
+# queues up the tasks for subcontractor.  Set FOREMAN_SCHEDULER = True in the
+# settings when this is running, so Dispatch.getJobs only hands out the tasks.
+
+running = True
+
+
+def _stop( signum, frame ):
+  global running
+
+  running = False
+
+
+def runOnce( logger ):
+  close_old_connections()  # long running, make sure we notice a dead/restarted database
+
+  count = 0
+  for site in Site.objects.filter( basejob__isnull=False ).distinct():
+    try:
+      with transaction.atomic():
+        count += scheduleJobs( site )
+
+    except Exception:
+      logger.exception( 'Error scheduling jobs for site "{0}"'.format( site.pk ) )
+
+  return count
+
+
+def main():
+  parser = argparse.ArgumentParser( description='Contractor Job Scheduler' )
+  parser.add_argument( '-i', '--interval', help='minimum seconds between passes over the jobs (default: 1.0)', type=float, default=1.0 )
+  parser.add_argument( '-d', '--debug', help='debug logging', action='store_true' )
+  args = parser.parse_args()
+
+  logging.basicConfig()
+  logger = logging.getLogger()
+  if args.debug:
+    logger.setLevel( logging.DEBUG )
+  else:
+    logger.setLevel( logging.INFO )
+
+  signal.signal( signal.SIGTERM, _stop )
+  signal.signal( signal.SIGINT, _stop )
+
+  logger.info( 'Starting up...' )
+  while running:
+    start = time.time()
+    count = runOnce( logger )
+    if count:
+      logger.debug( 'Queued {0} tasks'.format( count ) )
+
+    delay = args.interval - ( time.time() - start )
+    if delay > 0 and running:
+      time.sleep( delay )
+
+  logger.info( 'Shutting Down...' )
+  logger.info( 'Done!' )
+  logging.shutdown()
+  sys.exit( 0 )
+
+
+if __name__ == '__main__':
+  main()